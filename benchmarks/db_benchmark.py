@@ -0,0 +1,500 @@
+"""
+times every public Interface method in src/database against synthetic
+databases of several sizes and writes the results as json, so runs from
+different commits can be compared:
+
+    python -m benchmarks.db_benchmark --scales small,medium --output new.json
+    python -m benchmarks.db_benchmark --compare old.json new.json
+"""
+
+import argparse
+import inspect
+import io
+import json
+import pathlib
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable
+from sqlalchemy import func, select
+from src.database import common, instrumentation
+from src.database.syfit import Syfit
+from benchmarks import synthetic
+
+SCALES = {
+    "small": {"users": 5, "years": 1},
+    "medium": {"users": 20, "years": 3},
+    "large": {"users": 100, "years": 5},
+}
+
+INTERFACES = [
+    "user",
+    "measurement",
+    "routine",
+    "routine_day",
+    "routine_exercise",
+    "workout_session",
+    "exercise_log",
+    "exercise",
+]
+
+
+class Context:
+    """
+    picks the rows each benchmark call works on. reads and history-dependent
+    writes use random generated rows; adds and deletes work on scratch rows so
+    the dataset keeps its shape between repetitions.
+    """
+
+    def __init__(self, db: Syfit, seed: int = 0):
+        self.db = db
+        self.rng = random.Random(seed)
+        self.counter = 0
+        self.user_id = self.scratch_user()
+        self.routine_id = self.scratch_routine()
+        self.day_id = self.scratch_day()
+
+    def unique(self, prefix: str) -> str:
+        self.counter += 1
+        return f"{prefix}{self.counter}"
+
+    def random_row(self, model: type[common.Base]) -> common.Base:
+        session = self.db.Session()
+        count = session.query(func.count(model.id)).scalar()
+        row = (
+            session.query(model)
+            .order_by(model.id)
+            .offset(self.rng.randrange(count))
+            .first()
+        )
+        session.close()
+        return row
+
+    def random_id(self, model: type[common.Base]) -> int:
+        return self.random_row(model).id
+
+    def scratch_user(self) -> int:
+        user = common.User(
+            first_name="Bench",
+            last_name="User",
+            username=self.unique("bench"),
+            email=f"{self.unique('bench')}@syfit.test",
+            password=synthetic.password_hash(),
+            DOB=datetime(1990, 1, 1).date(),
+            measurement_system="metric",
+        )
+        return self.db.user.add_user(user).id
+
+    def scratch_routine(self) -> int:
+        return self.db.routine.add_routine(self.user_id, "BENCH", 4, False).id
+
+    def scratch_day(self) -> int:
+        return self.db.routine_day.add_routine_day(self.routine_id, "BENCH", "sun").id
+
+    def scratch_routine_exercise(self) -> int:
+        exercise_id = self.random_id(common.Exercise)
+        return self.db.routine_exercise.add_routine_exercise(
+            self.day_id, exercise_id
+        ).id
+
+    def scratch_measurement(self) -> int:
+        return self.db.measurement.add_measurement(
+            self.user_id, None, body_weight=self.rng.uniform(50, 100)
+        ).id
+
+    def scratch_exercise(self) -> int:
+        return self.db.exercise.add_exercise(
+            self.unique("bench exercise "), "bench.test", "core", None, "reps"
+        ).id
+
+    def new_user(self) -> common.User:
+        return common.User(
+            first_name="Bench",
+            last_name="Signup",
+            username=self.unique("signup"),
+            email=f"{self.unique('signup')}@syfit.test",
+            password="benchpassword",
+            DOB=datetime(1990, 1, 1).date(),
+            measurement_system="imperial",
+        )
+
+
+Case = Callable[[Context], tuple[tuple, dict]]
+
+
+def workout(ctx: Context) -> tuple[tuple, dict]:
+    # a 25 set session spread over the exercises of one routine day
+    day_id = ctx.random_row(common.RoutineExercise).day_id
+    routine_exercise_ids = [
+        e.id for e in ctx.db.routine_exercise.get_exercises_by_routine_day_id(day_id)
+    ]
+    time_stamp = datetime.utcnow()
+    logs = []
+    for n in range(25):
+        time_stamp += timedelta(minutes=2)
+        logs.append(
+            {
+                "routine_exercise_id": routine_exercise_ids[
+                    n % len(routine_exercise_ids)
+                ],
+                "time_stamp": time_stamp,
+                "num_reps": ctx.rng.randrange(5, 13),
+            }
+        )
+    return (logs,), {}
+
+
+def adopt_public_routine(ctx: Context) -> tuple[tuple, dict]:
+    session = ctx.db.Session()
+    public_ids = session.scalars(
+        select(common.Routine.id).where(common.Routine.is_public)
+    ).all()
+    session.close()
+    routine_id = ctx.rng.choice(public_ids) if public_ids else ctx.routine_id
+    return (routine_id, ctx.user_id), {}
+
+
+def weigh_ins(ctx: Context) -> tuple[tuple, dict]:
+    # a year of a smart scale's csv export, partly overlapping earlier runs
+    start = datetime(2000, 1, 1, 7) + timedelta(days=ctx.rng.randrange(3650))
+    lines = ["Date,Weight (kg)"]
+    for day in range(365):
+        weigh_in = start + timedelta(days=day)
+        lines.append(f"{weigh_in.isoformat()},{ctx.rng.uniform(50, 100):.1f}")
+    return (ctx.user_id, io.BytesIO("\n".join(lines).encode())), {}
+
+
+def no_args(ctx: Context) -> tuple[tuple, dict]:
+    return (), {}
+
+
+def by_id(model: type[common.Base]) -> Case:
+    return lambda ctx: ((ctx.random_id(model),), {})
+
+
+def by_user(ctx: Context) -> tuple[tuple, dict]:
+    return (ctx.random_id(common.User),), {}
+
+
+def scratch_history(ctx: Context) -> tuple[tuple, dict]:
+    for _ in range(30):
+        ctx.scratch_measurement()
+    return (ctx.user_id,), {}
+
+
+CASES: dict[str, Case | None] = {
+    "user.add_user": lambda ctx: ((ctx.new_user(),), {}),
+    "user.get_all_users": no_args,
+    "user.get_user_by_id": by_user,
+    "user.get_user_by_username": lambda ctx: (
+        (ctx.random_row(common.User).username,),
+        {},
+    ),
+    "user.delete_user": lambda ctx: ((ctx.db.user.add_user(ctx.new_user()).id,), {}),
+    "user.set_user_for_deletion": lambda ctx: ((ctx.user_id,), {}),
+    "user.change_username_by_id": lambda ctx: (
+        (ctx.user_id, ctx.unique("renamed")),
+        {},
+    ),
+    "measurement.add_measurement": lambda ctx: (
+        (ctx.random_id(common.User), None),
+        {"body_weight": ctx.rng.uniform(50, 100)},
+    ),
+    "measurement.get_measurement_by_measurements": lambda ctx: (
+        (ctx.random_id(common.User),),
+        {"body_weight": ctx.random_row(common.Measurement).body_weight},
+    ),
+    "measurement.get_measurement_by_id": by_id(common.Measurement),
+    "measurement.get_all_measurement_by_user": by_user,
+    "measurement.get_all_measurements_by_user_by_date": lambda ctx: (
+        (
+            ctx.random_id(common.User),
+            datetime.utcnow() - timedelta(days=90),
+            datetime.utcnow(),
+        ),
+        {},
+    ),
+    "measurement.get_measurement_buckets": lambda ctx: (
+        (ctx.random_id(common.User), datetime.utcnow() - timedelta(days=365)),
+        {"period": "week", "max_points": 26},
+    ),
+    "measurement.get_latest_measurement_by_user": by_user,
+    "measurement.edit_measurement": lambda ctx: (
+        (ctx.random_id(common.Measurement),),
+        {"body_weight": ctx.rng.uniform(50, 100)},
+    ),
+    "measurement.import_measurements": weigh_ins,
+    "measurement.change_measurement_system": lambda ctx: (
+        (ctx.random_id(common.User),),
+        {},
+    ),
+    "measurement.delete_measurement": lambda ctx: ((ctx.scratch_measurement(),), {}),
+    "measurement.delete_all_measurements_by_user": scratch_history,
+    "routine.add_routine": lambda ctx: ((ctx.user_id, "BENCH", 4, False), {}),
+    "routine.get_all_user_routines": by_user,
+    "routine.get_routine_by_id": by_id(common.Routine),
+    "routine.edit_routine": lambda ctx: (
+        (ctx.routine_id,),
+        {"routine_name": ctx.unique("BENCH ")[:20]},
+    ),
+    "routine.get_current_routine": by_user,
+    "routine.get_routine_tree": by_id(common.Routine),
+    "routine.get_today": by_user,
+    "routine.clone_routine": adopt_public_routine,
+    "routine.make_routine_not_current": lambda ctx: ((ctx.routine_id,), {}),
+    "routine.make_routine_current": by_id(common.Routine),
+    "routine.delete_routine": lambda ctx: ((ctx.scratch_routine(),), {}),
+    "routine_day.add_routine_day": lambda ctx: ((ctx.routine_id, "BENCH", "sun"), {}),
+    "routine_day.get_days_by_routine_id": by_id(common.Routine),
+    "routine_day.get_routine_day_by_id": by_id(common.RoutineDay),
+    "routine_day.get_routine_day_by_idx": lambda ctx: (
+        (ctx.random_id(common.Routine), 1),
+        {},
+    ),
+    "routine_day.edit_routine_day": lambda ctx: (
+        (ctx.day_id,),
+        {"routine_day_name": ctx.unique("D")[:10]},
+    ),
+    "routine_day.move_day": lambda ctx: ((ctx.day_id,), {}),
+    "routine_day.move_day_to_idx": lambda ctx: ((ctx.day_id, 0), {}),
+    "routine_day.reset_day_idxs": by_id(common.Routine),
+    "routine_day.delete_day_by_id": lambda ctx: ((ctx.scratch_day(),), {}),
+    "routine_day.delete_days_by_routine_id": lambda ctx: (
+        (ctx.scratch_routine(),),
+        {},
+    ),
+    "routine_exercise.add_routine_exercise": lambda ctx: (
+        (ctx.day_id, ctx.random_id(common.Exercise)),
+        {},
+    ),
+    "routine_exercise.get_exercises_by_routine_day_id": by_id(common.RoutineDay),
+    "routine_exercise.get_routine_exercise_by_id": by_id(common.RoutineExercise),
+    "routine_exercise.get_routine_exercise_by_idx": lambda ctx: (
+        (ctx.random_id(common.RoutineDay), 2),
+        {},
+    ),
+    "routine_exercise.edit_routine_exercise": lambda ctx: (
+        (ctx.scratch_routine_exercise(),),
+        {"num_sets": 4},
+    ),
+    "routine_exercise.move_exercise": lambda ctx: (
+        (ctx.scratch_routine_exercise(),),
+        {},
+    ),
+    "routine_exercise.move_exercise_to_idx": lambda ctx: (
+        (ctx.scratch_routine_exercise(), 0),
+        {},
+    ),
+    "routine_exercise.reset_exercise_idxs": by_id(common.RoutineDay),
+    "routine_exercise.delete_exercise_by_id": lambda ctx: (
+        (ctx.scratch_routine_exercise(),),
+        {},
+    ),
+    "routine_exercise.delete_exercises_by_day_id": lambda ctx: (
+        (ctx.scratch_day(),),
+        {},
+    ),
+    "workout_session.get_workout_session_by_id": by_id(common.WorkoutSession),
+    "workout_session.get_workout_sessions_by_user": lambda ctx: (
+        (ctx.random_id(common.User), datetime.utcnow() - timedelta(days=30)),
+        {},
+    ),
+    "workout_session.get_exercise_logs_by_workout_session": by_id(
+        common.WorkoutSession
+    ),
+    "exercise_log.add_log": lambda ctx: (
+        (ctx.random_id(common.RoutineExercise), datetime.utcnow(), 10),
+        {},
+    ),
+    "exercise_log.add_logs": workout,
+    "exercise_log.get_exercise_logs_by_routine_exercise_id": by_id(
+        common.RoutineExercise
+    ),
+    "exercise_log.get_exercise_log_by_id": by_id(common.ExerciseLog),
+    "exercise_log.get_exercise_log_by_set": lambda ctx: (
+        (ctx.random_id(common.RoutineExercise), 1),
+        {},
+    ),
+    "exercise_log.get_exercise_logs_by_user": by_user,
+    "exercise_log.get_exercise_logs_by_routine_exercise": by_id(common.RoutineExercise),
+    "exercise_log.get_exercise_logs_by_routine_day": by_id(common.RoutineDay),
+    "exercise_log.get_exercise_logs_by_routine": by_id(common.Routine),
+    "exercise_log.edit_exercise_log": lambda ctx: (
+        (ctx.random_id(common.ExerciseLog),),
+        {"num_reps": ctx.rng.randrange(5, 13)},
+    ),
+    "exercise_log.reset_set_idxs": by_id(common.RoutineExercise),
+    "exercise_log.delete_exercise_log_by_id": by_id(common.ExerciseLog),
+    "exercise_log.delete_exercises_by_routine_exercise_id": lambda ctx: (
+        (ctx.scratch_routine_exercise(),),
+        {},
+    ),
+    "exercise.add_exercise": lambda ctx: (
+        (ctx.unique("bench exercise "), "bench.test", "core", None, "reps"),
+        {},
+    ),
+    "exercise.get_exercise_by_id": by_id(common.Exercise),
+    "exercise.get_exercise_by_name": lambda ctx: (
+        (ctx.random_row(common.Exercise).exercise_name,),
+        {},
+    ),
+    "exercise.get_exercises_by_body_part": lambda ctx: (("chest",), {}),
+    "exercise.get_exercises_match_string": lambda ctx: (("exercise 1",), {}),
+    "exercise.get_user_created_exercises": by_user,
+    "exercise.edit_exercise": lambda ctx: (
+        (ctx.scratch_exercise(),),
+        {"reference_link": "edited.test"},
+    ),
+    "exercise.delete_exercise": lambda ctx: ((ctx.scratch_exercise(),), {}),
+}
+
+
+def public_methods(db: Syfit) -> dict[str, Callable]:
+    """every public method defined by each Interface (not inherited ones)"""
+    methods = {}
+    for name in INTERFACES:
+        interface = getattr(db, name)
+        for method, attr in vars(type(interface)).items():
+            if inspect.isfunction(attr) and not method.startswith("_"):
+                methods[f"{name}.{method}"] = getattr(interface, method)
+    return methods
+
+
+def summarize(durations: list[float], statements: list[int]) -> dict[str, Any]:
+    durations = sorted(durations)
+    return {
+        "runs": len(durations),
+        "min_ms": round(durations[0], 3),
+        "median_ms": round(statistics.median(durations), 3),
+        "mean_ms": round(statistics.mean(durations), 3),
+        "p95_ms": round(durations[int(0.95 * (len(durations) - 1))], 3),
+        "max_ms": round(durations[-1], 3),
+        "statements": statistics.median(statements),
+    }
+
+
+def benchmark_scale(
+    db: Syfit, repeat: int, seed: int, only: list[str] | None = None
+) -> dict[str, Any]:
+    ctx = Context(db, seed)
+    results = {}
+    for name, method in public_methods(db).items():
+        if only and not any(name.startswith(o) for o in only):
+            continue
+        case = CASES.get(name, "missing")
+        if case == "missing":
+            results[name] = {"skipped": "no benchmark case"}
+            continue
+        elif case is None:
+            results[name] = {"skipped": "not called directly"}
+            continue
+
+        durations, statements = [], []
+        for _ in range(repeat):
+            args, kwargs = case(ctx)
+            with instrumentation.track(f"benchmark {name}") as stats:
+                start = time.perf_counter()
+                method(*args, **kwargs)
+                durations.append((time.perf_counter() - start) * 1000)
+            statements.append(stats.count)
+        results[name] = summarize(durations, statements)
+
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(
+    scales: list[str],
+    repeat: int = 5,
+    seed: int = 0,
+    workdir: str | None = None,
+    only: list[str] | None = None,
+) -> dict[str, Any]:
+    workdir = pathlib.Path(workdir or tempfile.mkdtemp(prefix="syfit_bench_"))
+    results = {
+        "commit": git_commit(),
+        "created": datetime.utcnow().isoformat(),
+        "repeat": repeat,
+        "seed": seed,
+        "scales": {},
+    }
+    for scale in scales:
+        db = Syfit(f"sqlite:///{workdir / f'bench_{scale}.db'}", reset_db=True)
+        start = time.perf_counter()
+        rows = synthetic.generate(db, seed=seed, **SCALES[scale])
+        results["scales"][scale] = {
+            "parameters": SCALES[scale],
+            "generate_s": round(time.perf_counter() - start, 3),
+            "rows": rows,
+            "methods": benchmark_scale(db, repeat, seed, only),
+        }
+        print(f"{scale}: {rows['exercise_log']} exercise logs", file=sys.stderr)
+
+    return results
+
+
+def compare(old: dict[str, Any], new: dict[str, Any]) -> list[str]:
+    lines = [f"{'scale':8} {'method':60} {'old ms':>10} {'new ms':>10} {'ratio':>7}"]
+    for scale, new_scale in new["scales"].items():
+        old_methods = old["scales"].get(scale, {}).get("methods", {})
+        for name, new_result in new_scale["methods"].items():
+            old_result = old_methods.get(name, {})
+            if "median_ms" not in new_result or "median_ms" not in old_result:
+                continue
+            old_ms, new_ms = old_result["median_ms"], new_result["median_ms"]
+            ratio = new_ms / old_ms if old_ms else float("inf")
+            lines.append(
+                f"{scale:8} {name:60} {old_ms:10.3f} {new_ms:10.3f} {ratio:7.2f}"
+            )
+    return lines
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scales", default="small", help=f"any of {list(SCALES)}")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="directory for the generated databases")
+    parser.add_argument("--only", help="comma separated method name prefixes")
+    parser.add_argument("--output", help="json file to write, stdout if omitted")
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files"
+    )
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        old, new = [json.loads(pathlib.Path(p).read_text()) for p in args.compare]
+        print("\n".join(compare(old, new)))
+        return
+
+    results = run(
+        args.scales.split(","),
+        args.repeat,
+        args.seed,
+        args.workdir,
+        args.only.split(",") if args.only else None,
+    )
+    output = json.dumps(results, indent=2)
+    if args.output:
+        pathlib.Path(args.output).write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
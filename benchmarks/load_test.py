@@ -0,0 +1,359 @@
+"""
+http load test for src.api.main:app. starts uvicorn against a synthetic
+database (or targets a running server with --url), drives the request mix
+of a scenario file with concurrent virtual users and reports latency
+percentiles, throughput and error rates per route:
+
+    python -m benchmarks.load_test benchmarks/scenarios/mixed.json
+"""
+
+import argparse
+import asyncio
+import configparser
+import json
+import os
+import pathlib
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any
+import httpx
+from sqlalchemy import func, select
+from src import config
+from src.database import common
+from src.database.syfit import Syfit
+from benchmarks import synthetic
+
+
+class Scenario:
+    def __init__(
+        self,
+        name: str,
+        requests: list[dict[str, Any]],
+        concurrency: int = 8,
+        duration_s: float = 30,
+        max_requests: int | None = None,
+        virtual_users: int = 20,
+        dataset: dict[str, Any] | None = None,
+    ):
+        self.name = name
+        self.requests = requests
+        self.weights = [r.get("weight", 1) for r in requests]
+        self.concurrency = concurrency
+        self.duration_s = duration_s
+        self.max_requests = max_requests
+        self.virtual_users = virtual_users
+        self.dataset = dataset or {}
+
+    @classmethod
+    def load(cls, path: str | pathlib.Path) -> "Scenario":
+        return cls(**json.loads(pathlib.Path(path).read_text()))
+
+
+class VirtualUser:
+    def __init__(self, user_id: int, username: str, measurement_ids: tuple[int, int]):
+        self.user_id = user_id
+        self.username = username
+        self.password = synthetic.PASSWORD
+        self.measurement_ids = measurement_ids
+        self.token: str | None = None
+
+
+class Variables(dict):
+    """
+    values for {placeholders} in scenario requests. {unique} is a fresh
+    counter on every use and {days_ago_N} a YYYYMMDD date N days back.
+    """
+
+    counter = 0
+
+    def __init__(self, user: VirtualUser, rng: random.Random):
+        super().__init__(
+            user_id=user.user_id,
+            username=user.username,
+            password=user.password,
+            measurement_id=rng.randint(*user.measurement_ids),
+            today=datetime.utcnow().strftime("%Y%m%d"),
+        )
+
+    def __missing__(self, key: str) -> str:
+        if key == "unique":
+            Variables.counter += 1
+            return f"{os.getpid()}x{Variables.counter}"
+        elif key.startswith("days_ago_"):
+            days = int(key.removeprefix("days_ago_"))
+            return (datetime.utcnow() - timedelta(days=days)).strftime("%Y%m%d")
+        raise KeyError(key)
+
+
+def render(value: Any, variables: Variables) -> Any:
+    if isinstance(value, str):
+        return value.format_map(variables)
+    elif isinstance(value, dict):
+        return {k: render(v, variables) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [render(v, variables) for v in value]
+    return value
+
+
+class RouteStats:
+    def __init__(self):
+        self.latencies_ms: list[float] = []
+        self.statuses: Counter[str] = Counter()
+        self.errors = 0
+
+    def record(self, latency_ms: float, status: str, error: bool) -> None:
+        self.latencies_ms.append(latency_ms)
+        self.statuses[status] += 1
+        self.errors += error
+
+    def report(self, elapsed_s: float) -> dict[str, Any]:
+        latencies = sorted(self.latencies_ms)
+        return {
+            "requests": len(latencies),
+            "errors": self.errors,
+            "error_rate": round(self.errors / len(latencies), 4) if latencies else 0,
+            "throughput_rps": round(len(latencies) / elapsed_s, 2),
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "max_ms": round(latencies[-1], 2) if latencies else None,
+            "statuses": dict(self.statuses),
+        }
+
+
+def percentile(sorted_values: list[float], p: float) -> float | None:
+    """nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(0, int(round(p / 100 * len(sorted_values))) - 1)
+    return round(sorted_values[min(rank, len(sorted_values) - 1)], 2)
+
+
+def load_virtual_users(db: Syfit, count: int, seed: int = 0) -> list[VirtualUser]:
+    """picks synthetic users (the ones with the known password) from db"""
+    query = (
+        select(
+            common.User.id,
+            common.User.username,
+            func.min(common.Measurement.id),
+            func.max(common.Measurement.id),
+        )
+        .join(common.Measurement, common.Measurement.user_id == common.User.id)
+        .where(common.User.username.like("synthetic%"))
+        .group_by(common.User.id)
+    )
+    with db.engine.connect() as connection:
+        rows = connection.execute(query).all()
+
+    if not rows:
+        raise ValueError("database has no synthetic users, generate one first")
+    rows = random.Random(seed).sample(rows, min(count, len(rows)))
+    return [VirtualUser(r[0], r[1], (r[2], r[3])) for r in rows]
+
+
+def api_headers(user: VirtualUser | None = None) -> dict[str, str]:
+    headers = {"api_key": config.config["API"]["API_KEY"]}
+    if user is not None and user.token is not None:
+        headers["Authorization"] = f"Bearer {user.token}"
+    return headers
+
+
+async def login(client: httpx.AsyncClient, user: VirtualUser) -> None:
+    response = await client.post(
+        "/users/token/",
+        data={"username": user.username, "password": user.password},
+        headers=api_headers(),
+    )
+    response.raise_for_status()
+    user.token = response.json()["access_token"]
+
+
+async def send(
+    client: httpx.AsyncClient,
+    request: dict[str, Any],
+    user: VirtualUser,
+    rng: random.Random,
+) -> httpx.Response:
+    variables = Variables(user, rng)
+    return await client.request(
+        request.get("method", "GET"),
+        render(request["path"], variables),
+        params=render(request.get("params"), variables),
+        data=render(request.get("form"), variables),
+        json=render(request.get("json"), variables),
+        headers=api_headers(user if request.get("auth") else None),
+    )
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    scenario: Scenario,
+    users: list[VirtualUser],
+    seed: int = 0,
+) -> dict[str, Any]:
+    # logins happen before the clock starts; the mix measures steady state
+    await asyncio.gather(*(login(client, u) for u in users))
+
+    stats = {r["name"]: RouteStats() for r in scenario.requests}
+    sent = 0
+    start = time.perf_counter()
+    deadline = start + scenario.duration_s
+
+    async def worker(n: int) -> None:
+        nonlocal sent
+        rng = random.Random(seed * 1000 + n)
+        while time.perf_counter() < deadline:
+            if scenario.max_requests is not None and sent >= scenario.max_requests:
+                return
+            sent += 1
+            request = rng.choices(scenario.requests, scenario.weights)[0]
+            request_start = time.perf_counter()
+            try:
+                response = await send(client, request, rng.choice(users), rng)
+                status, error = str(response.status_code), response.is_error
+            except httpx.HTTPError as e:
+                status, error = type(e).__name__, True
+            latency_ms = (time.perf_counter() - request_start) * 1000
+            stats[request["name"]].record(latency_ms, status, error)
+
+    await asyncio.gather(*(worker(n) for n in range(scenario.concurrency)))
+    elapsed_s = time.perf_counter() - start
+
+    total = RouteStats()
+    for route in stats.values():
+        total.latencies_ms.extend(route.latencies_ms)
+        total.statuses.update(route.statuses)
+        total.errors += route.errors
+
+    return {
+        "scenario": scenario.name,
+        "concurrency": scenario.concurrency,
+        "elapsed_s": round(elapsed_s, 3),
+        "routes": {name: s.report(elapsed_s) for name, s in stats.items()},
+        "total": total.report(elapsed_s),
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(
+    conn_string: str, port: int, workers: int, workdir: pathlib.Path
+) -> subprocess.Popen:
+    """runs uvicorn with a copy of the app config pointing at conn_string"""
+    server_config = configparser.ConfigParser()
+    server_config.read_dict(config.config)
+    server_config["DATABASE"]["CONN_STRING"] = conn_string
+    config_path = workdir / "load_test.conf"
+    with open(config_path, "w") as f:
+        server_config.write(f)
+
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "src.api.main:app",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+        ],
+        env={**os.environ, "SYFIT_CONFIG": str(config_path)},
+    )
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/docs", timeout=1)
+            return server
+        except httpx.HTTPError:
+            if server.poll() is not None:
+                raise RuntimeError("uvicorn exited during startup")
+            time.sleep(0.2)
+
+    server.terminate()
+    raise RuntimeError("uvicorn did not start within 30 seconds")
+
+
+def format_report(report: dict[str, Any]) -> str:
+    lines = [
+        f"{report['scenario']}: {report['total']['requests']} requests in "
+        f"{report['elapsed_s']}s with concurrency {report['concurrency']}",
+        f"{'route':40} {'reqs':>7} {'rps':>8} {'err %':>6} "
+        f"{'p50':>8} {'p95':>8} {'p99':>8}",
+    ]
+    for name, r in [*report["routes"].items(), ("TOTAL", report["total"])]:
+        if not r["requests"]:
+            continue
+        lines.append(
+            f"{name:40} {r['requests']:7} {r['throughput_rps']:8.1f} "
+            f"{100 * r['error_rate']:6.2f} {r['p50_ms']:8.1f} {r['p95_ms']:8.1f} "
+            f"{r['p99_ms']:8.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("scenario", help="scenario json file")
+    parser.add_argument("--url", help="target a running server instead")
+    parser.add_argument("--database", help="existing synthetic sqlite database")
+    parser.add_argument("--concurrency", type=int, help="overrides the scenario")
+    parser.add_argument("--duration", type=float, help="seconds, overrides scenario")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="json report file")
+    args = parser.parse_args(argv)
+
+    scenario = Scenario.load(args.scenario)
+    if args.concurrency:
+        scenario.concurrency = args.concurrency
+    if args.duration:
+        scenario.duration_s = args.duration
+
+    workdir = pathlib.Path(tempfile.mkdtemp(prefix="syfit_load_"))
+    database = args.database or workdir / "load_test.db"
+    conn_string = f"sqlite:///{pathlib.Path(database).absolute()}"
+    db = Syfit(conn_string, reset_db=args.database is None)
+    if args.database is None:
+        synthetic.generate(db, seed=args.seed, **scenario.dataset)
+    users = load_virtual_users(db, scenario.virtual_users, args.seed)
+
+    server = None
+    url = args.url
+    if url is None:
+        port = free_port()
+        server = start_server(conn_string, port, args.workers, workdir)
+        url = f"http://127.0.0.1:{port}"
+
+    async def drive() -> dict[str, Any]:
+        limits = httpx.Limits(max_connections=scenario.concurrency)
+        async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as c:
+            return await run_scenario(c, scenario, users, args.seed)
+
+    try:
+        report = asyncio.run(drive())
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print(format_report(report))
+    if args.output:
+        pathlib.Path(args.output).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
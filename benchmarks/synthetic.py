@@ -0,0 +1,236 @@
+"""
+deterministic synthetic data for benchmarks and load tests. the same seed and
+parameters always produce the same rows (relative to end_time), written with
+batched core inserts so large datasets build in seconds.
+"""
+
+import random
+from datetime import datetime, timedelta
+from passlib.context import CryptContext
+from sqlalchemy import func, insert, select
+from src.database import common, constraints, ordering
+from src.database.syfit import Syfit
+
+# every generated user can log in with this password
+PASSWORD = "syntheticpassword"
+
+BATCH_SIZE = 10000
+
+WEEKLY_SCHEDULES = {
+    2: ["mon", "thu"],
+    3: ["mon", "wed", "fri"],
+    4: ["mon", "tue", "thu", "fri"],
+    5: ["mon", "tue", "wed", "fri", "sat"],
+    6: ["mon", "tue", "wed", "thu", "fri", "sat"],
+}
+
+
+def password_hash() -> str:
+    return CryptContext(schemes=["bcrypt"], deprecated="auto").hash(PASSWORD)
+
+
+class Generator:
+    def __init__(
+        self,
+        db: Syfit,
+        users: int = 10,
+        routines_per_user: int = 3,
+        days_per_routine: int = 4,
+        exercises_per_day: int = 5,
+        sets_per_exercise: int = 3,
+        years: float = 1,
+        num_exercises: int = 60,
+        seed: int = 0,
+        end_time: datetime | None = None,
+    ):
+        if days_per_routine not in WEEKLY_SCHEDULES:
+            raise ValueError(
+                f"days_per_routine must be one of {list(WEEKLY_SCHEDULES)}"
+            )
+
+        self.db = db
+        self.users = users
+        self.routines_per_user = routines_per_user
+        self.days_per_routine = days_per_routine
+        self.exercises_per_day = exercises_per_day
+        self.sets_per_exercise = sets_per_exercise
+        self.days = int(years * 365)
+        self.num_exercises = num_exercises
+        self.rng = random.Random(seed)
+        if end_time is None:
+            end_time = datetime.utcnow().replace(
+                hour=0, minute=0, second=0, microsecond=0
+            )
+        self.end_time = end_time
+        self.start_time = end_time - timedelta(days=self.days)
+        self.rows: dict[type[common.Base], list[dict]] = {}
+        self.next_ids: dict[type[common.Base], int] = {}
+
+    def next_id(self, model: type[common.Base]) -> int:
+        # ids are assigned here so child rows can reference them before insert
+        if model not in self.next_ids:
+            with self.db.engine.connect() as connection:
+                max_id = connection.execute(select(func.max(model.id))).scalar()
+            self.next_ids[model] = (max_id or 0) + 1
+
+        self.next_ids[model] += 1
+        return self.next_ids[model] - 1
+
+    def add(self, model: type[common.Base], id: int | None = None, **values) -> int:
+        values["id"] = self.next_id(model) if id is None else id
+        self.rows.setdefault(model, []).append(values)
+        if len(self.rows[model]) >= BATCH_SIZE:
+            self.flush_all()
+        return values["id"]
+
+    def flush_all(self) -> None:
+        # parents before children so foreign keys always resolve
+        models = {model.__table__: model for model in self.rows}
+        with self.db.engine.begin() as connection:
+            for table in common.Base.metadata.sorted_tables:
+                if table in models:
+                    connection.execute(insert(table), self.rows.pop(models[table]))
+
+    def generate(self) -> dict[str, int]:
+        """inserts the dataset and returns the number of rows per table"""
+        body_parts = [b.value for b in constraints.BodyPartCheck]
+        exercise_ids = []
+        for _ in range(self.num_exercises):
+            exercise_id = self.next_id(common.Exercise)
+            exercise_ids.append(exercise_id)
+            self.add(
+                common.Exercise,
+                id=exercise_id,
+                exercise_name=f"synthetic exercise {exercise_id}",
+                reference_link="synthetic.test",
+                body_part=self.rng.choice(body_parts),
+                secondary_body_part=self.rng.choice(body_parts),
+                rep_type="reps",
+            )
+
+        hashed_password = password_hash()
+        for _ in range(self.users):
+            self.generate_user(exercise_ids, hashed_password)
+
+        self.flush_all()
+
+        with self.db.engine.connect() as connection:
+            return {
+                table.name: connection.execute(
+                    select(func.count()).select_from(table)
+                ).scalar()
+                for table in common.Base.metadata.sorted_tables
+            }
+
+    def generate_user(self, exercise_ids: list[int], hashed_password: str) -> None:
+        user_id = self.next_id(common.User)
+        measurement_system = self.rng.choice(["metric", "imperial"])
+        self.add(
+            common.User,
+            id=user_id,
+            first_name="Synthetic",
+            last_name=f"User{user_id}",
+            username=f"synthetic{user_id}",
+            email=f"synthetic{user_id}@syfit.test",
+            password=hashed_password,
+            DOB=datetime(1990, 1, 1).date(),
+            last_updated_username=self.start_time,
+            measurement_system=measurement_system,
+        )
+
+        current_routine = self.rng.randrange(self.routines_per_user)
+        schedules = {}
+        for r in range(self.routines_per_user):
+            routine_id = self.add(
+                common.Routine,
+                routine_name=f"ROUTINE {r}",
+                user_id=user_id,
+                num_days=self.days_per_routine,
+                is_current=r == current_routine,
+                is_public=self.rng.random() < 0.1,
+            )
+            schedule = {}
+            for day_idx, day_of_week in enumerate(
+                WEEKLY_SCHEDULES[self.days_per_routine]
+            ):
+                day_id = self.add(
+                    common.RoutineDay,
+                    routine_id=routine_id,
+                    sort_key=day_idx * ordering.STEP,
+                    routine_day_name=f"DAY {day_idx}",
+                    day_of_week=day_of_week,
+                )
+                schedule[day_of_week] = [
+                    self.add(
+                        common.RoutineExercise,
+                        exercise_id=exercise_id,
+                        day_id=day_id,
+                        sort_key=exercise_idx * ordering.STEP,
+                        num_sets=self.sets_per_exercise,
+                        default_reps=10,
+                    )
+                    for exercise_idx, exercise_id in enumerate(
+                        self.rng.sample(exercise_ids, self.exercises_per_day)
+                    )
+                ]
+            schedules[r] = schedule
+
+        self.generate_history(user_id, schedules[current_routine])
+
+    def generate_history(self, user_id: int, schedule: dict[str, list[int]]) -> None:
+        # stored in canonical metric units, like add_measurement does
+        height = self.rng.uniform(150, 200)
+        body_weight = self.rng.uniform(55, 110)
+
+        for day in range(self.days):
+            date = self.start_time + timedelta(days=day)
+
+            body_weight += self.rng.gauss(0, 0.3)
+            weigh_in = date + timedelta(hours=7, minutes=self.rng.randrange(60))
+            self.add(
+                common.Measurement,
+                measurement_time=weigh_in,
+                user_id=user_id,
+                height=round(height, 1),
+                body_weight=round(body_weight, 1),
+            )
+
+            day_of_week = date.strftime("%a").lower()
+            if day_of_week not in schedule or self.rng.random() < 0.15:
+                continue
+
+            time_stamp = date + timedelta(hours=self.rng.randrange(6, 21))
+            sets = []
+            for routine_exercise_id in schedule[day_of_week]:
+                for set_idx in range(self.sets_per_exercise):
+                    time_stamp += timedelta(seconds=self.rng.randrange(60, 240))
+                    sets.append(
+                        {
+                            "routine_exercise_id": routine_exercise_id,
+                            "time_stamp": time_stamp,
+                            "set_idx": set_idx,
+                            "num_reps": self.rng.randrange(5, 13),
+                        }
+                    )
+
+            # one workout session per training day, added before its sets
+            workout_session_id = self.add(
+                common.WorkoutSession,
+                user_id=user_id,
+                start_time=sets[0]["time_stamp"],
+                end_time=sets[-1]["time_stamp"],
+                num_sets=len(sets),
+                total_reps=sum(s["num_reps"] for s in sets),
+                total_duration=0,
+            )
+            for values in sets:
+                self.add(
+                    common.ExerciseLog,
+                    workout_session_id=workout_session_id,
+                    user_id=user_id,
+                    **values,
+                )
+
+
+def generate(db: Syfit, **kwargs) -> dict[str, int]:
+    return Generator(db, **kwargs).generate()
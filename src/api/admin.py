@@ -0,0 +1,21 @@
+from fastapi import APIRouter, Depends
+from src.database import instrumentation
+from src.database.syfit import AsyncSyfit, get_async_db
+from src.api import auth
+
+router = APIRouter(dependencies=[Depends(auth.validate_admin_key)])
+
+
+@router.get("/admin/db/stats")
+async def get_db_stats():
+    return instrumentation.snapshot()
+
+
+@router.delete("/admin/db/stats")
+async def reset_db_stats():
+    instrumentation.reset()
+
+
+@router.get("/admin/db/settings")
+async def get_db_settings(db: AsyncSyfit = Depends(get_async_db, scope="function")):
+    return db.sync.get_tuning_settings()
@@ -5,7 +5,7 @@ from fastapi.security import OAuth2PasswordBearer, api_key
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel
-from src.database.syfit import Syfit, get_db
+from src.database.syfit import AsyncSyfit, get_async_db
 from src import config
 
 api_key_header = api_key.APIKeyHeader(name="api_key")
@@ -21,6 +21,13 @@ async def validate_api_key(key: str = Security(api_key_header)):
         raise HTTPException(status_code=403, detail="Unauthorized.")
 
 
+async def validate_admin_key(key: str = Security(admin_key_header)):
+    if key == config.config["API"]["ADMIN_KEY"]:
+        return admin_key_header
+    else:
+        raise HTTPException(status_code=403, detail="Unauthorized.")
+
+
 credentials_exception = HTTPException(
     status_code=status.HTTP_401_UNAUTHORIZED,
     detail="Could not validate credentials",
@@ -58,8 +65,12 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
-def authenticate_user(username: str, password: str, db: Syfit = Depends(get_db)):
-    user = db.user.get_user_by_username(username)
+async def authenticate_user(
+    username: str,
+    password: str,
+    db: AsyncSyfit = Depends(get_async_db, scope="function"),
+):
+    user = await db.user.get_user_by_username(username)
     if not user:
         return False
     if not verify_password(password, user.password):
@@ -0,0 +1,160 @@
+import base64
+from datetime import datetime, timezone
+from typing import Annotated
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.security import OAuth2PasswordBearer
+from pydantic import BaseModel, ConfigDict
+from src.database.syfit import AsyncSyfit, get_async_db
+from src.database import instrumentation
+from src.api import auth
+
+
+class RequestLog(BaseModel):
+    routine_exercise_id: int
+    time_stamp: datetime
+    num_reps: int | None = None
+    time_duration: float | None = None
+
+
+class RequestLogs(BaseModel):
+    logs: list[RequestLog]
+
+
+class ResponseLog(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    routine_exercise_id: int
+    time_stamp: datetime
+    set_idx: int | None
+    num_reps: int | None
+    time_duration: float | None
+    workout_session_id: int | None
+
+
+class LogPage(BaseModel):
+    logs: list[ResponseLog]
+    next_cursor: str | None
+
+
+router = APIRouter(dependencies=[Depends(auth.validate_api_key)])
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+
+
+@router.post("/exercise_log/bulk")
+@instrumentation.StatementBudget(7)
+async def add_logs(
+    request_logs: RequestLogs,
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSyfit = Depends(get_async_db, scope="function"),
+):
+    token_data = auth.get_token_data(token)
+    logs = []
+    for log in request_logs.logs:
+        if log.time_stamp.tzinfo is not None:
+            # time stamps are stored as naive utc
+            log.time_stamp = log.time_stamp.astimezone(timezone.utc).replace(
+                tzinfo=None
+            )
+        logs.append(log.model_dump())
+    ids = await db.exercise_log.add_logs(logs, user_id=token_data.id)
+    if isinstance(ids, dict):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail=ids.get("message")
+        )
+    return {"ids": ids}
+
+
+def encode_cursor(log) -> str:
+    key = f"{log.time_stamp.isoformat()}|{log.id}"
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        time_stamp, id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(time_stamp), int(id)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor."
+        )
+
+
+class PageParams:
+    def __init__(
+        self,
+        start_time: str | None = None,
+        end_time: str | None = None,
+        cursor: str | None = None,
+        limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+    ):
+        self.start_time = start_time and datetime.strptime(start_time, "%Y%m%d")
+        self.end_time = end_time and datetime.strptime(end_time, "%Y%m%d")
+        self.after = cursor and decode_cursor(cursor)
+        self.limit = limit
+
+    def kwargs(self) -> dict:
+        # one extra row tells whether there is a next page
+        return {
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "after": self.after,
+            "limit": self.limit + 1,
+        }
+
+    def page(self, logs: list) -> LogPage:
+        next_cursor = None
+        if len(logs) > self.limit:
+            logs = logs[: self.limit]
+            next_cursor = encode_cursor(logs[-1])
+        return LogPage(
+            logs=[ResponseLog.model_validate(log) for log in logs],
+            next_cursor=next_cursor,
+        )
+
+
+@router.get("/exercise_log/user/{user_id}")
+@instrumentation.StatementBudget(1)
+async def get_logs_by_user(
+    user_id: int,
+    params: PageParams = Depends(),
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSyfit = Depends(get_async_db, scope="function"),
+) -> LogPage:
+    token_data = auth.get_token_data(token)
+    if user_id != token_data.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized."
+        )
+    logs = await db.exercise_log.get_exercise_logs_by_user(user_id, **params.kwargs())
+    return params.page(logs)
+
+
+@router.get("/exercise_log/routine/{routine_id}")
+@instrumentation.StatementBudget(1)
+async def get_logs_by_routine(
+    routine_id: int,
+    params: PageParams = Depends(),
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSyfit = Depends(get_async_db, scope="function"),
+) -> LogPage:
+    token_data = auth.get_token_data(token)
+    logs = await db.exercise_log.get_exercise_logs_by_routine(
+        routine_id, user_id=token_data.id, **params.kwargs()
+    )
+    return params.page(logs)
+
+
+@router.get("/exercise_log/routine_day/{routine_day_id}")
+@instrumentation.StatementBudget(1)
+async def get_logs_by_routine_day(
+    routine_day_id: int,
+    params: PageParams = Depends(),
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSyfit = Depends(get_async_db, scope="function"),
+) -> LogPage:
+    token_data = auth.get_token_data(token)
+    logs = await db.exercise_log.get_exercise_logs_by_routine_day(
+        routine_day_id, user_id=token_data.id, **params.kwargs()
+    )
+    return params.page(logs)
@@ -0,0 +1,41 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy.ext.asyncio import AsyncEngine
+from src.database.syfit import get_async_engine
+from src.database import export
+from src.api import auth
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+router = APIRouter(dependencies=[Depends(auth.validate_api_key)])
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+
+
+@router.get("/export/user/{user_id}")
+async def export_user(
+    user_id: int,
+    format: str = "ndjson",
+    table: list[str] = Query(default=list(export.QUERIES)),
+    gzip: bool = False,
+    token: str = Depends(oauth2_scheme),
+    engine: AsyncEngine = Depends(get_async_engine),
+):
+    token_data = auth.get_token_data(token)
+    if user_id != token_data.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized."
+        )
+    try:
+        export.check_tables(table, format)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    # the stream reads each page on a connection of its own, so the export
+    # needs no unit of work and holds no lock between pages
+    filename = f"syfit_user_{user_id}.{format}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        export.export_async(engine, user_id, table, format, gzip),
+        media_type="application/gzip" if gzip else MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
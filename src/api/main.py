@@ -1,8 +1,51 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from src.api import user, measurement
+from starlette.types import ASGIApp, Receive, Scope, Send
+from src.api import admin, exercise_log, export, routine, user, measurement
+from src.database import common, instrumentation
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    common.dispose_engines()
+    await common.dispose_async_engines()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Include routes from other modules
 app.include_router(user.router)
 app.include_router(measurement.router)
+app.include_router(routine.router)
+app.include_router(exercise_log.router)
+app.include_router(export.router)
+app.include_router(admin.router)
+
+
+class TrackStatements:
+    """
+    collects each request's statements. a plain asgi middleware, so the stats
+    are recorded once the whole request has run, including the unit of work
+    commit in the dependency teardown
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with instrumentation.track(f"{scope['method']} {scope['path']}") as stats:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                # group by route template rather than by concrete path
+                route = scope.get("route")
+                if route is not None:
+                    stats.name = f"{scope['method']} {route.path}"
+
+
+app.add_middleware(TrackStatements)
@@ -1,62 +1,162 @@
-from fastapi import APIRouter, Depends, Request
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    UploadFile,
+    status,
+)
+from fastapi.responses import StreamingResponse
+from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy.engine import Engine
+from starlette.concurrency import iterate_in_threadpool
 import json
-from src.database.syfit import Syfit, get_db
+from typing import Literal
+from src.database.syfit import AsyncSyfit, get_async_db, get_engine
+from src.database import importer, instrumentation
+from src.api import auth
 from datetime import datetime
 
 router = APIRouter()
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
 @router.get("/measurement/user/{user_id}")
-async def get(user_id: int, db: Syfit = Depends(get_db)):
-    return db.measurement.get_all_measurement_by_user(user_id)
+@instrumentation.StatementBudget(1)
+async def get(user_id: int, db: AsyncSyfit = Depends(get_async_db, scope="function")):
+    return await db.measurement.get_all_measurement_by_user(user_id)
 
 
 @router.get("/measurement/user/{user_id}/latest")
-async def get_latest_measurement_by_user(user_id: int, db: Syfit = Depends(get_db)):
-    return db.measurement.get_latest_measurement_by_user(user_id)
+@instrumentation.StatementBudget(1)
+async def get_latest_measurement_by_user(
+    user_id: int, db: AsyncSyfit = Depends(get_async_db, scope="function")
+):
+    return await db.measurement.get_latest_measurement_by_user(user_id)
 
 
 @router.get("/measurement/{measurement_id}")
-async def get_measurement_by_id(measurement_id: int, db: Syfit = Depends(get_db)):
-    return db.measurement.get_measurement_by_id(measurement_id)
+@instrumentation.StatementBudget(1)
+async def get_measurement_by_id(
+    measurement_id: int, db: AsyncSyfit = Depends(get_async_db, scope="function")
+):
+    return await db.measurement.get_measurement_by_id(measurement_id)
 
 
 @router.get("/measurement/user/{user_id}/time")
+@instrumentation.StatementBudget(1)
 async def get_measurements_by_date(
     user_id: int,
     start_time: str,
     end_time: str = datetime.utcnow(),
-    db: Syfit = Depends(get_db),
+    db: AsyncSyfit = Depends(get_async_db, scope="function"),
 ):
     start_time = datetime.strptime(start_time, "%Y%m%d")
     if not isinstance(end_time, datetime):
         end_time = datetime.strptime(end_time, "%Y%m%d")
-    return db.measurement.get_all_measurements_by_user_by_date(
+    return await db.measurement.get_all_measurements_by_user_by_date(
         user_id, start_time, end_time
     )
 
 
+@router.get("/measurement/user/{user_id}/buckets")
+@instrumentation.StatementBudget(1)
+async def get_measurement_buckets(
+    user_id: int,
+    start_time: str,
+    end_time: str | None = None,
+    period: Literal["day", "week", "month"] = "day",
+    max_points: int | None = Query(None, ge=1),
+    db: AsyncSyfit = Depends(get_async_db, scope="function"),
+):
+    start_time = datetime.strptime(start_time, "%Y%m%d")
+    if end_time is not None:
+        end_time = datetime.strptime(end_time, "%Y%m%d")
+    return await db.measurement.get_measurement_buckets(
+        user_id, start_time, end_time, period, max_points
+    )
+
+
+@router.post(
+    "/measurement/user/{user_id}/import",
+    dependencies=[Depends(auth.validate_api_key)],
+)
+async def import_measurements(
+    user_id: int,
+    file: UploadFile,
+    format: Literal["csv", "ndjson", "json"] | None = None,
+    measurement_system: Literal["metric", "imperial"] | None = None,
+    token: str = Depends(oauth2_scheme),
+    engine: Engine = Depends(get_engine),
+):
+    """
+    streams the running totals as ndjson, a line per batch written. the last
+    line holds the final totals, or an error if the file turned out bad after
+    the first batch
+    """
+    token_data = auth.get_token_data(token)
+    if user_id != token_data.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized."
+        )
+    if format is None:
+        format = (file.filename or "").rsplit(".", 1)[-1].lower()
+    if format not in importer.FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"format must be one of {importer.FORMATS}",
+        )
+
+    # no unit of work: every batch commits on the importer's own session, and
+    # the file is read, parsed and written in the threadpool, off the loop
+    progress = iterate_in_threadpool(
+        importer.run(engine, user_id, file.file, format, measurement_system)
+    )
+    try:
+        first = await anext(progress)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    async def lines():
+        yield json.dumps(first) + "\n"
+        try:
+            async for totals in progress:
+                yield json.dumps(totals) + "\n"
+        except ValueError as e:
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
 @router.put("/measurement/{measurement_id}/edit")
+@instrumentation.StatementBudget(2)
 async def edit_measurement(
-    measurement_id: int, request: Request, db: Syfit = Depends(get_db)
+    measurement_id: int,
+    request: Request,
+    db: AsyncSyfit = Depends(get_async_db, scope="function"),
 ):
     kwargs = json.loads((await request.body()).decode())
-    return db.measurement.edit_measurement(measurement_id, **kwargs)
+    return await db.measurement.edit_measurement(measurement_id, **kwargs)
 
 
 @router.put("/measurement/user/{user_id}/change_measurement_system")
+@instrumentation.StatementBudget(2)
 async def change_measurement_system(
-    user_id: int, request: Request, db: Syfit = Depends(get_db)
+    user_id: int, db: AsyncSyfit = Depends(get_async_db, scope="function")
 ):
-    change_values = json.loads((await request.body()).decode())["change_values"]
-    db.measurement.change_measurement_system(user_id, change_values)
+    await db.measurement.change_measurement_system(user_id)
 
 
 @router.delete("/measurement/{measurement_id}/delete")
-async def delete_measurement(measurement_id: int, db: Syfit = Depends(get_db)):
-    db.measurement.delete_measurement(measurement_id)
+async def delete_measurement(
+    measurement_id: int, db: AsyncSyfit = Depends(get_async_db, scope="function")
+):
+    await db.measurement.delete_measurement(measurement_id)
 
 
 @router.delete("/measurement/user/{user_id}/delete")
-async def delete_measurements_for_user(user_id: int, db: Syfit = Depends(get_db)):
-    db.measurement.delete_all_measurements_by_user(user_id)
+async def delete_measurements_for_user(
+    user_id: int, db: AsyncSyfit = Depends(get_async_db, scope="function")
+):
+    await db.measurement.delete_all_measurements_by_user(user_id)
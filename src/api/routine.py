@@ -0,0 +1,152 @@
+from datetime import date, datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.security import OAuth2PasswordBearer
+from pydantic import BaseModel, ConfigDict
+from src.database.syfit import AsyncSyfit, get_async_db
+from src.database import instrumentation
+from src.api import auth
+from src.api.exercise_log import ResponseLog
+
+
+class TreeNode(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+
+class ResponseWarmUpSet(TreeNode):
+    set_idx: int
+    num_reps: int | None
+    time_duration: float | None
+    working_percentage: float | None
+
+
+class ResponseWarmUp(TreeNode):
+    id: int
+    num_sets: int | None
+    default_reps: int | None
+    default_time: float | None
+    sets: list[ResponseWarmUpSet]
+
+
+class ResponseExercise(TreeNode):
+    id: int
+    exercise_name: str
+    body_part: str | None
+    secondary_body_part: str | None
+    rep_type: str | None
+    reference_link: str | None
+
+
+class ResponseRoutineExercise(TreeNode):
+    id: int
+    exercise_idx: int
+    num_sets: int | None
+    default_reps: int | None
+    default_time: float | None
+    exercise: ResponseExercise
+    warmup: ResponseWarmUp | None
+
+
+class ResponseRoutineDay(TreeNode):
+    id: int
+    day_idx: int
+    routine_day_name: str | None
+    day_of_week: str | None
+    exercises: list[ResponseRoutineExercise]
+
+
+class ResponseRoutineTree(TreeNode):
+    id: int
+    routine_name: str
+    user_id: int | None
+    num_days: int | None
+    is_current: bool | None
+    is_public: bool | None
+    days: list[ResponseRoutineDay]
+
+
+class ResponseTodayRoutine(TreeNode):
+    id: int
+    routine_name: str
+
+
+class ResponseTodayExercise(TreeNode):
+    id: int
+    exercise_idx: int
+    num_sets: int | None
+    default_reps: int | None
+    default_time: float | None
+    exercise: ResponseExercise
+    last_sets: list[ResponseLog]
+
+
+class ResponseTodayDay(TreeNode):
+    id: int
+    day_idx: int
+    routine_day_name: str | None
+    exercises: list[ResponseTodayExercise]
+
+
+class ResponseToday(TreeNode):
+    date: date
+    day_of_week: str
+    routine: ResponseTodayRoutine | None
+    days: list[ResponseTodayDay]
+
+
+router = APIRouter(dependencies=[Depends(auth.validate_api_key)])
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+
+
+@router.get("/routine/today")
+@instrumentation.StatementBudget(4)
+async def get_today(
+    tz: str = "UTC",
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSyfit = Depends(get_async_db, scope="function"),
+) -> ResponseToday:
+    """today is the date in tz, the user's IANA time zone, e.g. Europe/Berlin"""
+    token_data = auth.get_token_data(token)
+    try:
+        day = datetime.now(ZoneInfo(tz)).date()
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=f"unknown time zone {tz}"
+        )
+    return ResponseToday.model_validate(await db.routine.get_today(token_data.id, day))
+
+
+@router.get("/routine/{routine_id}/tree")
+@instrumentation.StatementBudget(4)
+async def get_routine_tree(
+    routine_id: int,
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSyfit = Depends(get_async_db, scope="function"),
+) -> ResponseRoutineTree:
+    token_data = auth.get_token_data(token)
+    routine = await db.routine.get_routine_tree(routine_id)
+    if routine is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Routine not found."
+        )
+    if routine.user_id != token_data.id and not routine.is_public:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized."
+        )
+    return ResponseRoutineTree.model_validate(routine)
+
+
+@router.post("/routine/{routine_id}/clone")
+@instrumentation.StatementBudget(8)
+async def clone_routine(
+    routine_id: int,
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSyfit = Depends(get_async_db, scope="function"),
+):
+    token_data = auth.get_token_data(token)
+    routine = await db.routine.clone_routine(routine_id, token_data.id)
+    if isinstance(routine, dict):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail=routine.get("message")
+        )
+    return {"id": routine.id}
@@ -5,8 +5,9 @@ from datetime import datetime, timedelta
 from fastapi import APIRouter, Depends, Request, HTTPException, status, Form
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from passlib.context import CryptContext
-from src.database.syfit import get_db, Syfit
+from src.database.syfit import get_async_db, AsyncSyfit
 from src.database.common import User
+from src.database import instrumentation
 from src import config
 from src.api import auth
 
@@ -29,21 +30,26 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
 @router.get("/users/")
-async def read_users(token: str = Depends(oauth2_scheme), db: Syfit = Depends(get_db)):
+async def read_users(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSyfit = Depends(get_async_db, scope="function"),
+):
     token_data = auth.get_token_data(token)
     if token_data.username != "admin":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized."
         )
-    return db.user.get_all_users()
+    return await db.user.get_all_users()
 
 
 @router.get("/users/me/")
+@instrumentation.StatementBudget(1)
 async def get_current_user(
-    token: str = Depends(oauth2_scheme), db: Syfit = Depends(get_db)
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSyfit = Depends(get_async_db, scope="function"),
 ):
     token_data = auth.get_token_data(token)
-    user = db.user.get_user_by_id(token_data.id)
+    user = await db.user.get_user_by_id(token_data.id)
 
     if user is None:
         raise auth.credentials_exception
@@ -53,11 +59,14 @@ async def get_current_user(
 
 
 @router.get("/users/id/{user_id}")
+@instrumentation.StatementBudget(1)
 async def get_user_by_id(
-    user_id: int, token: str = Depends(oauth2_scheme), db: Syfit = Depends(get_db)
+    user_id: int,
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSyfit = Depends(get_async_db, scope="function"),
 ):
     token_data = auth.get_token_data(token)
-    user = db.user.get_user_by_id(user_id)
+    user = await db.user.get_user_by_id(user_id)
 
     if user is None:
         raise auth.credentials_exception
@@ -69,12 +78,15 @@ async def get_user_by_id(
 
 
 @router.get("/users/username/{username}")
+@instrumentation.StatementBudget(1)
 async def get_user_by_username(
-    username: str, token: str = Depends(oauth2_scheme), db: Syfit = Depends(get_db)
+    username: str,
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSyfit = Depends(get_async_db, scope="function"),
 ) -> RequestUser | None:
     token_data = auth.get_token_data(token)
-    user = db.user.get_user_by_username(username)
-    
+    user = await db.user.get_user_by_username(username)
+
     if user is None:
         raise auth.credentials_exception
     elif user.username != token_data.username:
@@ -85,6 +97,8 @@ async def get_user_by_username(
 
 
 @router.post("/users/signup/")
+# the insert runs in a savepoint, so a taken username keeps the rest of the request
+@instrumentation.StatementBudget(5)
 async def signup(
     first_name: Annotated[str, Form()],
     last_name: Annotated[str, Form()],
@@ -93,7 +107,7 @@ async def signup(
     email: Annotated[str, Form()],
     DOB: Annotated[str, Form()],
     measurement_system: Annotated[str, Form()],
-    db: Syfit = Depends(get_db),
+    db: AsyncSyfit = Depends(get_async_db, scope="function"),
 ):
     user = User(
         first_name=first_name,
@@ -107,7 +121,7 @@ async def signup(
     str_password = user.password
     user.password = password_context.hash(user.password)
     user.DOB = datetime.strptime(user.DOB, "%m/%d/%Y").date()
-    user = db.user.add_user(user)
+    user = await db.user.add_user(user)
     if isinstance(user, dict):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT, detail=user.get("message")
@@ -115,12 +129,14 @@ async def signup(
     data = OAuth2PasswordRequestForm(username=user.username, password=str_password)
     return await login_for_access_token(form_data=data, db=db)
 
+
 @router.post("/users/token/")
+@instrumentation.StatementBudget(1)
 async def login_for_access_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-    db: Syfit = Depends(get_db),
+    db: AsyncSyfit = Depends(get_async_db, scope="function"),
 ) -> auth.Token:
-    user = auth.authenticate_user(form_data.username, form_data.password, db)
+    user = await auth.authenticate_user(form_data.username, form_data.password, db)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -142,7 +158,7 @@ async def change_username_by_id(
     user_id: int,
     request: Request,
     token: str = Depends(oauth2_scheme),
-    db: Syfit = Depends(get_db),
+    db: AsyncSyfit = Depends(get_async_db, scope="function"),
 ):
     token_data = auth.get_token_data(token)
     if user_id != token_data.id:
@@ -150,12 +166,14 @@ async def change_username_by_id(
             status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized."
         )
     username = json.loads((await request.body()).decode())["username"]
-    return db.user.change_username_by_id(user_id, username)
+    return await db.user.change_username_by_id(user_id, username)
 
 
 @router.delete("/users/id/{user_id}/delete")
 async def delete_username(
-    user_id: int, token: str = Depends(oauth2_scheme), db: Syfit = Depends(get_db)
+    user_id: int,
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSyfit = Depends(get_async_db, scope="function"),
 ):
     token_data = auth.get_token_data(token)
     if user_id != token_data.id:
@@ -1,6 +1,10 @@
 import configparser
+import os
 import pathlib
 
-config_path = pathlib.Path(__file__).parent.absolute() / "app.local.conf"
+# SYFIT_CONFIG points the app at another config file, e.g. for load tests
+config_path = os.environ.get(
+    "SYFIT_CONFIG", pathlib.Path(__file__).parent.absolute() / "app.local.conf"
+)
 config = configparser.ConfigParser()
 config.read(config_path)
@@ -1,6 +1,9 @@
+import inspect
 import os
+import threading
 from sqlalchemy import (
     create_engine,
+    make_url,
     Column,
     Integer,
     Float,
@@ -12,10 +15,28 @@ from sqlalchemy import (
     DATE,
     Enum,
     CheckConstraint,
+    Index,
+    func,
+    select,
+    text,
+    tuple_,
+)
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.orm import (
+    Session,
+    aliased,
+    column_property,
+    declarative_base,
+    relationship,
+    sessionmaker,
+    validates,
 )
-from sqlalchemy.orm import sessionmaker, declarative_base, validates
 import src.database.constraints as constraints
+from src.database import instrumentation, today, tuning
 from src.database.utils import CountryCode
+from src import config
 
 Base = declarative_base()
 
@@ -40,6 +61,8 @@ class User(Base):
     measurement_system = Column(
         String(10), Enum(constraints.MeasurementSystemCheck, create_constraint=True)
     )
+    # bumped by every write to rows the user's today projection reads
+    today_version = Column(Integer, nullable=False, default=0, server_default="0")
 
     __table_args__ = (CheckConstraint("LENGTH(password) > 8", name="pwd_gt_8"),)
 
@@ -98,6 +121,10 @@ class Measurement(Base):
     height = Column(Float)
     body_weight = Column(Float)
 
+    __table_args__ = (
+        Index("ix_measurement_user_id_measurement_time", "user_id", "measurement_time"),
+    )
+
 
 class Routine(Base):
     __tablename__ = "routine"
@@ -109,18 +136,49 @@ class Routine(Base):
     is_current = Column(Boolean)
     is_public = Column(Boolean)
 
+    # the relationships of the routine tree are read-only; rows are still
+    # written through the interfaces
+    days = relationship(
+        "RoutineDay",
+        order_by="(RoutineDay.sort_key, RoutineDay.id)",
+        viewonly=True,
+    )
+
+    __table_args__ = (
+        Index("ix_routine_user_id", "user_id"),
+        # at most one current routine per user, and the lookup for it
+        Index(
+            "ix_routine_user_id_is_current",
+            "user_id",
+            unique=True,
+            sqlite_where=text("is_current"),
+            postgresql_where=text("is_current"),
+        ),
+    )
+
 
 class RoutineDay(Base):
     __tablename__ = "routine_day"
 
     id = Column(Integer, Sequence("routine_day_id_seq"), primary_key=True)
     routine_id = Column(Integer, ForeignKey("routine.id"), nullable=False)
-    day_idx = Column(Integer)
+    # sparse ordering key, day_idx (the dense position) is derived from it
+    sort_key = Column(Integer, nullable=False, default=0)
     routine_day_name = Column(String(10))
     day_of_week = Column(
         String(3), Enum(constraints.DayOfWeekCheck, create_constraint=True)
     )
 
+    exercises = relationship(
+        "RoutineExercise",
+        order_by="(RoutineExercise.sort_key, RoutineExercise.id)",
+        viewonly=True,
+    )
+
+    __table_args__ = (
+        Index("ix_routine_day_routine_id_sort_key", "routine_id", "sort_key"),
+    )
+
 
 class Exercise(Base):
     __tablename__ = "exercise"
@@ -146,6 +204,10 @@ class WarmUp(Base):
     default_reps = Column(Integer)
     default_time = Column(Float)
 
+    sets = relationship(
+        "WarmUpSet", order_by="(WarmUpSet.set_idx, WarmUpSet.id)", viewonly=True
+    )
+
 
 class WarmUpSet(Base):
     __tablename__ = "warmup_set"
@@ -164,12 +226,57 @@ class RoutineExercise(Base):
     id = Column(Integer, Sequence("routine_exercise_id_seq"), primary_key=True)
     exercise_id = Column(Integer, ForeignKey("exercise.id"), nullable=False)
     day_id = Column(Integer, ForeignKey("routine_day.id"), nullable=False)
-    exercise_idx = Column(Integer, nullable=False)
+    # sparse ordering key, exercise_idx (the dense position) is derived from it
+    sort_key = Column(Integer, nullable=False, default=0)
     num_sets = Column(Integer)
     default_reps = Column(Integer)
     default_time = Column(Float)
     warmup_schema = Column(Integer, ForeignKey("warmup.id"))
 
+    exercise = relationship("Exercise", viewonly=True)
+    warmup = relationship("WarmUp", viewonly=True)
+
+    __table_args__ = (
+        Index("ix_routine_exercise_day_id_sort_key", "day_id", "sort_key"),
+    )
+
+
+def dense_position(model: type[Base], parent: str):
+    """
+    0-based position of a row among the rows sharing its parent, in
+    (sort_key, id) order: one index range count per row read
+    """
+    sibling = aliased(model)
+    return column_property(
+        select(func.count())
+        .where(
+            getattr(sibling, parent) == getattr(model, parent),
+            tuple_(sibling.sort_key, sibling.id) < tuple_(model.sort_key, model.id),
+        )
+        .correlate_except(sibling)
+        .scalar_subquery()
+    )
+
+
+RoutineDay.day_idx = dense_position(RoutineDay, "routine_id")
+RoutineExercise.exercise_idx = dense_position(RoutineExercise, "day_id")
+
+
+class WorkoutSession(Base):
+    __tablename__ = "workout_session"
+
+    id = Column(Integer, Sequence("workout_session_id_seq"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("app_user.id"), nullable=False)
+    start_time = Column(TIMESTAMP, nullable=False)
+    end_time = Column(TIMESTAMP, nullable=False)
+    num_sets = Column(Integer, nullable=False, default=0)
+    total_reps = Column(Integer, nullable=False, default=0)
+    total_duration = Column(Float, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_workout_session_user_id_end_time", "user_id", "end_time"),
+    )
+
 
 class ExerciseLog(Base):
     __tablename__ = "exercise_log"
@@ -182,12 +289,192 @@ class ExerciseLog(Base):
     set_idx = Column(Integer)
     num_reps = Column(Integer)
     time_duration = Column(Float)
+    workout_session_id = Column(Integer, ForeignKey("workout_session.id"))
+    # the owner of the routine exercise, copied here so a user's history is
+    # one index range instead of a join through their routines
+    user_id = Column(Integer, ForeignKey("app_user.id"))
+
+    # covers the set index lookup in add_log as well as plain
+    # routine_exercise_id / time range scans. unique only rules out two sets of
+    # a routine exercise with the same set index at the exact same time stamp;
+    # set indexes within a workout's hour are kept apart by add_log
+    __table_args__ = (
+        Index(
+            "ix_exercise_log_routine_exercise_id_time_stamp",
+            "routine_exercise_id",
+            "time_stamp",
+            "set_idx",
+            unique=True,
+        ),
+        Index(
+            "ix_exercise_log_workout_session_id_time_stamp",
+            "workout_session_id",
+            "time_stamp",
+        ),
+        Index("ix_exercise_log_user_id_time_stamp", "user_id", "time_stamp", "id"),
+    )
+
+
+class SchemaVersion(Base):
+    __tablename__ = "schema_version"
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    description = Column(String(200), nullable=False)
+    applied_at = Column(TIMESTAMP, nullable=False)
+
+
+_engines: dict[str, Engine] = {}
+_sessionmakers: dict[str, sessionmaker] = {}
+_async_engines: dict[str, AsyncEngine] = {}
+_engines_lock = threading.Lock()
+
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite"}
+
+
+def _pool_options(connection_string: str) -> dict[str, int]:
+    url = make_url(connection_string)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # in-memory sqlite uses a SingletonThreadPool, which has no overflow
+        return {}
+
+    return {
+        "pool_size": config.config.getint("DATABASE", "POOL_SIZE", fallback=5),
+        "max_overflow": config.config.getint("DATABASE", "MAX_OVERFLOW", fallback=10),
+    }
+
+
+def get_engine(connection_string: str) -> Engine:
+    """
+    returns the engine for connection_string, creating it on first use. engines
+    (and their connection pools) are shared by every interface in the process.
+    """
+    with _engines_lock:
+        engine = _engines.get(connection_string)
+        if engine is None:
+            engine = create_engine(
+                connection_string, **_pool_options(connection_string)
+            )
+            if engine.url.get_backend_name() == "sqlite":
+                tuning.apply_settings(engine, tuning.get_settings())
+                tuning.nest_savepoints(engine)
+            instrumentation.instrument(engine)
+            _engines[connection_string] = engine
+            _sessionmakers[connection_string] = sessionmaker(bind=engine)
+
+    return engine
+
+
+def get_sessionmaker(connection_string: str) -> sessionmaker:
+    get_engine(connection_string)
+    return _sessionmakers[connection_string]
+
+
+def get_async_engine(connection_string: str) -> AsyncEngine:
+    """
+    async counterpart of get_engine. the connection string keeps its sync
+    driver in the config and is switched to the asyncio driver here.
+    """
+    with _engines_lock:
+        engine = _async_engines.get(connection_string)
+        if engine is None:
+            url = make_url(connection_string)
+            backend = url.get_backend_name()
+            if backend in ASYNC_DRIVERS:
+                url = url.set(drivername=ASYNC_DRIVERS[backend])
+            engine = create_async_engine(url, **_pool_options(connection_string))
+            if backend == "sqlite":
+                tuning.apply_settings(engine.sync_engine, tuning.get_settings())
+                tuning.nest_savepoints(engine.sync_engine)
+            instrumentation.instrument(engine.sync_engine)
+            _async_engines[connection_string] = engine
+
+    return engine
+
+
+def dispose_engines() -> None:
+    """closes every pooled connection, e.g. on app shutdown"""
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+        _sessionmakers.clear()
+
+
+def discard_async_engines(database: str) -> None:
+    """
+    drops the async engines for database from the registry. their connections
+    belong to whichever event loop opened them, so they are released when
+    garbage collected instead of being closed here.
+    """
+    with _engines_lock:
+        for connection_string, engine in list(_async_engines.items()):
+            if engine.url.database == database:
+                engine.sync_engine.dispose(close=False)
+                del _async_engines[connection_string]
+
+
+async def dispose_async_engines() -> None:
+    with _engines_lock:
+        engines = list(_async_engines.values())
+        _async_engines.clear()
+
+    for engine in engines:
+        await engine.dispose()
+
+
+class UnitOfWorkSession(Session):
+    """
+    session shared by every interface method inside Syfit.unit_of_work(). the
+    commit() and close() calls made by interface methods only flush, so the
+    whole unit of work is committed (or rolled back) once by finish().
+    expected errors have to be undone with begin_nested(): a rollback() throws
+    away the whole unit of work, so finish() refuses to commit after one.
+    """
+
+    rolled_back = False
+
+    def commit(self) -> None:
+        self.flush()
+
+    def rollback(self) -> None:
+        self.rolled_back = True
+        super().rollback()
+
+    def close(self) -> None:
+        transaction = self.get_transaction()
+        if transaction is not None and not transaction.is_active:
+            # a failed flush has to be rolled back before the session is reused
+            self.rollback()
+
+    def finish(self, commit: bool = True) -> None:
+        try:
+            if commit and self.rolled_back:
+                raise InvalidRequestError(
+                    "the unit of work was rolled back before it finished"
+                )
+            if commit:
+                with instrumentation.commit():
+                    super().commit()
+            else:
+                super().rollback()
+        finally:
+            super().close()
 
 
 class DatabaseInterface:
+    def __init_subclass__(cls, **kwargs):
+        # tag the statements each public method runs, e.g.
+        # exercise_log.Interface.add_log, for the per-request sql stats
+        super().__init_subclass__(**kwargs)
+        module = cls.__module__.rsplit(".", 1)[-1]
+        for name, attr in list(vars(cls).items()):
+            if inspect.isfunction(attr) and not name.startswith("_"):
+                method_name = f"{module}.{cls.__qualname__}.{name}"
+                setattr(cls, name, instrumentation.method(method_name)(attr))
+
     def __init__(self, connection_string: str, restart_db: bool = False):
-        self.engine = create_engine(connection_string)
-        self.Session = sessionmaker(bind=self.engine)
+        self.engine = get_engine(connection_string)
+        self.Session = get_sessionmaker(connection_string)
         if restart_db:
             self.restart_db()
 
@@ -195,13 +482,23 @@ class DatabaseInterface:
         Base.metadata.create_all(self.engine)
 
     def delete_db(self):
-        if os.path.isfile(self.engine.url.database):
-            os.remove(self.engine.url.database)
+        # pooled connections would otherwise keep pointing at the deleted file
+        self.engine.dispose()
+        discard_async_engines(self.engine.url.database)
+        # a leftover WAL would be replayed into the next database with this name
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.isfile(self.engine.url.database + suffix):
+                os.remove(self.engine.url.database + suffix)
 
     def restart_db(self):
         self.delete_db()
+        today.invalidate_database(self.engine)
         self.create_tables()
 
+    def get_tuning_settings(self) -> dict[str, dict]:
+        """configured and currently active sqlite pragmas, for diagnostics"""
+        return tuning.get_active_settings(self.engine)
+
     def initialize_country_code_table(self):
         pass
 
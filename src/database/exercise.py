@@ -1,6 +1,7 @@
 from src.database.common import DatabaseInterface, Exercise
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy import or_
+from src.database import today
 
 
 class Interface(DatabaseInterface):
@@ -24,9 +25,12 @@ class Interface(DatabaseInterface):
         )
 
         session = self.Session()
-        session.add(exercise)
 
         try:
+            # a savepoint, so a duplicate only undoes this insert
+            with session.begin_nested():
+                session.add(exercise)
+                session.flush()
             session.commit()
         except IntegrityError as e:
             session.close()
@@ -95,6 +99,7 @@ class Interface(DatabaseInterface):
         session.query(Exercise).filter(Exercise.id == exercise_id).update(
             exercise_update
         )
+        today.touch(session, ("exercise", exercise_id))
         session.commit()
 
         exercise = self.get_exercise_by_id(exercise_id)
@@ -109,6 +114,7 @@ class Interface(DatabaseInterface):
 
         if exercise:
             session.delete(exercise)
+            today.touch(session, ("exercise", exercise_id))
             session.commit()
 
         session.close()
@@ -1,10 +1,53 @@
 from datetime import datetime, timedelta
-from sqlalchemy import and_
-from src.database.common import ExerciseLog, Routine, RoutineDay, RoutineExercise
-from src.database import routine_exercise
+from sqlalchemy import and_, func, insert, select, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Query
+from src.database.common import (
+    ExerciseLog,
+    Routine,
+    RoutineDay,
+    RoutineExercise,
+    WorkoutSession,
+)
+from src.database import ordering, session_totals, today, tuning, workout_session
 
+SETS = ordering.OrderedCollection(
+    ExerciseLog,
+    ExerciseLog.routine_exercise_id,
+    ExerciseLog.set_idx,
+    step=1,
+    unique=True,
+)
 
-class Interface(routine_exercise.Interface):
+
+def paginate(
+    query: Query,
+    start_time: datetime = None,
+    end_time: datetime = None,
+    after: tuple[datetime, int] = None,
+    limit: int = None,
+) -> Query:
+    """
+    orders logs by (time_stamp, id) and restricts them to
+    start_time <= time_stamp < end_time. after is the (time_stamp, id) of the
+    last log of the previous page, so each page is an index range read instead
+    of an offset scan
+    """
+    if start_time is not None:
+        query = query.filter(ExerciseLog.time_stamp >= start_time)
+    if end_time is not None:
+        query = query.filter(ExerciseLog.time_stamp < end_time)
+    if after is not None:
+        query = query.filter(
+            tuple_(ExerciseLog.time_stamp, ExerciseLog.id) > tuple_(*after)
+        )
+    query = query.order_by(ExerciseLog.time_stamp, ExerciseLog.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+class Interface(workout_session.Interface):
     def add_log(
         self,
         routine_exercise_id: int,
@@ -12,34 +55,167 @@ class Interface(routine_exercise.Interface):
         num_reps: int = None,
         time_duration: float = None,
     ):
-        exercises = self.get_exercise_logs_by_routine_exercise_id(routine_exercise_id)
-        set_idxs = [
-            e.set_idx
-            for e in exercises
-            if e.time_stamp >= (time_stamp + timedelta(minutes=-60))
-            and e.time_stamp <= (time_stamp + timedelta(minutes=60))
-        ]
-
-        if len(set_idxs) == 0:
-            set_idx = 0
-        else:
-            set_idx = max(set_idxs) + 1
-        exercise = ExerciseLog(
-            routine_exercise_id=routine_exercise_id,
-            time_stamp=time_stamp,
-            set_idx=set_idx,
-            num_reps=num_reps,
-            time_duration=time_duration,
+        # the next set_idx is picked inside the insert itself, so the lookup uses
+        # the (routine_exercise_id, time_stamp, set_idx) index and two
+        # concurrent writers can't both read the same max
+        next_set_idx = (
+            select(func.coalesce(func.max(ExerciseLog.set_idx) + 1, 0))
+            .where(
+                ExerciseLog.routine_exercise_id == routine_exercise_id,
+                ExerciseLog.time_stamp.between(
+                    time_stamp - timedelta(minutes=60),
+                    time_stamp + timedelta(minutes=60),
+                ),
+            )
+            .scalar_subquery()
         )
 
         session = self.Session()
-        session.add(exercise)
+        # the owner of the routine exercise and the sessions the set joins
+        owners = session.execute(
+            select(Routine.user_id, WorkoutSession.id)
+            .select_from(RoutineExercise)
+            .join(RoutineDay)
+            .join(Routine)
+            .outerjoin(
+                WorkoutSession,
+                workout_session.overlapping(Routine.user_id, time_stamp, time_stamp),
+            )
+            .where(RoutineExercise.id == routine_exercise_id)
+            .order_by(WorkoutSession.end_time.desc())
+        ).all()
+        if len(owners) == 0:
+            session.close()
+            return {"message": f"routine exercise {routine_exercise_id} not found"}
+
+        user_id = owners[0].user_id
+        workout_session_id = workout_session.add_set(
+            session,
+            user_id,
+            [id for _, id in owners if id is not None],
+            time_stamp,
+            num_reps,
+            time_duration,
+        )
+        exercise = session.scalars(
+            insert(ExerciseLog)
+            .values(
+                routine_exercise_id=routine_exercise_id,
+                time_stamp=time_stamp,
+                set_idx=next_set_idx,
+                num_reps=num_reps,
+                time_duration=time_duration,
+                workout_session_id=workout_session_id,
+                user_id=user_id,
+            )
+            .returning(ExerciseLog)
+        ).one()
+        today.touch(session, ("routine_exercise", routine_exercise_id))
         session.commit()
         session.refresh(exercise)
         session.close()
 
         return exercise
 
+    def add_logs(self, logs: list[dict], user_id: int = None):
+        """
+        inserts a batch of sets (e.g. a whole workout uploaded at once) with one
+        multi-row insert and one commit and returns the new ids in input order.
+        set indexes are assigned like add_log does, in time_stamp order per
+        routine exercise. with user_id, every routine exercise has to belong to
+        that user
+        """
+        if len(logs) == 0:
+            return []
+
+        window = timedelta(minutes=60)
+        routine_exercise_ids = {log["routine_exercise_id"] for log in logs}
+        time_stamps = [log["time_stamp"] for log in logs]
+
+        session = self.Session()
+        user_ids = dict(
+            session.execute(
+                select(RoutineExercise.id, Routine.user_id)
+                .select_from(RoutineExercise)
+                .join(RoutineDay)
+                .join(Routine)
+                .where(RoutineExercise.id.in_(routine_exercise_ids))
+            ).all()
+        )
+        if len(user_ids) != len(routine_exercise_ids):
+            session.close()
+            return {"message": "routine exercise not found"}
+        if user_id is not None and set(user_ids.values()) != {user_id}:
+            session.close()
+            return {"message": "routine exercise does not belong to user"}
+
+        # set indexes are picked from the sets read below, so a concurrent upload
+        # must not write between the read and the insert
+        tuning.begin_write(session.connection())
+
+        # one indexed range read covers the set windows of the whole batch
+        existing = session.execute(
+            select(
+                ExerciseLog.routine_exercise_id,
+                ExerciseLog.time_stamp,
+                ExerciseLog.set_idx,
+            ).where(
+                ExerciseLog.routine_exercise_id.in_(routine_exercise_ids),
+                ExerciseLog.time_stamp.between(
+                    min(time_stamps) - window, max(time_stamps) + window
+                ),
+            )
+        ).all()
+        sets = {routine_exercise_id: [] for routine_exercise_id in routine_exercise_ids}
+        for routine_exercise_id, time_stamp, set_idx in existing:
+            sets[routine_exercise_id].append((time_stamp, set_idx))
+
+        # every row gets the same keys so the batch stays a single statement
+        rows = [
+            {
+                "routine_exercise_id": log["routine_exercise_id"],
+                "time_stamp": log["time_stamp"],
+                "num_reps": log.get("num_reps"),
+                "time_duration": log.get("time_duration"),
+                "user_id": user_ids[log["routine_exercise_id"]],
+            }
+            for log in logs
+        ]
+        for row in sorted(rows, key=lambda row: row["time_stamp"]):
+            nearby = sets[row["routine_exercise_id"]]
+            set_idxs = [
+                set_idx
+                for time_stamp, set_idx in nearby
+                if abs(time_stamp - row["time_stamp"]) <= window
+            ]
+            row["set_idx"] = max(set_idxs) + 1 if set_idxs else 0
+            nearby.append((row["time_stamp"], row["set_idx"]))
+        workout_session_ids = workout_session.add_sets(session, rows, user_ids)
+
+        # sqlite returns multi-row RETURNING in no particular order, so ids are
+        # matched back by (routine_exercise_id, time_stamp, set_idx), which a
+        # unique index keeps unique
+        inserted = session.execute(
+            insert(ExerciseLog).returning(
+                ExerciseLog.id,
+                ExerciseLog.routine_exercise_id,
+                ExerciseLog.time_stamp,
+                ExerciseLog.set_idx,
+            ),
+            rows,
+        ).all()
+        ids_by_set = {tuple(r[1:]): r[0] for r in inserted}
+        ids = [
+            ids_by_set[(r["routine_exercise_id"], r["time_stamp"], r["set_idx"])]
+            for r in rows
+        ]
+        session_totals.refresh(session, workout_session_ids, drop_empty=False)
+        today.touch(session, *(("routine_exercise", id) for id in routine_exercise_ids))
+        session.commit()
+        session.close()
+
+        return ids
+
     def get_exercise_logs_by_routine_exercise_id(self, routine_exercise_id: int):
         session = self.Session()
         exercises = (
@@ -74,16 +250,18 @@ class Interface(routine_exercise.Interface):
         session.close()
         return exercise_log
 
-    def get_exercise_logs_by_user(self, user_id: int):
+    def get_exercise_logs_by_user(
+        self,
+        user_id: int,
+        start_time: datetime = None,
+        end_time: datetime = None,
+        after: tuple[datetime, int] = None,
+        limit: int = None,
+    ):
         session = self.Session()
-        logs = (
-            session.query(ExerciseLog)
-            .join(RoutineExercise)
-            .join(RoutineDay)
-            .join(Routine)
-            .filter(Routine.user_id == user_id)
-            .all()
-        )
+        # a range of the (user_id, time_stamp, id) index, read in order
+        query = session.query(ExerciseLog).filter(ExerciseLog.user_id == user_id)
+        logs = paginate(query, start_time, end_time, after, limit).all()
         session.close()
         return logs
 
@@ -98,28 +276,48 @@ class Interface(routine_exercise.Interface):
         session.close()
         return logs
 
-    def get_exercise_logs_by_routine_day(self, routine_day_id: int):
+    def get_exercise_logs_by_routine_day(
+        self,
+        routine_day_id: int,
+        start_time: datetime = None,
+        end_time: datetime = None,
+        after: tuple[datetime, int] = None,
+        limit: int = None,
+        user_id: int = None,
+    ):
         session = self.Session()
-        logs = (
+        query = (
             session.query(ExerciseLog)
             .join(RoutineExercise)
             .join(RoutineDay)
             .filter(RoutineDay.id == routine_day_id)
-            .all()
         )
+        if user_id is not None:
+            query = query.join(Routine).filter(Routine.user_id == user_id)
+        logs = paginate(query, start_time, end_time, after, limit).all()
         session.close()
         return logs
 
-    def get_exercise_logs_by_routine(self, routine_id: int):
+    def get_exercise_logs_by_routine(
+        self,
+        routine_id: int,
+        start_time: datetime = None,
+        end_time: datetime = None,
+        after: tuple[datetime, int] = None,
+        limit: int = None,
+        user_id: int = None,
+    ):
         session = self.Session()
-        logs = (
+        query = (
             session.query(ExerciseLog)
             .join(RoutineExercise)
             .join(RoutineDay)
             .join(Routine)
             .filter(Routine.id == routine_id)
-            .all()
         )
+        if user_id is not None:
+            query = query.filter(Routine.user_id == user_id)
+        logs = paginate(query, start_time, end_time, after, limit).all()
         session.close()
         return logs
 
@@ -128,12 +326,52 @@ class Interface(routine_exercise.Interface):
         exercise_log_update = {
             k: v
             for k, v in kwargs.items()
-            if k in ExerciseLog.__table__.columns and k != "id"
+            if k in ExerciseLog.__table__.columns
+            and k not in ("id", "workout_session_id", "user_id")
         }
+        if "routine_exercise_id" in exercise_log_update:
+            # the set follows its new routine exercise's owner
+            exercise_log_update["user_id"] = (
+                select(Routine.user_id)
+                .join(RoutineDay)
+                .join(RoutineExercise)
+                .where(RoutineExercise.id == exercise_log_update["routine_exercise_id"])
+                .scalar_subquery()
+            )
 
-        session.query(ExerciseLog).filter(ExerciseLog.id == exercise_log_id).update(
-            exercise_log_update
-        )
+        # read before the update, which may move the set to another exercise
+        edited = session.execute(
+            select(
+                ExerciseLog.routine_exercise_id, ExerciseLog.workout_session_id
+            ).where(ExerciseLog.id == exercise_log_id)
+        ).first()
+        try:
+            # a savepoint, so a clashing set only undoes this edit
+            with session.begin_nested():
+                session.query(ExerciseLog).filter(
+                    ExerciseLog.id == exercise_log_id
+                ).update(exercise_log_update)
+        except IntegrityError as e:
+            session.close()
+            if "UNIQUE constraint failed" in e.args[0]:
+                return {
+                    "message": "another set of this exercise has the same "
+                    "time stamp and set index"
+                }
+            raise
+        if edited is not None:
+            if exercise_log_update.keys() & {"time_stamp", "num_reps", "time_duration"}:
+                session_totals.refresh(session, [edited.workout_session_id])
+            today.touch(
+                session,
+                ("routine_exercise", edited.routine_exercise_id),
+                (
+                    "routine_exercise",
+                    exercise_log_update.get(
+                        "routine_exercise_id", edited.routine_exercise_id
+                    ),
+                ),
+            )
         session.commit()
         session.close()
 
@@ -142,18 +380,9 @@ class Interface(routine_exercise.Interface):
         return exercise_log
 
     def reset_set_idxs(self, routine_exercise_id: int):
-        exercise_logs = self.get_exercise_logs_by_routine_exercise_id(
-            routine_exercise_id
-        )
-        exercise_logs = sorted(exercise_logs, key=lambda x: x.set_idx)
-
         session = self.Session()
-
-        for n, e in enumerate(exercise_logs):
-            if e.set_idx != n:
-                session.query(ExerciseLog).filter(ExerciseLog.id == e.id).update(
-                    {"set_idx": n}
-                )
+        SETS.renumber(session, routine_exercise_id)
+        today.touch(session, ("routine_exercise", routine_exercise_id))
         session.commit()
         session.close()
 
@@ -163,18 +392,21 @@ class Interface(routine_exercise.Interface):
             session.query(ExerciseLog).filter(ExerciseLog.id == exercise_log_id).first()
         )
         if exercise_log:
-            routine_exercise_id = exercise_log.routine_exercise_id
             session.delete(exercise_log)
+            session.flush()
+            session_totals.refresh(session, [exercise_log.workout_session_id])
+            SETS.renumber(session, exercise_log.routine_exercise_id)
+            today.touch(session, ("routine_exercise", exercise_log.routine_exercise_id))
             session.commit()
-            self.reset_set_idxs(routine_exercise_id)
         session.close()
 
     def delete_exercises_by_routine_exercise_id(self, routine_exercise_id: int) -> None:
         self.delete_exercise_by_id(routine_exercise_id)
 
         session = self.Session()
-        session.query(ExerciseLog).filter(
-            ExerciseLog.routine_exercise_id == routine_exercise_id
-        ).delete()
+        session_totals.delete_sets(
+            session, ExerciseLog.routine_exercise_id == routine_exercise_id
+        )
+        today.touch(session, ("routine_exercise", routine_exercise_id))
         session.commit()
         session.close()
@@ -0,0 +1,241 @@
+"""
+streams a user's measurement and training history out of the database in
+batches, serialized incrementally as ndjson or csv and optionally gzipped, so
+memory stays flat no matter how large the account is. each batch is a keyset
+page read on its own, so no lock is held while the client consumes the stream
+and writers are never blocked by a long export. measurements are exported as
+stored, in canonical metric units:
+
+    python -m src.database.export USER_ID --format csv --table measurement
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+import zlib
+from datetime import date, datetime
+from typing import Any, AsyncIterator, Iterable, Iterator
+from sqlalchemy import Column, Select, select, tuple_
+from sqlalchemy.engine import Engine, RowMapping
+from sqlalchemy.ext.asyncio import AsyncEngine
+from src.database.common import (
+    Exercise,
+    ExerciseLog,
+    Measurement,
+    Routine,
+    RoutineDay,
+    RoutineExercise,
+    get_engine,
+)
+from src import config
+
+FORMATS = ("ndjson", "csv")
+
+BATCH_SIZE = 1000
+
+
+def measurement_query(user_id: int) -> Select:
+    return (
+        select(*Measurement.__table__.columns)
+        .where(Measurement.user_id == user_id)
+        .order_by(Measurement.measurement_time, Measurement.id)
+    )
+
+
+def exercise_log_query(user_id: int) -> Select:
+    # logs carry the routine and exercise they belong to so the export
+    # stands on its own
+    return (
+        select(
+            *ExerciseLog.__table__.columns,
+            Routine.id.label("routine_id"),
+            RoutineDay.id.label("routine_day_id"),
+            Exercise.id.label("exercise_id"),
+            Exercise.exercise_name,
+        )
+        .join(RoutineExercise, ExerciseLog.routine_exercise_id == RoutineExercise.id)
+        .join(RoutineDay, RoutineExercise.day_id == RoutineDay.id)
+        .join(Routine, RoutineDay.routine_id == Routine.id)
+        .join(Exercise, RoutineExercise.exercise_id == Exercise.id)
+        .where(ExerciseLog.user_id == user_id)
+        .order_by(ExerciseLog.time_stamp, ExerciseLog.id)
+    )
+
+
+QUERIES = {"measurement": measurement_query, "exercise_log": exercise_log_query}
+
+# the columns each query is ordered by, which are also its keyset
+KEYS: dict[str, tuple[Column, ...]] = {
+    "measurement": (Measurement.measurement_time, Measurement.id),
+    "exercise_log": (ExerciseLog.time_stamp, ExerciseLog.id),
+}
+
+
+def page_query(
+    table: str, user_id: int, after: tuple | None, batch_size: int
+) -> Select:
+    """the batch_size rows of table that follow the keyset after"""
+    query = QUERIES[table](user_id)
+    if after is not None:
+        query = query.where(tuple_(*KEYS[table]) > tuple_(*after))
+    return query.limit(batch_size)
+
+
+def next_key(table: str, rows: list[RowMapping]) -> tuple:
+    return tuple(rows[-1][column.key] for column in KEYS[table])
+
+
+def to_json_value(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+class Encoder:
+    """turns batches of rows into ndjson or csv bytes, optionally gzipped"""
+
+    def __init__(self, format: str = "ndjson", compress: bool = False):
+        if format not in FORMATS:
+            raise ValueError(f"format must be one of {FORMATS}")
+        self.format = format
+        # wbits=31 writes a gzip header and trailer around the deflate stream
+        self.compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def encode(self, text: str) -> bytes:
+        data = text.encode()
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        return data
+
+    def begin(self, table: str, columns: Iterable[str]) -> bytes:
+        if self.format == "csv":
+            return self.encode(self.csv_line(columns))
+        return b""
+
+    def rows(self, table: str, rows: list[RowMapping]) -> bytes:
+        if self.format == "csv":
+            lines = (self.csv_line(map(to_json_value, row.values())) for row in rows)
+        else:
+            lines = (
+                json.dumps(
+                    {"table": table, **{k: to_json_value(v) for k, v in row.items()}}
+                )
+                + "\n"
+                for row in rows
+            )
+        return self.encode("".join(lines))
+
+    def finish(self) -> bytes:
+        if self.compressor is not None:
+            return self.compressor.flush()
+        return b""
+
+    @staticmethod
+    def csv_line(values: Iterable[Any]) -> str:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(values)
+        return buffer.getvalue()
+
+
+def check_tables(tables: list[str], format: str) -> None:
+    if format not in FORMATS:
+        raise ValueError(f"format must be one of {FORMATS}")
+    unknown = set(tables) - set(QUERIES)
+    if unknown:
+        raise ValueError(f"unknown tables {sorted(unknown)}, expected {list(QUERIES)}")
+    if format == "csv" and len(tables) != 1:
+        raise ValueError("csv exports one table at a time")
+
+
+def export(
+    engine: Engine,
+    user_id: int,
+    tables: Iterable[str] = tuple(QUERIES),
+    format: str = "ndjson",
+    compress: bool = False,
+    batch_size: int = BATCH_SIZE,
+) -> Iterator[bytes]:
+    """
+    rows written while the export runs show up if they sort after the current
+    page; no row is exported twice or skipped
+    """
+    tables = list(tables)
+    check_tables(tables, format)
+    encoder = Encoder(format, compress)
+    for table in tables:
+        after = None
+        while True:
+            with engine.connect() as connection:
+                result = connection.execute(
+                    page_query(table, user_id, after, batch_size)
+                )
+                columns, rows = list(result.keys()), result.mappings().all()
+            if after is None:
+                yield encoder.begin(table, columns)
+            if rows:
+                yield encoder.rows(table, rows)
+            if len(rows) < batch_size:
+                break
+            after = next_key(table, rows)
+    yield encoder.finish()
+
+
+async def export_async(
+    engine: AsyncEngine,
+    user_id: int,
+    tables: Iterable[str] = tuple(QUERIES),
+    format: str = "ndjson",
+    compress: bool = False,
+    batch_size: int = BATCH_SIZE,
+) -> AsyncIterator[bytes]:
+    """async version of export"""
+    tables = list(tables)
+    check_tables(tables, format)
+    encoder = Encoder(format, compress)
+    for table in tables:
+        after = None
+        while True:
+            async with engine.connect() as connection:
+                result = await connection.execute(
+                    page_query(table, user_id, after, batch_size)
+                )
+                columns, rows = list(result.keys()), result.mappings().all()
+            if after is None:
+                yield encoder.begin(table, columns)
+            if rows:
+                yield encoder.rows(table, rows)
+            if len(rows) < batch_size:
+                break
+            after = next_key(table, rows)
+    yield encoder.finish()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="export a user's history")
+    parser.add_argument("user_id", type=int)
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument(
+        "--table", choices=list(QUERIES), action="append", dest="tables"
+    )
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--output", help="file to write, stdout by default")
+    args = parser.parse_args()
+
+    engine = get_engine(config.config["DATABASE"]["CONN_STRING"])
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for chunk in export(
+            engine,
+            args.user_id,
+            args.tables or list(QUERIES),
+            args.format,
+            args.gzip,
+            args.batch_size,
+        ):
+            output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
@@ -0,0 +1,264 @@
+"""
+imports measurement history, e.g. a smart scale's export, from csv, ndjson or
+a json array. the file is parsed as a stream and written in batches, so memory
+stays flat however many years of weigh-ins it holds:
+
+    python -m src.database.importer USER_ID weigh_ins.csv --units imperial
+
+column names are matched loosely ("Date", "Weight (lb)", "body_weight"), and a
+unit in the column name wins over the system the file is declared in. rows
+whose timestamp the user already has, or that repeat an earlier row of the
+file, are skipped.
+"""
+
+import argparse
+import csv
+import io
+import json
+import re
+import sys
+from datetime import datetime, timezone
+from itertools import islice
+from typing import IO, Any, Iterable, Iterator
+from sqlalchemy import insert, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from src.database.common import Measurement, User, get_engine
+from src.database import units
+from src import config
+
+FORMATS = ("csv", "ndjson", "json")
+
+BATCH_SIZE = 5000
+
+TOTALS = ("read", "inserted", "duplicates", "skipped")
+
+TIME_FIELDS = ("measurement_time", "time", "timestamp", "datetime", "date")
+
+FIELDS = {"weight": "body_weight", "body_weight": "body_weight", "height": "height"}
+
+# metric units per unit, for units that may appear in a column name
+UNITS = {
+    "kg": ("body_weight", 1.0),
+    "lb": ("body_weight", units.FACTORS["imperial"]["body_weight"]),
+    "lbs": ("body_weight", units.FACTORS["imperial"]["body_weight"]),
+    "cm": ("height", 1.0),
+    "m": ("height", 100.0),
+    "in": ("height", units.FACTORS["imperial"]["height"]),
+}
+
+COLUMN = re.compile(r"^(?P<name>.*?)[\s_]*(?:\((?P<unit>[a-z]+)\))?$")
+
+
+def read_csv(text: IO[str]) -> Iterator[dict]:
+    return csv.DictReader(text)
+
+
+def read_ndjson(text: IO[str]) -> Iterator[dict]:
+    for line in text:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_json(text: IO[str], chunk_size: int = 1 << 16) -> Iterator[dict]:
+    """the elements of a top-level json array, decoded one at a time"""
+    decoder = json.JSONDecoder()
+    buffer = text.read(chunk_size).lstrip()
+    if not buffer.startswith("["):
+        raise ValueError("expected a json array")
+    position = 1
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position < len(buffer) and buffer[position] == "]":
+            return
+        try:
+            record, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # the element runs past the buffer, read on
+            chunk = text.read(chunk_size)
+            if not chunk:
+                raise ValueError("unterminated json array") from None
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        yield record
+
+
+READERS = {"csv": read_csv, "ndjson": read_ndjson, "json": read_json}
+
+
+def records(file: IO[bytes], format: str) -> Iterator[dict]:
+    if format not in FORMATS:
+        raise ValueError(f"format must be one of {FORMATS}")
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        yield from READERS[format](text)
+    finally:
+        # leave the caller's file open
+        text.detach()
+
+
+def parse_time(value: Any) -> datetime | None:
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.strip())
+        except ValueError:
+            value = float(value)
+    if isinstance(value, (int, float)):
+        # epoch seconds, or milliseconds from some scales
+        if value > 1e11:
+            value /= 1000
+        return datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def parse_value(value: Any) -> float | None:
+    if value is None or value == "":
+        return None
+    return float(value)
+
+
+def normalize(record: Any, measurement_system: str | None) -> dict | None:
+    """
+    a measurement row in metric units, or None for records that are not
+    measurements or can't be read
+    """
+    # json elements and ndjson lines may be anything, e.g. [1, 2]
+    if not isinstance(record, dict):
+        return None
+    if record.get("table", "measurement") != "measurement":
+        return None
+    defaults = units.factors(measurement_system)
+    row = {"measurement_time": None, **{column: None for column in units.COLUMNS}}
+    try:
+        for key, value in record.items():
+            match = COLUMN.match(str(key).strip().lower())
+            name = match["name"].replace(" ", "_")
+            if name in TIME_FIELDS and row["measurement_time"] is None:
+                row["measurement_time"] = parse_time(value)
+            elif name in FIELDS:
+                column = FIELDS[name]
+                unit = UNITS.get(match["unit"])
+                if unit is not None and unit[0] != column:
+                    return None
+                value = parse_value(value)
+                if value is not None:
+                    factor = unit[1] if unit is not None else defaults[column]
+                    row[column] = value * factor
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+
+    if row["measurement_time"] is None or all(
+        row[column] is None for column in units.COLUMNS
+    ):
+        return None
+    return row
+
+
+def batches(items: Iterable, size: int) -> Iterator[list]:
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
+
+
+def load(
+    session: Session,
+    user_id: int,
+    records: Iterable[dict],
+    measurement_system: str | None = None,
+    batch_size: int = BATCH_SIZE,
+) -> Iterator[dict]:
+    """
+    writes records as measurements of user_id, committing each batch, and
+    yields the running totals after every batch. measurement_system is the
+    system of the file, the user's own by default
+    """
+    if measurement_system is None:
+        measurement_system = session.scalar(
+            select(User.measurement_system).where(User.id == user_id)
+        )
+    totals = dict.fromkeys(TOTALS, 0)
+    for batch in batches(records, batch_size):
+        rows = {}
+        for record in batch:
+            row = normalize(record, measurement_system)
+            if row is None:
+                totals["skipped"] += 1
+            elif row["measurement_time"] in rows:
+                totals["duplicates"] += 1
+            else:
+                rows[row["measurement_time"]] = row
+        totals["read"] += len(batch)
+
+        # earlier batches are already written, so this also catches repeats
+        # across batches; each timestamp is a lookup on the
+        # (user_id, measurement_time) index
+        existing = set()
+        if rows:
+            existing = set(
+                session.scalars(
+                    select(Measurement.measurement_time).where(
+                        Measurement.user_id == user_id,
+                        Measurement.measurement_time.in_(list(rows)),
+                    )
+                )
+            )
+        new = [
+            {"user_id": user_id, **row}
+            for measurement_time, row in rows.items()
+            if measurement_time not in existing
+        ]
+        totals["duplicates"] += len(rows) - len(new)
+        if new:
+            session.execute(insert(Measurement), new)
+        session.commit()
+        totals["inserted"] += len(new)
+
+        yield dict(totals)
+
+
+def run(
+    engine: Engine,
+    user_id: int,
+    file: IO[bytes],
+    format: str,
+    measurement_system: str | None = None,
+    batch_size: int = BATCH_SIZE,
+) -> Iterator[dict]:
+    """
+    loads file on a session of its own, so each batch is its own transaction
+    and holds the write lock only while it is written. yields the running
+    totals after every batch, and once even for an empty file
+    """
+    totals = None
+    with Session(engine) as session:
+        for totals in load(
+            session, user_id, records(file, format), measurement_system, batch_size
+        ):
+            yield totals
+    if totals is None:
+        yield dict.fromkeys(TOTALS, 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="import measurement history")
+    parser.add_argument("user_id", type=int)
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=FORMATS, help="from the file name")
+    parser.add_argument(
+        "--units", choices=list(units.FACTORS), help="the user's system by default"
+    )
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    format = args.format or args.path.rsplit(".", 1)[-1].lower()
+    engine = get_engine(config.config["DATABASE"]["CONN_STRING"])
+    with open(args.path, "rb") as file:
+        for totals in run(
+            engine, args.user_id, file, format, args.units, args.batch_size
+        ):
+            print(json.dumps(totals), file=sys.stderr)
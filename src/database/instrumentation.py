@@ -0,0 +1,272 @@
+"""
+per-request sql instrumentation. every statement run on a shared engine is
+timed and attributed to the active tracking scope (usually one api request)
+and to the outermost interface method that issued it.
+"""
+
+import functools
+import inspect
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from src import config
+
+logger = logging.getLogger(__name__)
+
+NO_METHOD = "<direct>"
+
+COMMIT = "<commit>"
+
+
+class StatementStats:
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.slowest_ms = 0.0
+        self.slowest_statement: str | None = None
+
+    def record(self, statement: str, duration_ms: float) -> None:
+        self.count += 1
+        self.total_ms += duration_ms
+        if duration_ms >= self.slowest_ms:
+            self.slowest_ms = duration_ms
+            self.slowest_statement = statement
+
+    def merge(self, other: "StatementStats") -> None:
+        self.count += other.count
+        self.total_ms += other.total_ms
+        if other.slowest_ms >= self.slowest_ms:
+            self.slowest_ms = other.slowest_ms
+            self.slowest_statement = other.slowest_statement
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "total_ms": round(self.total_ms, 3),
+            "slowest_ms": round(self.slowest_ms, 3),
+            "slowest_statement": self.slowest_statement,
+        }
+
+
+class RequestStats(StatementStats):
+    def __init__(self, name: str, parent: "RequestStats | None" = None):
+        super().__init__()
+        self.name = name
+        self.parent = parent
+        self.requests = 1
+        self.methods: dict[str, StatementStats] = {}
+
+    def record(self, statement: str, duration_ms: float, method: str = NO_METHOD):
+        super().record(statement, duration_ms)
+        self.methods.setdefault(method, StatementStats()).record(statement, duration_ms)
+        if self.parent is not None:
+            self.parent.record(statement, duration_ms, method)
+
+    def merge(self, other: "RequestStats") -> None:
+        super().merge(other)
+        self.requests += other.requests
+        for method, stats in other.methods.items():
+            self.methods.setdefault(method, StatementStats()).merge(stats)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "requests": self.requests,
+            **super().to_dict(),
+            "methods": {m: s.to_dict() for m, s in self.methods.items()},
+        }
+
+
+current_scope: ContextVar[RequestStats | None] = ContextVar(
+    "current_scope", default=None
+)
+current_method: ContextVar[str | None] = ContextVar("current_method", default=None)
+
+route_stats: dict[str, RequestStats] = {}
+recent_requests: deque[RequestStats] = deque(maxlen=50)
+stats_lock = threading.Lock()
+
+
+def slow_query_ms() -> float:
+    return config.config.getfloat("DATABASE", "SLOW_QUERY_MS", fallback=200.0)
+
+
+def parameter_shape(parameters: Any) -> Any:
+    """parameter types without their values, so slow query logs hold no user data"""
+    if isinstance(parameters, dict):
+        return {k: type(v).__name__ for k, v in parameters.items()}
+    elif isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return f"{len(parameters)} x {parameter_shape(parameters[0])}"
+        return [type(v).__name__ for v in parameters]
+    return type(parameters).__name__
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # kept on the execution context, which is dropped with the statement
+    # whether or not it succeeds
+    context.query_start_time = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration_ms = (time.perf_counter() - context.query_start_time) * 1000
+    method = current_method.get() or NO_METHOD
+
+    scope = current_scope.get()
+    if scope is not None:
+        scope.record(statement, duration_ms, method)
+
+    if duration_ms >= slow_query_ms():
+        logger.warning(
+            "slow query (%.1f ms) in %s: %s parameters=%s",
+            duration_ms,
+            method,
+            statement,
+            parameter_shape(parameters),
+        )
+
+
+@contextmanager
+def commit() -> Iterator[None]:
+    """times a commit, which doesn't go through a cursor, as a COMMIT statement"""
+    start = time.perf_counter()
+    yield
+    scope = current_scope.get()
+    if scope is not None:
+        duration_ms = (time.perf_counter() - start) * 1000
+        scope.record("COMMIT", duration_ms, COMMIT)
+
+
+def instrument(engine: Engine) -> None:
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+def method(name: str) -> Callable[[Callable], Callable]:
+    """attributes statements to name unless an outer interface method already is"""
+
+    def decorate(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if current_method.get() is not None:
+                return fn(*args, **kwargs)
+
+            token = current_method.set(name)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                current_method.reset(token)
+
+        return wrapper
+
+    return decorate
+
+
+@contextmanager
+def track(name: str) -> Iterator[RequestStats]:
+    """
+    collects the statements run inside the block. the stats can be renamed
+    before the block exits (e.g. once the route is known) and are then added
+    to the per-route totals.
+    """
+    stats = RequestStats(name, current_scope.get())
+    token = current_scope.set(stats)
+    try:
+        yield stats
+    finally:
+        current_scope.reset(token)
+        if stats.parent is None:
+            with stats_lock:
+                recent_requests.append(stats)
+                if stats.name not in route_stats:
+                    route_stats[stats.name] = RequestStats(stats.name)
+                    route_stats[stats.name].requests = 0
+                route_stats[stats.name].merge(stats)
+
+
+class StatementBudgetExceeded(Exception):
+    pass
+
+
+def strict_budgets() -> bool:
+    return config.config.getboolean(
+        "DATABASE", "STRICT_STATEMENT_BUDGETS", fallback=False
+    )
+
+
+class StatementBudget:
+    """
+    context manager and decorator (for sync or async functions, including api
+    routes) capping the statements run inside it. going over the budget raises
+    StatementBudgetExceeded in strict mode and logs a warning otherwise.
+    """
+
+    def __init__(
+        self, max_statements: int, name: str | None = None, strict: bool | None = None
+    ):
+        self.max_statements = max_statements
+        self.name = name
+        self.strict = strict
+
+    def __enter__(self) -> RequestStats:
+        self.stats = RequestStats(self.name or "statement budget", current_scope.get())
+        self.token = current_scope.set(self.stats)
+        return self.stats
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        current_scope.reset(self.token)
+        if exc_type is not None or self.stats.count <= self.max_statements:
+            return
+
+        methods = {m: s.count for m, s in self.stats.methods.items()}
+        message = (
+            f"{self.stats.name} ran {self.stats.count} statements, "
+            f"budget is {self.max_statements}: {methods}"
+        )
+        strict = strict_budgets() if self.strict is None else self.strict
+        if strict:
+            raise StatementBudgetExceeded(message)
+        logger.warning(message)
+
+    def __call__(self, fn: Callable) -> Callable:
+        name = self.name or fn.__qualname__
+
+        def budget():
+            return StatementBudget(self.max_statements, name, self.strict)
+
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with budget():
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with budget():
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+
+def snapshot() -> dict[str, Any]:
+    with stats_lock:
+        return {
+            "slow_query_ms": slow_query_ms(),
+            "routes": {n: s.to_dict() for n, s in route_stats.items()},
+            "recent": [s.to_dict() for s in recent_requests],
+        }
+
+
+def reset() -> None:
+    with stats_lock:
+        route_stats.clear()
+        recent_requests.clear()
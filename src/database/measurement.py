@@ -1,14 +1,122 @@
-from datetime import datetime, timedelta
-from typing import List
+import math
+from datetime import date, datetime, timedelta
+from typing import IO, Callable, List, Sequence
+from sqlalchemy import (
+    Integer,
+    Select,
+    case,
+    cast,
+    delete,
+    func,
+    insert,
+    literal,
+    select,
+    update,
+)
+from sqlalchemy.engine import RowMapping
 from sqlalchemy.orm.session import Session
 from src.database.common import Measurement, User
-from src.database import user
+from src.database import importer, units, user
+
+
+def measurement_query(*criteria) -> Select:
+    """measurement rows along with the system their user reads them in"""
+    return (
+        select(*Measurement.__table__.columns, User.measurement_system)
+        .join(User, Measurement.user_id == User.id)
+        .where(*criteria)
+    )
+
+
+def present(
+    rows: Sequence[RowMapping], measurement_system: str | None
+) -> List[Measurement]:
+    """converts stored rows into measurement_system, a column at a time"""
+    names = Measurement.__table__.columns.keys()
+    columns = units.from_metric(units.to_columns(rows, names), measurement_system)
+    # transient copies, so the converted values are never flushed back
+    return [Measurement(**values) for values in units.to_rows(columns)]
+
+
+def fetch(session: Session, query: Select) -> List[Measurement]:
+    rows = session.execute(query).mappings().all()
+    return present(rows, rows[0]["measurement_system"] if rows else None)
+
+
+def get_measurement_system(session: Session, user_id: int) -> str | None:
+    return session.scalar(select(User.measurement_system).where(User.id == user_id))
+
+
+def matching(values: dict) -> list:
+    """criteria for measurements with exactly these stored values"""
+    return [
+        getattr(Measurement, k) == v
+        for k, v in values.items()
+        if k in Measurement.__table__.columns
+    ]
+
+
+def match(user_id: int, values: dict) -> Select:
+    """measurements of user_id with exactly these stored values"""
+    return measurement_query(Measurement.user_id == user_id, *matching(values))
+
+
+PERIODS = ("day", "week", "month")
+
+STATS = ("min", "max", "mean", "last")
+
+
+def period_origin(period: str, start: date) -> date:
+    """the first day of the period start falls in; buckets count from there"""
+    if period == "week":
+        return start - timedelta(days=start.weekday())
+    if period == "month":
+        return start.replace(day=1)
+    return start
+
+
+def months(t) -> int:
+    return t.year * 12 + t.month - 1
+
+
+def add_months(origin: date, n: int) -> date:
+    year, month = divmod(months(origin) + n, 12)
+    return date(year, month + 1, 1)
+
+
+def num_periods(period: str, origin: date, end: date) -> int:
+    if period == "month":
+        return months(end) - months(origin) + 1
+    return (end - origin).days // (7 if period == "week" else 1) + 1
+
+
+def bucket_index(period: str, origin: date, width: int):
+    """sql for the bucket of each measurement: width periods counted from origin"""
+    if period == "month":
+        return (
+            cast(func.strftime("%Y", Measurement.measurement_time), Integer) * 12
+            + cast(func.strftime("%m", Measurement.measurement_time), Integer)
+            - 1
+            - months(origin)
+        ) // width
+    days = cast(
+        func.julianday(func.date(Measurement.measurement_time))
+        - func.julianday(origin.isoformat()),
+        Integer,
+    )
+    return days // (width * (7 if period == "week" else 1))
+
+
+def bucket_start(period: str, origin: date, width: int, index: int) -> date:
+    if period == "month":
+        return add_months(origin, index * width)
+    return origin + timedelta(days=index * width * (7 if period == "week" else 1))
 
 
 class Interface(user.Interface):
     def add_measurement(
         self, user_id: int, measurement_time: datetime = None, **kwargs
-    ) -> Measurement:
+    ) -> Measurement | dict[str, str]:
         """
         TODO: verify kwargs (maybe do on front end?)
         """
@@ -16,45 +124,51 @@ class Interface(user.Interface):
         if measurement_time is None or measurement_time > datetime.utcnow():
             measurement_time = datetime.utcnow()
 
-        query_dict = {
-            k: v for k, v in kwargs.items() if k in Measurement.__table__.columns
-        }
-        measurements = self.get_measurement_by_measurements(user_id, **query_dict)
-        twenty_four_hours_ago = datetime.utcnow() - timedelta(hours=24)
-
-        if len(measurements) > 0:
-            latest_time = max([m.measurement_time for m in measurements])
-            if latest_time > (twenty_four_hours_ago):
-                print(
-                    "These exact measurements have been entered less than 24 hours ago."
+        session = self.Session()
+        measurement_system = get_measurement_system(session, user_id)
+        metric = units.to_metric(kwargs, measurement_system)
+        values = {"measurement_time": measurement_time, "user_id": user_id, **metric}
+        # the same values entered in the last 24 hours, found on the
+        # (user_id, measurement_time) index; checked by the insert itself so
+        # that two identical requests can't both get in
+        duplicate = select(Measurement.id).where(
+            Measurement.user_id == user_id,
+            Measurement.measurement_time > datetime.utcnow() - timedelta(hours=24),
+            *matching(metric),
+        )
+        rows = (
+            session.execute(
+                insert(Measurement)
+                .from_select(
+                    list(values),
+                    select(
+                        *[
+                            literal(v, Measurement.__table__.c[k].type)
+                            for k, v in values.items()
+                        ]
+                    ).where(~duplicate.exists()),
                 )
-        else:
-            latest_time = datetime.utcnow()
-
-        if len(measurements) == 0 or latest_time < (twenty_four_hours_ago):
-            measurement = Measurement(
-                measurement_time=measurement_time, user_id=user_id, **kwargs
+                .returning(*Measurement.__table__.columns)
             )
+            .mappings()
+            .all()
+        )
+        session.commit()
+        session.close()
 
-            session = self.Session()
-            session.add(measurement)
-            session.commit()
-            session.refresh(measurement)
-
-            session.close()
-
-            return measurement
+        if not rows:
+            return {
+                "message": "These exact measurements have been entered less than "
+                "24 hours ago."
+            }
 
-        return measurements
+        return present(rows, measurement_system)[0]
 
     def get_measurement_by_measurements(self, user_id: int, **kwargs) -> Measurement:
         session = self.Session()
-        kwargs = {k: v for k, v in kwargs.items() if k in Measurement.__table__.columns}
-        measurement = (
-            session.query(Measurement)
-            .filter(Measurement.user_id == user_id)
-            .filter_by(**kwargs)
-            .all()
+        measurement_system = get_measurement_system(session, user_id)
+        measurement = fetch(
+            session, match(user_id, units.to_metric(kwargs, measurement_system))
         )
         session.close()
 
@@ -62,17 +176,15 @@ class Interface(user.Interface):
 
     def get_measurement_by_id(self, measurement_id: int) -> Measurement:
         session = self.Session()
-        measurement = (
-            session.query(Measurement).filter(Measurement.id == measurement_id).first()
+        measurement = fetch(
+            session, measurement_query(Measurement.id == measurement_id)
         )
         session.close()
-        return measurement
+        return measurement[0] if measurement else None
 
     def get_all_measurement_by_user(self, user_id: int) -> List[Measurement]:
         session = self.Session()
-        measurements = (
-            session.query(Measurement).filter(Measurement.user_id == user_id).all()
-        )
+        measurements = fetch(session, measurement_query(Measurement.user_id == user_id))
         session.close()
         return measurements
 
@@ -80,114 +192,233 @@ class Interface(user.Interface):
         self, user_id: int, start_time: datetime, end_time: datetime = datetime.utcnow()
     ):
         session = self.Session()
-        measurements = (
-            session.query(Measurement)
-            .filter(Measurement.user_id == user_id)
-            .filter(Measurement.measurement_time >= start_time)
-            .filter(Measurement.measurement_time < end_time)
-            .all()
+        measurements = fetch(
+            session,
+            measurement_query(
+                Measurement.user_id == user_id,
+                Measurement.measurement_time >= start_time,
+                Measurement.measurement_time < end_time,
+            ),
         )
         session.close()
         return measurements
 
+    def get_measurement_buckets(
+        self,
+        user_id: int,
+        start_time: datetime,
+        end_time: datetime = None,
+        period: str = "day",
+        max_points: int = None,
+    ) -> List[dict]:
+        """
+        min, max, mean and last of each measurement per day, week or month in
+        start_time <= t < end_time, in the user's units. with max_points, whole
+        periods are merged so there are at most that many buckets
+        """
+        if period not in PERIODS:
+            raise ValueError(f"period must be one of {', '.join(PERIODS)}")
+        if max_points is not None and max_points < 1:
+            raise ValueError("max_points must be at least 1")
+        if end_time is None:
+            end_time = datetime.utcnow()
+
+        origin = period_origin(period, start_time.date())
+        width = 1
+        if max_points is not None:
+            periods = num_periods(period, origin, end_time.date())
+            width = max(1, math.ceil(periods / max_points))
+        index = bucket_index(period, origin, width)
+
+        columns = [getattr(Measurement, name) for name in units.COLUMNS]
+        ranked = (
+            select(
+                index.label("bucket"),
+                *columns,
+                # the latest value of each column in the bucket, skipping nulls
+                *[
+                    func.first_value(column)
+                    .over(
+                        partition_by=index,
+                        order_by=(
+                            column.is_(None),
+                            Measurement.measurement_time.desc(),
+                            Measurement.id.desc(),
+                        ),
+                    )
+                    .label(f"{column.key}_last")
+                    for column in columns
+                ],
+            )
+            .where(
+                Measurement.user_id == user_id,
+                Measurement.measurement_time >= start_time,
+                Measurement.measurement_time < end_time,
+            )
+            .subquery()
+        )
+        aggregates = {"min": func.min, "max": func.max, "mean": func.avg}
+        query = (
+            select(
+                ranked.c.bucket,
+                func.count().label("count"),
+                *[
+                    aggregate(ranked.c[name]).label(f"{name}_{stat}")
+                    for name in units.COLUMNS
+                    for stat, aggregate in aggregates.items()
+                ],
+                *[
+                    func.max(ranked.c[f"{name}_last"]).label(f"{name}_last")
+                    for name in units.COLUMNS
+                ],
+                select(User.measurement_system)
+                .where(User.id == user_id)
+                .scalar_subquery()
+                .label("measurement_system"),
+            )
+            .group_by(ranked.c.bucket)
+            .order_by(ranked.c.bucket)
+        )
+
+        session = self.Session()
+        rows = session.execute(query).mappings().all()
+        session.close()
+        if not rows:
+            return []
+
+        # every statistic scales like the values themselves
+        measurement_system = rows[0]["measurement_system"]
+        stats = {
+            stat: units.from_metric(
+                {
+                    name: [row[f"{name}_{stat}"] for row in rows]
+                    for name in units.COLUMNS
+                },
+                measurement_system,
+            )
+            for stat in STATS
+        }
+        return [
+            {
+                "start": bucket_start(period, origin, width, row["bucket"]),
+                "end": bucket_start(period, origin, width, row["bucket"] + 1),
+                "count": row["count"],
+                **{
+                    name: {stat: stats[stat][name][i] for stat in STATS}
+                    for name in units.COLUMNS
+                },
+            }
+            for i, row in enumerate(rows)
+        ]
+
     def get_latest_measurement_by_user(self, user_id):
         session = self.Session()
-        measurement = (
-            session.query(Measurement)
-            .filter(Measurement.user_id == user_id)
+        measurement = fetch(
+            session,
+            measurement_query(Measurement.user_id == user_id)
             .order_by(Measurement.measurement_time.desc())
-            .first()
+            .limit(1),
         )
         session.close()
-        return measurement
+        return measurement[0] if measurement else None
 
     def edit_measurement(self, measurement_id: int, **kwargs) -> Measurement:
         session = self.Session()
+        measurement_system = session.scalar(
+            select(User.measurement_system)
+            .join(Measurement, Measurement.user_id == User.id)
+            .where(Measurement.id == measurement_id)
+        )
         measurement_update = {
             k: v
             for k, v in kwargs.items()
             if k in Measurement.__table__.columns and "id" not in k
         }
-        session.query(Measurement).filter(Measurement.id == measurement_id).update(
-            measurement_update
+        rows = (
+            session.execute(
+                update(Measurement)
+                .where(Measurement.id == measurement_id)
+                .values(units.to_metric(measurement_update, measurement_system))
+                .returning(*Measurement.__table__.columns)
+                .execution_options(synchronize_session=False)
+            )
+            .mappings()
+            .all()
         )
         session.commit()
 
-        measurement = self.get_measurement_by_id(measurement_id)
-
         session.close()
 
-        return measurement
-
-    def change_measurement_units(
-        self, user_id: int, session: Session
-    ) -> List[Measurement]:
-        measurement_system = self.get_user_by_id(user_id).measurement_system
-
-        measurements = self.get_all_measurement_by_user(user_id)
-
-        for m in measurements:
-            update_keys = [
-                k
-                for k, v in m.__dict__.items()
-                if v is not None
-                and k not in ["measurement_time", "_sa_instance_state", "id", "user_id"]
-            ]
-            update_values = {k: v for k, v in m.__dict__.items() if k in update_keys}
-
-            if measurement_system == "metric":
-                weight_convert = 2.20462262185
-                length_convert = 0.39370079
-            elif measurement_system == "imperial":
-                weight_convert = 0.45359237
-                length_convert = 2.54
-            else:
-                raise ValueError
-
-            for k, v in update_values.items():
-                if k == "body_weight":
-                    update_values[k] = v * weight_convert
-                else:
-                    update_values[k] = v * length_convert
-
-            session.query(Measurement).filter(Measurement.id == m.id).update(
-                update_values
-            )
+        return present(rows, measurement_system)[0] if rows else None
+
+    def import_measurements(
+        self,
+        user_id: int,
+        file: IO[bytes],
+        format: str = "csv",
+        measurement_system: str = None,
+        batch_size: int = importer.BATCH_SIZE,
+        progress: Callable[[dict], None] = None,
+    ) -> dict:
+        """
+        streams measurements from a csv, ndjson or json array file and writes
+        them in batches, skipping timestamps the user already has. progress is
+        called with the running totals after every batch
+        """
+        if format not in importer.FORMATS:
+            raise ValueError(f"format must be one of {importer.FORMATS}")
+        units.factors(measurement_system)
 
-    def change_measurement_system(
-        self, user_id: int, change_values: bool = False
-    ) -> User:
         session = self.Session()
-        user = self.get_user_by_id(user_id)
-
-        if user.measurement_system == "metric":
-            update_measurement_system = "imperial"
-        elif user.measurement_system == "imperial":
-            update_measurement_system = "metric"
-        else:
-            raise ValueError
-
-        user = (
-            session.query(User)
-            .filter(User.id == user_id)
-            .update({"measurement_system": update_measurement_system})
-        )
+        totals = dict.fromkeys(importer.TOTALS, 0)
+        for totals in importer.load(
+            session,
+            user_id,
+            importer.records(file, format),
+            measurement_system,
+            batch_size,
+        ):
+            if progress is not None:
+                progress(totals)
+        session.close()
 
-        if change_values:
-            self.change_measurement_units(user_id, session)
+        return totals
+
+    def change_measurement_system(self, user_id: int) -> User:
+        """
+        flips the user between metric and imperial. measurements are stored in
+        metric and converted when read, so no measurement row is touched
+        """
+        session = self.Session()
+        user = session.scalars(
+            update(User)
+            .where(User.id == user_id)
+            .values(
+                measurement_system=case(
+                    (User.measurement_system == "metric", "imperial"),
+                    (User.measurement_system == "imperial", "metric"),
+                    else_=User.measurement_system,
+                )
+            )
+            .returning(User)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if user is None or user.measurement_system not in units.FACTORS:
+            # the update left the row as it was, so there is nothing to undo
+            session.close()
+            raise ValueError(f"can't change the measurement system of user {user_id}")
 
         session.commit()
+        session.refresh(user)
         session.close()
 
         return user
 
     def delete_measurement(self, measurement_id: int) -> None:
         session = self.Session()
-        measurement = self.get_measurement_by_id(measurement_id)
 
-        if measurement:
-            session.delete(measurement)
-            session.commit()
+        session.execute(delete(Measurement).where(Measurement.id == measurement_id))
+        session.commit()
 
         session.close()
 
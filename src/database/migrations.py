@@ -0,0 +1,336 @@
+"""
+versioned schema migrations for databases created before a schema change.
+fresh databases are built from the models by create_tables and stamped with
+the latest version. run `python -m src.database.migrations` to upgrade the
+database in app.local.conf in place.
+
+each migration is frozen as the literal statements of the schema it was
+written against, so later changes to the models never change what an old
+migration does.
+"""
+
+from datetime import datetime, timedelta
+from typing import Callable
+from sqlalchemy import TIMESTAMP, Integer, func, insert, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from src.database.common import SchemaVersion, get_engine
+from src import config
+
+MIGRATIONS: dict[int, Callable[[Connection], None]] = {}
+
+
+def migration(version: int):
+    def register(upgrade: Callable[[Connection], None]):
+        if version in MIGRATIONS:
+            raise ValueError(f"duplicate migration version {version}")
+        MIGRATIONS[version] = upgrade
+        return upgrade
+
+    return register
+
+
+def execute_all(connection: Connection, *statements: str) -> None:
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+def get_columns(connection: Connection, table_name: str) -> list[str]:
+    return [c["name"] for c in inspect(connection).get_columns(table_name)]
+
+
+@migration(1)
+def add_lookup_indexes(connection: Connection) -> None:
+    """indexes on the user, routine and exercise log lookup paths"""
+    execute_all(
+        connection,
+        "CREATE INDEX IF NOT EXISTS ix_measurement_user_id_measurement_time "
+        "ON measurement (user_id, measurement_time)",
+        "CREATE INDEX IF NOT EXISTS ix_routine_user_id ON routine (user_id)",
+        "CREATE INDEX IF NOT EXISTS ix_routine_day_routine_id_day_idx "
+        "ON routine_day (routine_id, day_idx)",
+        "CREATE INDEX IF NOT EXISTS ix_routine_exercise_day_id_exercise_idx "
+        "ON routine_exercise (day_id, exercise_idx)",
+        "CREATE INDEX IF NOT EXISTS ix_exercise_log_routine_exercise_id_time_stamp "
+        "ON exercise_log (routine_exercise_id, time_stamp, set_idx)",
+    )
+
+
+@migration(2)
+def add_workout_sessions(connection: Connection) -> None:
+    """workout_session table and exercise_log.workout_session_id, backfilled"""
+    execute_all(
+        connection,
+        "CREATE TABLE IF NOT EXISTS workout_session ("
+        "id INTEGER NOT NULL, "
+        "user_id INTEGER NOT NULL, "
+        "start_time TIMESTAMP NOT NULL, "
+        "end_time TIMESTAMP NOT NULL, "
+        "num_sets INTEGER NOT NULL, "
+        "total_reps INTEGER NOT NULL, "
+        "total_duration FLOAT NOT NULL, "
+        "PRIMARY KEY (id), "
+        "FOREIGN KEY(user_id) REFERENCES app_user (id))",
+        "CREATE INDEX IF NOT EXISTS ix_workout_session_user_id_end_time "
+        "ON workout_session (user_id, end_time)",
+    )
+    if "workout_session_id" not in get_columns(connection, "exercise_log"):
+        connection.execute(
+            text(
+                "ALTER TABLE exercise_log ADD COLUMN workout_session_id INTEGER "
+                "REFERENCES workout_session (id)"
+            )
+        )
+    connection.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_exercise_log_workout_session_id_time_stamp "
+            "ON exercise_log (workout_session_id, time_stamp)"
+        )
+    )
+
+    # existing sets are grouped per user into chains with gaps of at most an
+    # hour, which is what add_log would have built
+    session_gap = timedelta(minutes=60)
+    logs = connection.execution_options(yield_per=10000).execute(
+        text(
+            "SELECT exercise_log.id, exercise_log.time_stamp, routine.user_id "
+            "FROM exercise_log "
+            "JOIN routine_exercise "
+            "ON exercise_log.routine_exercise_id = routine_exercise.id "
+            "JOIN routine_day ON routine_exercise.day_id = routine_day.id "
+            "JOIN routine ON routine_day.routine_id = routine.id "
+            "WHERE exercise_log.workout_session_id IS NULL "
+            "ORDER BY routine.user_id, exercise_log.time_stamp"
+        ).columns(id=Integer, time_stamp=TIMESTAMP, user_id=Integer)
+    )
+    first_id = next_id = (
+        connection.execute(text("SELECT max(id) FROM workout_session")).scalar() or 0
+    )
+    workout_sessions, assignments = [], []
+    last_user_id, last_time_stamp = None, None
+    for log_id, time_stamp, user_id in logs:
+        if user_id != last_user_id or time_stamp - last_time_stamp > session_gap:
+            next_id += 1
+            workout_sessions.append({"id": next_id, "user_id": user_id})
+        assignments.append({"log_id": log_id, "workout_session_id": next_id})
+        last_user_id, last_time_stamp = user_id, time_stamp
+
+    if workout_sessions:
+        connection.execute(
+            text(
+                "INSERT INTO workout_session (id, user_id, start_time, end_time, "
+                "num_sets, total_reps, total_duration) "
+                "VALUES (:id, :user_id, 0, 0, 0, 0, 0)"
+            ),
+            workout_sessions,
+        )
+        connection.execute(
+            text(
+                "UPDATE exercise_log SET workout_session_id = :workout_session_id "
+                "WHERE id = :log_id"
+            ),
+            assignments,
+        )
+        connection.execute(
+            text(
+                "UPDATE workout_session SET "
+                "start_time = (SELECT min(time_stamp) FROM exercise_log "
+                "WHERE workout_session_id = workout_session.id), "
+                "end_time = (SELECT max(time_stamp) FROM exercise_log "
+                "WHERE workout_session_id = workout_session.id), "
+                "num_sets = (SELECT count(*) FROM exercise_log "
+                "WHERE workout_session_id = workout_session.id), "
+                "total_reps = (SELECT coalesce(sum(num_reps), 0) FROM exercise_log "
+                "WHERE workout_session_id = workout_session.id), "
+                "total_duration = (SELECT coalesce(sum(time_duration), 0) "
+                "FROM exercise_log WHERE workout_session_id = workout_session.id) "
+                "WHERE id > :first_id"
+            ),
+            {"first_id": first_id},
+        )
+
+
+@migration(3)
+def add_sort_keys(connection: Connection) -> None:
+    """sparse sort keys on routine days and exercises instead of dense indexes"""
+    step = 1 << 16
+    for table, parent, index in [
+        ("routine_day", "routine_id", "day_idx"),
+        ("routine_exercise", "day_id", "exercise_idx"),
+    ]:
+        columns = get_columns(connection, table)
+        if "sort_key" not in columns:
+            connection.execute(
+                text(
+                    f"ALTER TABLE {table} ADD COLUMN sort_key INTEGER NOT NULL "
+                    "DEFAULT 0"
+                )
+            )
+        if index in columns:
+            # keeps the old order, spread step apart
+            connection.execute(
+                text(
+                    f"UPDATE {table} SET sort_key = :step * ("
+                    f"SELECT count(*) FROM {table} AS sibling "
+                    f"WHERE sibling.{parent} = {table}.{parent} "
+                    f"AND (coalesce(sibling.{index}, 0), sibling.id) "
+                    f"< (coalesce({table}.{index}, 0), {table}.id))"
+                ),
+                {"step": step},
+            )
+            connection.execute(
+                text(f"DROP INDEX IF EXISTS ix_{table}_{parent}_{index}")
+            )
+            connection.execute(text(f"ALTER TABLE {table} DROP COLUMN {index}"))
+        connection.execute(
+            text(
+                f"CREATE INDEX IF NOT EXISTS ix_{table}_{parent}_sort_key "
+                f"ON {table} ({parent}, sort_key)"
+            )
+        )
+
+
+@migration(4)
+def add_current_routine_index(connection: Connection) -> None:
+    """unique index on each user's current routine"""
+    # users with several current routines keep the newest one
+    execute_all(
+        connection,
+        "UPDATE routine SET is_current = 0 WHERE is_current AND id != ("
+        "SELECT max(current.id) FROM routine AS current "
+        "WHERE current.user_id = routine.user_id AND current.is_current)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_routine_user_id_is_current "
+        "ON routine (user_id) WHERE is_current",
+    )
+
+
+@migration(5)
+def store_measurements_in_metric(connection: Connection) -> None:
+    """measurements stored in canonical metric units"""
+    # rows were saved in the units of their user's system; pounds and inches
+    connection.execute(
+        text(
+            "UPDATE measurement SET "
+            "body_weight = body_weight * 0.45359237, height = height * 2.54 "
+            "WHERE user_id IN ("
+            "SELECT id FROM app_user WHERE measurement_system = 'imperial')"
+        )
+    )
+
+
+@migration(6)
+def add_unique_set_index(connection: Connection) -> None:
+    """unique set indexes per routine exercise and time stamp"""
+    # sets written twice with the same index by concurrent uploads keep their
+    # first row; the copies move past the highest index at their time stamp
+    execute_all(
+        connection,
+        "WITH ranked AS ("
+        "SELECT id, routine_exercise_id, time_stamp, set_idx, row_number() OVER ("
+        "PARTITION BY routine_exercise_id, time_stamp, set_idx ORDER BY id"
+        ") AS copy, max(set_idx) OVER ("
+        "PARTITION BY routine_exercise_id, time_stamp"
+        ") AS top FROM exercise_log), "
+        "moved AS ("
+        "SELECT id, top + row_number() OVER ("
+        "PARTITION BY routine_exercise_id, time_stamp ORDER BY id"
+        ") AS set_idx FROM ranked WHERE copy > 1 AND set_idx IS NOT NULL) "
+        "UPDATE exercise_log SET set_idx = ("
+        "SELECT set_idx FROM moved WHERE moved.id = exercise_log.id) "
+        "WHERE id IN (SELECT id FROM moved)",
+        "DROP INDEX IF EXISTS ix_exercise_log_routine_exercise_id_time_stamp",
+        "CREATE UNIQUE INDEX ix_exercise_log_routine_exercise_id_time_stamp "
+        "ON exercise_log (routine_exercise_id, time_stamp, set_idx)",
+    )
+
+
+@migration(7)
+def add_exercise_log_user_id(connection: Connection) -> None:
+    """exercise_log.user_id, indexed with time_stamp for paging a user's history"""
+    if "user_id" not in get_columns(connection, "exercise_log"):
+        connection.execute(
+            text(
+                "ALTER TABLE exercise_log ADD COLUMN user_id INTEGER "
+                "REFERENCES app_user (id)"
+            )
+        )
+    execute_all(
+        connection,
+        "UPDATE exercise_log SET user_id = ("
+        "SELECT routine.user_id FROM routine_exercise "
+        "JOIN routine_day ON routine_exercise.day_id = routine_day.id "
+        "JOIN routine ON routine_day.routine_id = routine.id "
+        "WHERE routine_exercise.id = exercise_log.routine_exercise_id)",
+        "CREATE INDEX IF NOT EXISTS ix_exercise_log_user_id_time_stamp "
+        "ON exercise_log (user_id, time_stamp, id)",
+    )
+
+
+@migration(8)
+def add_today_version(connection: Connection) -> None:
+    """app_user.today_version, checked by the today cache of every worker"""
+    if "today_version" not in get_columns(connection, "app_user"):
+        connection.execute(
+            text(
+                "ALTER TABLE app_user ADD COLUMN today_version INTEGER NOT NULL "
+                "DEFAULT '0'"
+            )
+        )
+
+
+def latest_version() -> int:
+    return max(MIGRATIONS, default=0)
+
+
+def get_version(connection: Connection) -> int:
+    SchemaVersion.__table__.create(connection, checkfirst=True)
+    version = connection.execute(select(func.max(SchemaVersion.version))).scalar()
+    return version or 0
+
+
+def record_version(connection: Connection, version: int) -> None:
+    connection.execute(
+        insert(SchemaVersion).values(
+            version=version,
+            description=MIGRATIONS[version].__doc__,
+            applied_at=datetime.utcnow(),
+        )
+    )
+
+
+def upgrade(engine: Engine) -> list[int]:
+    """applies every pending migration, each in its own transaction"""
+    applied = []
+    for version in sorted(MIGRATIONS):
+        with engine.begin() as connection:
+            if version <= get_version(connection):
+                continue
+            MIGRATIONS[version](connection)
+            record_version(connection, version)
+        applied.append(version)
+
+    if applied:
+        # migrations write rows behind the today caches of running workers
+        with engine.begin() as connection:
+            connection.execute(
+                text("UPDATE app_user SET today_version = today_version + 1")
+            )
+
+    return applied
+
+
+def stamp(engine: Engine) -> None:
+    """marks a database created from the current models as fully migrated"""
+    with engine.begin() as connection:
+        current = get_version(connection)
+        for version in sorted(MIGRATIONS):
+            if version > current:
+                record_version(connection, version)
+
+
+if __name__ == "__main__":
+    engine = get_engine(config.config["DATABASE"]["CONN_STRING"])
+    applied = upgrade(engine)
+    if applied:
+        print(f"applied migrations {applied}")
+    else:
+        print(f"database already at version {latest_version()}")
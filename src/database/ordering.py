@@ -0,0 +1,172 @@
+from sqlalchemy import Column, ScalarSelect, func, select, tuple_, update
+from sqlalchemy.orm import Session
+from src.database.common import Base
+
+# distance between the keys of neighbouring children in a sparse collection,
+# so an insert or a move can almost always take the midpoint of its new
+# neighbours and write a single row
+STEP = 1 << 16
+
+# a position past the end of any collection
+MAX_POSITION = 1 << 62
+
+
+class OrderedCollection:
+    """
+    the children of one parent row, ordered by an integer key column: the days
+    of a routine, the exercises of a day, the sets of a routine exercise.
+    with step=1 the keys are dense positions; with a larger step they are
+    sparse and positions are derived from them on read. unique is for keys
+    under a unique index
+    """
+
+    def __init__(
+        self,
+        model: type[Base],
+        parent: Column,
+        key: Column,
+        step: int = STEP,
+        unique: bool = False,
+    ):
+        self.model = model
+        self.parent = parent
+        self.key = key
+        self.step = step
+        self.unique = unique
+
+    def next_key(self, parent_id: int) -> ScalarSelect:
+        """the key after the last child, as a subquery for the insert to use"""
+        return (
+            select(func.coalesce(func.max(self.key) + self.step, 0))
+            .where(self.parent == parent_id)
+            .scalar_subquery()
+        )
+
+    def renumber(self, session: Session, parent_id: int) -> None:
+        """
+        spreads parent_id's children to keys position * step with a single
+        UPDATE ... FROM over a row_number() window (two for unique keys); rows
+        that are already in place are not written
+        """
+        ranked = (
+            select(
+                self.model.id,
+                (
+                    (func.row_number().over(order_by=(self.key, self.model.id)) - 1)
+                    * self.step
+                ).label("new_key"),
+            )
+            .where(self.parent == parent_id)
+            .subquery()
+        )
+        new_key = ranked.c.new_key
+        if self.unique:
+            # sqlite checks a unique index row by row, so the rows are parked
+            # on negative keys first, which no row uses
+            new_key = -1 - new_key
+        session.execute(
+            update(self.model)
+            .where(self.model.id == ranked.c.id, self.key != ranked.c.new_key)
+            .values({self.key: new_key})
+            .execution_options(synchronize_session=False)
+        )
+        if self.unique:
+            session.execute(
+                update(self.model)
+                .where(self.parent == parent_id, self.key < 0)
+                .values({self.key: -1 - self.key})
+                .execution_options(synchronize_session=False)
+            )
+
+    def key_at(
+        self, session: Session, parent_id: int, position: int, exclude_id: int = None
+    ) -> int:
+        """
+        a free key that puts a child at position among the other children
+        (exclude_id being the one that moves). in the rare case its neighbours
+        there have no room left between them, the collection is renumbered first
+        """
+        siblings = [self.parent == parent_id]
+        if exclude_id is not None:
+            siblings.append(self.model.id != exclude_id)
+        ordered = select(self.key).where(*siblings).order_by(self.key, self.model.id)
+
+        while True:
+            if position <= 0:
+                before, after = None, session.scalar(ordered.limit(1))
+            else:
+                neighbours = session.scalars(
+                    ordered.offset(position - 1).limit(2)
+                ).all()
+                if len(neighbours) == 0:
+                    # past the end
+                    neighbours = [
+                        session.scalar(select(func.max(self.key)).where(*siblings))
+                    ]
+                before = neighbours[0]
+                after = neighbours[1] if len(neighbours) == 2 else None
+
+            key = self.key_between(before, after)
+            if key is not None:
+                return key
+            self.renumber(session, parent_id)
+
+    def key_between(self, before: int | None, after: int | None) -> int | None:
+        """a key strictly between two neighbours, None if there is none"""
+        if before is None and after is None:
+            return 0
+        elif after is None:
+            return before + self.step
+        elif before is None:
+            return after - self.step
+        elif after - before > 1:
+            return (before + after) // 2
+        return None
+
+    def move(self, session: Session, child_id: int, position: int) -> bool:
+        """
+        moves a child to position among its siblings by writing only its own
+        key. returns False if there is no such child
+        """
+        parent_id = session.scalar(select(self.parent).where(self.model.id == child_id))
+        if parent_id is None:
+            return False
+        key = self.key_at(session, parent_id, position, exclude_id=child_id)
+        session.execute(
+            update(self.model)
+            .where(self.model.id == child_id)
+            .values({self.key: key})
+            .execution_options(synchronize_session=False)
+        )
+        return True
+
+    def move_before(
+        self, session: Session, child_id: int, before_id: int | None = None
+    ) -> bool:
+        """
+        moves a child in front of its sibling before_id, or to the end without
+        one, by writing only its own key. returns False unless both exist and
+        share a parent
+        """
+        if before_id is None:
+            return self.move(session, child_id, MAX_POSITION)
+
+        rows = {
+            id: (parent_id, key)
+            for id, parent_id, key in session.execute(
+                select(self.model.id, self.parent, self.key).where(
+                    self.model.id.in_((child_id, before_id))
+                )
+            )
+        }
+        if len(rows) != 2 or rows[child_id][0] != rows[before_id][0]:
+            return False
+        parent_id, key = rows[before_id]
+        position = session.scalar(
+            select(func.count()).where(
+                self.parent == parent_id,
+                self.model.id != child_id,
+                tuple_(self.key, self.model.id) < tuple_(key, before_id),
+            )
+        )
+        return self.move(session, child_id, position)
@@ -1,18 +1,54 @@
+from datetime import date, datetime
 from typing import List
-from src.database.common import DatabaseInterface, Routine
+from sqlalchemy import (
+    ScalarSelect,
+    and_,
+    exists,
+    func,
+    insert,
+    literal,
+    select,
+    update,
+)
+from sqlalchemy.orm import Session, joinedload, selectinload
+from src.database.common import (
+    DatabaseInterface,
+    ExerciseLog,
+    Routine,
+    RoutineDay,
+    RoutineExercise,
+    WarmUp,
+    WarmUpSet,
+)
+from src.database import session_totals, today
+
+
+def clear_current(
+    session: Session, user_id: int | ScalarSelect, keep_id: int = None
+) -> None:
+    """
+    unsets the user's current routine (other than keep_id) so another one can
+    take its place under the one-current-routine-per-user index
+    """
+    query = update(Routine).where(Routine.user_id == user_id, Routine.is_current)
+    if keep_id is not None:
+        query = query.where(Routine.id != keep_id)
+    session.execute(
+        query.values(is_current=False).execution_options(synchronize_session=False)
+    )
 
 
 class Interface(DatabaseInterface):
     def add_routine(
         self, user_id: int, routine_name: str, num_days: int, is_current: bool = None
     ) -> Routine:
-        any_routines = len(self.get_all_user_routines(user_id)) > 0
-
+        session = self.Session()
         if is_current is None:
-            if not any_routines:
-                is_current = True
-            else:
-                is_current = False
+            is_current = not session.scalar(
+                select(exists().where(Routine.user_id == user_id))
+            )
+        elif is_current:
+            clear_current(session, user_id)
 
         routine = Routine(
             user_id=user_id,
@@ -21,8 +57,146 @@ class Interface(DatabaseInterface):
             is_current=is_current,
         )
 
-        session = self.Session()
         session.add(routine)
+        today.touch(session, ("user", user_id))
+        session.commit()
+        session.refresh(routine)
+        session.close()
+
+        return routine
+
+    def clone_routine(self, routine_id: int, target_user_id: int):
+        """
+        copies a public routine (or one of target_user_id's own) with its days,
+        exercises and warmup schemas to target_user_id in one transaction. each
+        table is copied by a single INSERT ... SELECT; new day and warmup ids
+        are numbered on from the current maximum so the copied exercises can be
+        pointed at them in the same statements
+        """
+        session = self.Session()
+        routine = session.scalars(
+            insert(Routine)
+            .from_select(
+                ["routine_name", "user_id", "num_days", "is_current", "is_public"],
+                select(
+                    Routine.routine_name,
+                    literal(target_user_id),
+                    Routine.num_days,
+                    ~exists().where(Routine.user_id == target_user_id),
+                    literal(False),
+                ).where(
+                    Routine.id == routine_id,
+                    Routine.is_public | (Routine.user_id == target_user_id),
+                ),
+            )
+            .returning(Routine)
+        ).first()
+        if routine is None:
+            session.close()
+            return {"message": f"routine {routine_id} not found or not public"}
+
+        # the insert above holds the write lock, so the ids stay free
+        day_base, warmup_base = session.execute(
+            select(
+                select(func.coalesce(func.max(RoutineDay.id), 0)).scalar_subquery(),
+                select(func.coalesce(func.max(WarmUp.id), 0)).scalar_subquery(),
+            )
+        ).one()
+        day_ids = (
+            select(
+                RoutineDay.id.label("old_id"),
+                (day_base + func.row_number().over(order_by=RoutineDay.id)).label(
+                    "new_id"
+                ),
+            )
+            .where(RoutineDay.routine_id == routine_id)
+            .subquery()
+        )
+        warmup_ids = (
+            select(
+                WarmUp.id.label("old_id"),
+                (warmup_base + func.row_number().over(order_by=WarmUp.id)).label(
+                    "new_id"
+                ),
+            )
+            .where(
+                WarmUp.id.in_(
+                    select(RoutineExercise.warmup_schema)
+                    .join(RoutineDay, RoutineExercise.day_id == RoutineDay.id)
+                    .where(RoutineDay.routine_id == routine_id)
+                )
+            )
+            .subquery()
+        )
+
+        session.execute(
+            insert(RoutineDay).from_select(
+                ["id", "routine_id", "sort_key", "routine_day_name", "day_of_week"],
+                select(
+                    day_ids.c.new_id,
+                    literal(routine.id),
+                    RoutineDay.sort_key,
+                    RoutineDay.routine_day_name,
+                    RoutineDay.day_of_week,
+                ).join(day_ids, day_ids.c.old_id == RoutineDay.id),
+            )
+        )
+        session.execute(
+            insert(WarmUp).from_select(
+                ["id", "num_sets", "default_reps", "default_time"],
+                select(
+                    warmup_ids.c.new_id,
+                    WarmUp.num_sets,
+                    WarmUp.default_reps,
+                    WarmUp.default_time,
+                ).join(warmup_ids, warmup_ids.c.old_id == WarmUp.id),
+            )
+        )
+        session.execute(
+            insert(WarmUpSet).from_select(
+                [
+                    "warmup_id",
+                    "set_idx",
+                    "num_reps",
+                    "time_duration",
+                    "working_percentage",
+                ],
+                select(
+                    warmup_ids.c.new_id,
+                    WarmUpSet.set_idx,
+                    WarmUpSet.num_reps,
+                    WarmUpSet.time_duration,
+                    WarmUpSet.working_percentage,
+                ).join(warmup_ids, warmup_ids.c.old_id == WarmUpSet.warmup_id),
+            )
+        )
+        session.execute(
+            insert(RoutineExercise).from_select(
+                [
+                    "exercise_id",
+                    "day_id",
+                    "sort_key",
+                    "num_sets",
+                    "default_reps",
+                    "default_time",
+                    "warmup_schema",
+                ],
+                select(
+                    RoutineExercise.exercise_id,
+                    day_ids.c.new_id,
+                    RoutineExercise.sort_key,
+                    RoutineExercise.num_sets,
+                    RoutineExercise.default_reps,
+                    RoutineExercise.default_time,
+                    warmup_ids.c.new_id,
+                )
+                .join(day_ids, day_ids.c.old_id == RoutineExercise.day_id)
+                .outerjoin(
+                    warmup_ids, warmup_ids.c.old_id == RoutineExercise.warmup_schema
+                ),
+            )
+        )
+        today.touch(session, ("user", target_user_id))
         session.commit()
         session.refresh(routine)
         session.close()
@@ -36,6 +210,17 @@ class Interface(DatabaseInterface):
 
         return routines
 
+    def get_current_routine(self, user_id: int) -> Routine:
+        session = self.Session()
+        routine = (
+            session.query(Routine)
+            .filter(Routine.user_id == user_id, Routine.is_current)
+            .first()
+        )
+        session.close()
+
+        return routine
+
     def get_routine_by_id(self, routine_id: int) -> Routine:
         session = self.Session()
         routine = session.query(Routine).filter(Routine.id == routine_id).first()
@@ -43,6 +228,150 @@ class Interface(DatabaseInterface):
 
         return routine
 
+    def get_routine_tree(self, routine_id: int) -> Routine:
+        """
+        the routine with its days, their exercises and each exercise's details
+        and warmup schema loaded, in four queries however large the routine is
+        """
+        session = self.Session()
+        routine = (
+            session.query(Routine)
+            .options(
+                selectinload(Routine.days)
+                .selectinload(RoutineDay.exercises)
+                .options(
+                    joinedload(RoutineExercise.exercise),
+                    joinedload(RoutineExercise.warmup).selectinload(WarmUp.sets),
+                )
+            )
+            .filter(Routine.id == routine_id)
+            .first()
+        )
+        session.close()
+
+        return routine
+
+    def get_today(self, user_id: int, day: date = None) -> dict:
+        """
+        what the app shows on open: the current routine, its days scheduled for
+        day's day of week with their exercises, and the sets of the last workout
+        each exercise was logged in. served from the per-user today cache, which
+        writes to those rows invalidate. day is the user's own date; without
+        one it is today in utc, which is a different day for part of the day
+        everywhere else
+        """
+        day = day or datetime.utcnow().date()
+        session = self.Session()
+        # read first, so the rows below are at least as new as the version
+        version = session.scalar(today.version_query(user_id))
+        projection = today.get(self.engine, user_id, day, version)
+        if projection is not None:
+            session.close()
+            return projection
+
+        day_of_week = today.day_of_week(day)
+        rows = session.execute(
+            select(
+                Routine.id,
+                Routine.routine_name,
+                RoutineDay.id,
+                RoutineDay.day_of_week,
+            )
+            .outerjoin(RoutineDay, RoutineDay.routine_id == Routine.id)
+            .where(Routine.user_id == user_id, Routine.is_current)
+        ).all()
+        routine = None
+        day_ids, days, exercises, logs = [], [], [], []
+        if rows:
+            routine = {"id": rows[0][0], "routine_name": rows[0][1]}
+            day_ids = [row[2] for row in rows if row[3] == day_of_week]
+        if day_ids:
+            days = (
+                session.query(RoutineDay)
+                .options(
+                    joinedload(RoutineDay.exercises).joinedload(
+                        RoutineExercise.exercise
+                    )
+                )
+                .filter(RoutineDay.id.in_(day_ids))
+                .order_by(RoutineDay.sort_key, RoutineDay.id)
+                .all()
+            )
+            exercises = [e for d in days for e in d.exercises]
+        if exercises:
+            # the workout each exercise was last logged in, one index seek each
+            last_workout = (
+                select(ExerciseLog.workout_session_id)
+                .where(ExerciseLog.routine_exercise_id == RoutineExercise.id)
+                .order_by(ExerciseLog.time_stamp.desc(), ExerciseLog.id.desc())
+                .limit(1)
+                .correlate(RoutineExercise)
+                .scalar_subquery()
+            )
+            last = (
+                select(
+                    RoutineExercise.id.label("routine_exercise_id"),
+                    last_workout.label("workout_session_id"),
+                )
+                .where(RoutineExercise.id.in_([e.id for e in exercises]))
+                .subquery()
+            )
+            logs = session.scalars(
+                select(ExerciseLog)
+                .join(
+                    last,
+                    and_(
+                        last.c.routine_exercise_id == ExerciseLog.routine_exercise_id,
+                        last.c.workout_session_id == ExerciseLog.workout_session_id,
+                    ),
+                )
+                .order_by(ExerciseLog.time_stamp, ExerciseLog.id)
+            ).all()
+        # a user without a row has no version to check an entry against
+        cacheable = version is not None and not today.pending(session)
+        session.close()
+
+        last_sets = {e.id: [] for e in exercises}
+        for log in logs:
+            last_sets[log.routine_exercise_id].append(
+                {
+                    column.key: getattr(log, column.key)
+                    for column in ExerciseLog.__table__.columns
+                }
+            )
+        projection = {
+            "date": day,
+            "day_of_week": day_of_week,
+            "routine": routine,
+            "days": [
+                {
+                    "id": d.id,
+                    "day_idx": d.day_idx,
+                    "routine_day_name": d.routine_day_name,
+                    "exercises": [
+                        {
+                            "id": e.id,
+                            "exercise_idx": e.exercise_idx,
+                            "num_sets": e.num_sets,
+                            "default_reps": e.default_reps,
+                            "default_time": e.default_time,
+                            "exercise": {
+                                column.key: getattr(e.exercise, column.key)
+                                for column in e.exercise.__table__.columns
+                            },
+                            "last_sets": last_sets[e.id],
+                        }
+                        for e in d.exercises
+                    ],
+                }
+                for d in days
+            ],
+        }
+        if cacheable:
+            today.put(self.engine, user_id, day, version, projection)
+
+        return projection
+
     def edit_routine(self, routine_id: int, **kwargs):
         session = self.Session()
         routine_update = {
@@ -51,6 +380,7 @@ class Interface(DatabaseInterface):
             if k in ["routine_name", "num_days"] and k in Routine.__table__.columns
         }
         session.query(Routine).filter(Routine.id == routine_id).update(routine_update)
+        today.touch(session, ("routine", routine_id))
         session.commit()
 
         routine = self.get_routine_by_id(routine_id)
@@ -64,31 +394,37 @@ class Interface(DatabaseInterface):
         session.query(Routine).filter(Routine.id == routine_id).update(
             {"is_current": False}
         )
+        today.touch(session, ("routine", routine_id))
         session.commit()
         routine = self.get_routine_by_id(routine_id)
         session.close()
         return routine
 
     def make_routine_current(self, routine_id: int):
-        session = self.Session()
-        routine = self.get_routine_by_id(routine_id)
-        user_id = routine.user_id
-        routine_ids = [
-            r.id for r in self.get_all_user_routines(user_id) if r != routine_id
-        ]
-
-        for i in routine_ids:
-            self.make_routine_not_current(i)
-
-        session.query(Routine).filter(Routine.id == routine_id).update(
-            {"is_current": True}
+        """
+        switches the user's current routine in one transaction: the old one is
+        unset before the new one is set, since the unique index on current
+        routines is checked row by row
+        """
+        user_id = (
+            select(Routine.user_id).where(Routine.id == routine_id).scalar_subquery()
         )
-
+        session = self.Session()
+        clear_current(session, user_id, keep_id=routine_id)
+        routine = session.scalars(
+            update(Routine)
+            .where(Routine.id == routine_id)
+            .values(is_current=True)
+            .returning(Routine)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if routine is not None:
+            today.touch(session, ("user", routine.user_id))
         session.commit()
+        if routine is not None:
+            session.refresh(routine)
         session.close()
 
-        routine = self.get_routine_by_id(routine_id)
-
         return routine
 
     def delete_routine(self, routine_id: int) -> None:
@@ -97,6 +433,16 @@ class Interface(DatabaseInterface):
 
         if routine:
             session.delete(routine)
+            # the routine's sets go with it, and their sessions are refreshed
+            session_totals.delete_sets(
+                session,
+                ExerciseLog.routine_exercise_id.in_(
+                    select(RoutineExercise.id)
+                    .join(RoutineDay)
+                    .where(RoutineDay.routine_id == routine_id)
+                ),
+            )
+            today.touch(session, ("routine", routine_id))
             session.commit()
 
         session.close()
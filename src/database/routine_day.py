@@ -1,24 +1,37 @@
-from src.database import routine
-from src.database.common import RoutineDay
+from sqlalchemy import insert, select
+from src.database import ordering, routine, session_totals, today
+from src.database.common import ExerciseLog, RoutineDay, RoutineExercise
 
+DAYS = ordering.OrderedCollection(
+    RoutineDay, RoutineDay.routine_id, RoutineDay.sort_key
+)
 
-class Interface(routine.Interface):
-    def add_routine_day(self, routine_id: int, routine_day_name: str, day_of_week: str):
-        routine_days = self.get_days_by_routine_id(routine_id)
-        day_idxs = [d.day_idx for d in routine_days]
-        if day_idxs == []:
-            day_idx = 0
-        else:
-            day_idx = max(day_idxs) + 1
-        day = RoutineDay(
-            routine_id=routine_id,
-            day_idx=day_idx,
-            routine_day_name=routine_day_name,
-            day_of_week=day_of_week,
-        )
 
+class Interface(routine.Interface):
+    def add_routine_day(
+        self,
+        routine_id: int,
+        routine_day_name: str,
+        day_of_week: str,
+        day_idx: int = None,
+    ):
+        """appends the day, or inserts it at day_idx, without touching the others"""
         session = self.Session()
-        session.add(day)
+        if day_idx is None:
+            sort_key = DAYS.next_key(routine_id)
+        else:
+            sort_key = DAYS.key_at(session, routine_id, day_idx)
+        day = session.scalars(
+            insert(RoutineDay)
+            .values(
+                routine_id=routine_id,
+                sort_key=sort_key,
+                routine_day_name=routine_day_name,
+                day_of_week=day_of_week,
+            )
+            .returning(RoutineDay)
+        ).one()
+        today.touch(session, ("routine", routine_id))
         session.commit()
         session.refresh(day)
         session.close()
@@ -27,7 +40,10 @@ class Interface(routine.Interface):
     def get_days_by_routine_id(self, routine_id: int):
         session = self.Session()
         routine_days = (
-            session.query(RoutineDay).filter(RoutineDay.routine_id == routine_id).all()
+            session.query(RoutineDay)
+            .filter(RoutineDay.routine_id == routine_id)
+            .order_by(RoutineDay.sort_key, RoutineDay.id)
+            .all()
         )
         session.close()
 
@@ -48,7 +64,8 @@ class Interface(routine.Interface):
         routine_day = (
             session.query(RoutineDay)
             .filter(RoutineDay.routine_id == routine_id)
-            .filter(RoutineDay.day_idx == day_idx)
+            .order_by(RoutineDay.sort_key, RoutineDay.id)
+            .offset(day_idx)
             .first()
         )
 
@@ -61,11 +78,18 @@ class Interface(routine.Interface):
         routine_day_update = {
             k: v
             for k, v in kwargs.items()
-            if k in RoutineDay.__table__.columns and k != "id"
+            if k in RoutineDay.__table__.columns and k not in ("id", "sort_key")
         }
-        session.query(RoutineDay).filter(RoutineDay.id == day_id).update(
-            routine_day_update
-        )
+        # before the update, which may move the day to another routine
+        today.touch(session, ("routine_day", day_id))
+        if routine_day_update:
+            session.query(RoutineDay).filter(RoutineDay.id == day_id).update(
+                routine_day_update
+            )
+        if kwargs.get("day_idx") is not None:
+            DAYS.move(session, day_id, kwargs["day_idx"])
+        if "routine_id" in routine_day_update:
+            today.touch(session, ("routine", routine_day_update["routine_id"]))
         session.commit()
 
         routine_day = self.get_routine_day_by_id(day_id)
@@ -74,17 +98,34 @@ class Interface(routine.Interface):
 
         return routine_day
 
-    def reset_day_idxs(self, routine_id: int):
-        routine_days = self.get_days_by_routine_id(routine_id)
-        routine_days = sorted(routine_days, key=lambda x: x.day_idx)
+    def move_day(self, day_id: int, before_day_id: int = None):
+        """
+        moves a day in front of before_day_id, or to the end of its routine
+        without one. only the moved day is written
+        """
+        session = self.Session()
+        moved = DAYS.move_before(session, day_id, before_day_id)
+        today.touch(session, ("routine_day", day_id))
+        session.commit()
+        session.close()
+        if not moved:
+            return {"message": f"can't move day {day_id} before {before_day_id}"}
+        return self.get_routine_day_by_id(day_id)
 
+    def move_day_to_idx(self, day_id: int, day_idx: int):
         session = self.Session()
+        moved = DAYS.move(session, day_id, day_idx)
+        today.touch(session, ("routine_day", day_id))
+        session.commit()
+        session.close()
+        if not moved:
+            return {"message": f"day {day_id} not found"}
+        return self.get_routine_day_by_id(day_id)
 
-        for n, d in enumerate(routine_days):
-            if d.day_idx != n:
-                session.query(RoutineDay).filter(RoutineDay.id == d.id).update(
-                    {"day_idx": n}
-                )
+    def reset_day_idxs(self, routine_id: int):
+        """spreads the routine's sort keys evenly again"""
+        session = self.Session()
+        DAYS.renumber(session, routine_id)
         session.commit()
         session.close()
 
@@ -92,10 +133,15 @@ class Interface(routine.Interface):
         session = self.Session()
         day = session.query(RoutineDay).filter(RoutineDay.id == day_id).first()
         if day:
-            routine_id = day.routine_id
             session.delete(day)
+            session_totals.delete_sets(
+                session,
+                ExerciseLog.routine_exercise_id.in_(
+                    select(RoutineExercise.id).where(RoutineExercise.day_id == day_id)
+                ),
+            )
+            today.touch(session, ("routine_day", day_id))
             session.commit()
-            self.reset_day_idxs(routine_id)
         session.close()
 
     def delete_days_by_routine_id(self, routine_id: int) -> None:
@@ -103,5 +149,6 @@ class Interface(routine.Interface):
 
         session = self.Session()
         session.query(RoutineDay).filter(RoutineDay.routine_id == routine_id).delete()
+        today.touch(session, ("routine", routine_id))
         session.commit()
         session.close()
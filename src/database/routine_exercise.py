@@ -1,5 +1,10 @@
-from src.database.common import RoutineExercise
-from src.database import routine_day
+from sqlalchemy import insert
+from src.database.common import ExerciseLog, RoutineExercise
+from src.database import ordering, routine_day, session_totals, today
+
+EXERCISES = ordering.OrderedCollection(
+    RoutineExercise, RoutineExercise.day_id, RoutineExercise.sort_key
+)
 
 
 class Interface(routine_day.Interface):
@@ -13,24 +18,29 @@ class Interface(routine_day.Interface):
         warmup_schema: int = None,
         exercise_idx: int = None,
     ):
-        routine_exercises = self.get_exercises_by_routine_day_id(day_id)
-        exercise_idxs = [d.exercise_idx for d in routine_exercises]
-        if exercise_idxs == []:
-            exercise_idx = 0
-        else:
-            exercise_idx = max(exercise_idxs) + 1
-        exercise = RoutineExercise(
-            day_id=day_id,
-            exercise_id=exercise_id,
-            exercise_idx=exercise_idx,
-            num_sets=num_sets,
-            default_reps=default_reps,
-            default_time=default_time,
-            warmup_schema=warmup_schema,
-        )
-
+        """
+        appends the exercise to the day, or inserts it at exercise_idx, without
+        touching the others
+        """
         session = self.Session()
-        session.add(exercise)
+        if exercise_idx is None:
+            sort_key = EXERCISES.next_key(day_id)
+        else:
+            sort_key = EXERCISES.key_at(session, day_id, exercise_idx)
+        exercise = session.scalars(
+            insert(RoutineExercise)
+            .values(
+                day_id=day_id,
+                exercise_id=exercise_id,
+                sort_key=sort_key,
+                num_sets=num_sets,
+                default_reps=default_reps,
+                default_time=default_time,
+                warmup_schema=warmup_schema,
+            )
+            .returning(RoutineExercise)
+        ).one()
+        today.touch(session, ("routine_day", day_id))
         session.commit()
         session.refresh(exercise)
         session.close()
@@ -42,6 +52,7 @@ class Interface(routine_day.Interface):
         routine_exercises = (
             session.query(RoutineExercise)
             .filter(RoutineExercise.day_id == day_id)
+            .order_by(RoutineExercise.sort_key, RoutineExercise.id)
             .all()
         )
         session.close()
@@ -64,7 +75,8 @@ class Interface(routine_day.Interface):
         routine_exercise = (
             session.query(RoutineExercise)
             .filter(RoutineExercise.day_id == routine_day_id)
-            .filter(RoutineExercise.exercise_idx == exercise_idx)
+            .order_by(RoutineExercise.sort_key, RoutineExercise.id)
+            .offset(exercise_idx)
             .first()
         )
         session.close()
@@ -75,11 +87,18 @@ class Interface(routine_day.Interface):
         routine_exercise_update = {
             k: v
             for k, v in kwargs.items()
-            if k in RoutineExercise.__table__.columns and k != "id"
+            if k in RoutineExercise.__table__.columns and k not in ("id", "sort_key")
         }
-        session.query(RoutineExercise).filter(
-            RoutineExercise.id == routine_exercise_id
-        ).update(routine_exercise_update)
+        # before the update, which may move the exercise to another day
+        today.touch(session, ("routine_exercise", routine_exercise_id))
+        if routine_exercise_update:
+            session.query(RoutineExercise).filter(
+                RoutineExercise.id == routine_exercise_id
+            ).update(routine_exercise_update)
+        if kwargs.get("exercise_idx") is not None:
+            EXERCISES.move(session, routine_exercise_id, kwargs["exercise_idx"])
+        if "day_id" in routine_exercise_update:
+            today.touch(session, ("routine_day", routine_exercise_update["day_id"]))
         session.commit()
 
         routine_day = self.get_routine_exercise_by_id(routine_exercise_id)
@@ -88,17 +107,37 @@ class Interface(routine_day.Interface):
 
         return routine_day
 
-    def reset_exercise_idxs(self, day_id: int):
-        routine_exercises = self.get_exercises_by_routine_day_id(day_id)
-        routine_exercises = sorted(routine_exercises, key=lambda x: x.exercise_idx)
-
+    def move_exercise(self, routine_exercise_id: int, before_id: int = None):
+        """
+        moves an exercise in front of before_id, or to the end of its day
+        without one. only the moved exercise is written
+        """
         session = self.Session()
+        moved = EXERCISES.move_before(session, routine_exercise_id, before_id)
+        today.touch(session, ("routine_exercise", routine_exercise_id))
+        session.commit()
+        session.close()
+        if not moved:
+            return {
+                "message": f"can't move exercise {routine_exercise_id} before "
+                f"{before_id}"
+            }
+        return self.get_routine_exercise_by_id(routine_exercise_id)
+
+    def move_exercise_to_idx(self, routine_exercise_id: int, exercise_idx: int):
+        session = self.Session()
+        moved = EXERCISES.move(session, routine_exercise_id, exercise_idx)
+        today.touch(session, ("routine_exercise", routine_exercise_id))
+        session.commit()
+        session.close()
+        if not moved:
+            return {"message": f"routine exercise {routine_exercise_id} not found"}
+        return self.get_routine_exercise_by_id(routine_exercise_id)
 
-        for n, e in enumerate(routine_exercises):
-            if e.exercise_idx != n:
-                session.query(RoutineExercise).filter(
-                    RoutineExercise.id == e.id
-                ).update({"exercise_idx": n})
+    def reset_exercise_idxs(self, day_id: int):
+        """spreads the day's sort keys evenly again"""
+        session = self.Session()
+        EXERCISES.renumber(session, day_id)
         session.commit()
         session.close()
 
@@ -110,10 +149,12 @@ class Interface(routine_day.Interface):
             .first()
         )
         if exercise:
-            day_id = exercise.day_id
             session.delete(exercise)
+            session_totals.delete_sets(
+                session, ExerciseLog.routine_exercise_id == routine_exercise_id
+            )
+            today.touch(session, ("routine_exercise", routine_exercise_id))
             session.commit()
-            self.reset_exercise_idxs(day_id)
         session.close()
 
     def delete_exercises_by_day_id(self, day_id: int) -> None:
@@ -121,5 +162,6 @@ class Interface(routine_day.Interface):
 
         session = self.Session()
         session.query(RoutineExercise).filter(RoutineExercise.day_id == day_id).delete()
+        today.touch(session, ("routine_day", day_id))
         session.commit()
         session.close()
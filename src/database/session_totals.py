@@ -0,0 +1,71 @@
+"""
+keeps the bounds and totals of workout sessions in line with their sets. kept
+apart from workout_session.py, whose Interface sits above the routine
+interfaces, so the routine and user delete paths can use it as well
+"""
+
+from typing import Iterable
+from sqlalchemy import delete, exists, func, select, update
+from sqlalchemy.orm import Session
+from src.database.common import ExerciseLog, WorkoutSession
+
+
+def aggregates() -> dict:
+    """update values that recompute a session's bounds and totals from its sets"""
+
+    def aggregate(column):
+        return (
+            select(column)
+            .where(ExerciseLog.workout_session_id == WorkoutSession.id)
+            .scalar_subquery()
+        )
+
+    return {
+        "start_time": aggregate(func.min(ExerciseLog.time_stamp)),
+        "end_time": aggregate(func.max(ExerciseLog.time_stamp)),
+        "num_sets": aggregate(func.count()),
+        "total_reps": aggregate(func.coalesce(func.sum(ExerciseLog.num_reps), 0)),
+        "total_duration": aggregate(
+            func.coalesce(func.sum(ExerciseLog.time_duration), 0)
+        ),
+    }
+
+
+def refresh(
+    session: Session, workout_session_ids: Iterable[int], drop_empty: bool = True
+) -> None:
+    """
+    recomputes bounds and totals of the given sessions from their own sets
+    (an index range per session). with drop_empty, sessions left without sets
+    are deleted first; batch inserts skip that since they only add sets
+    """
+    workout_session_ids = {id for id in workout_session_ids if id is not None}
+    if len(workout_session_ids) == 0:
+        return
+
+    if drop_empty:
+        session.execute(
+            delete(WorkoutSession)
+            .where(
+                WorkoutSession.id.in_(workout_session_ids),
+                ~exists().where(ExerciseLog.workout_session_id == WorkoutSession.id),
+            )
+            .execution_options(synchronize_session=False)
+        )
+    session.execute(
+        update(WorkoutSession)
+        .where(WorkoutSession.id.in_(workout_session_ids))
+        .values(**aggregates())
+        .execution_options(synchronize_session=False)
+    )
+
+
+def delete_sets(session: Session, *where) -> None:
+    """deletes the sets matching where, then refreshes or drops their sessions"""
+    workout_session_ids = session.scalars(
+        delete(ExerciseLog)
+        .where(*where)
+        .returning(ExerciseLog.workout_session_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    refresh(session, workout_session_ids)
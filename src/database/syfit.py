@@ -1,3 +1,8 @@
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Callable, Iterator
+from sqlalchemy import inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
 from src.database import (
     common,
     user,
@@ -5,8 +10,10 @@ from src.database import (
     routine,
     routine_day,
     routine_exercise,
+    workout_session,
     exercise_log,
     exercise,
+    migrations,
 )
 from src import config
 
@@ -19,13 +26,164 @@ class Syfit(common.DatabaseInterface):
         self.routine = routine.Interface(conn_string)
         self.routine_day = routine_day.Interface(conn_string)
         self.routine_exercise = routine_exercise.Interface(conn_string)
+        self.workout_session = workout_session.Interface(conn_string)
         self.exercise_log = exercise_log.Interface(conn_string)
         self.exercise = exercise.Interface(conn_string)
+        self.uow_session: common.UnitOfWorkSession | None = None
+
+    def interfaces(self) -> list[common.DatabaseInterface]:
+        return [
+            self,
+            self.user,
+            self.measurement,
+            self.routine,
+            self.routine_day,
+            self.routine_exercise,
+            self.workout_session,
+            self.exercise_log,
+            self.exercise,
+        ]
+
+    def create_tables(self):
+        # only a database built from the models here is at the latest version;
+        # one with older tables still needs its migrations
+        empty = not inspect(self.engine).get_table_names()
+        super().create_tables()
+        if empty:
+            migrations.stamp(self.engine)
+
+    def migrate(self) -> list[int]:
+        return migrations.upgrade(self.engine)
+
+    @contextmanager
+    def use_session(
+        self, session: common.UnitOfWorkSession
+    ) -> Iterator[common.UnitOfWorkSession]:
+        """points every interface at session until the block exits"""
+        session_makers = [(i, i.Session) for i in self.interfaces()]
+        for interface, _ in session_makers:
+            interface.Session = lambda: session
+        self.uow_session = session
+
+        try:
+            yield session
+        finally:
+            self.uow_session = None
+            for interface, session_maker in session_makers:
+                interface.Session = session_maker
+
+    @contextmanager
+    def unit_of_work(self) -> Iterator[common.UnitOfWorkSession]:
+        """
+        every interface method called inside the block uses the same session and
+        transaction, which is committed once on exit (rolled back on error).
+        nested calls join the outer unit of work.
+        """
+        if self.uow_session is not None:
+            yield self.uow_session
+            return
+
+        session = common.UnitOfWorkSession(bind=self.engine, expire_on_commit=False)
+        with self.use_session(session):
+            try:
+                yield session
+            except BaseException:
+                session.finish(commit=False)
+                raise
+            else:
+                session.finish(commit=True)
+
+
+class AsyncInterface:
+    """
+    exposes the public methods of a sync interface as coroutines. the sync
+    method runs through AsyncSession.run_sync, so its queries are awaited on
+    the asyncio driver instead of blocking the event loop.
+    """
+
+    def __init__(self, db: "AsyncSyfit", interface: common.DatabaseInterface):
+        self.db = db
+        self.interface = interface
+
+    def __getattr__(self, name: str) -> Any:
+        method = getattr(self.interface, name)
+        if name.startswith("_") or not callable(method):
+            return method
+
+        async def run(*args, **kwargs):
+            return await self.db.run_sync(method, *args, **kwargs)
+
+        run.__name__ = name
+        run.__doc__ = method.__doc__
+        return run
+
+
+class AsyncSyfit:
+    def __init__(self, conn_string: str):
+        self.engine = common.get_async_engine(conn_string)
+        self.sync = Syfit(conn_string)
+        self.user = AsyncInterface(self, self.sync.user)
+        self.measurement = AsyncInterface(self, self.sync.measurement)
+        self.routine = AsyncInterface(self, self.sync.routine)
+        self.routine_day = AsyncInterface(self, self.sync.routine_day)
+        self.routine_exercise = AsyncInterface(self, self.sync.routine_exercise)
+        self.workout_session = AsyncInterface(self, self.sync.workout_session)
+        self.exercise_log = AsyncInterface(self, self.sync.exercise_log)
+        self.exercise = AsyncInterface(self, self.sync.exercise)
+        self.uow_session: AsyncSession | None = None
+
+    @asynccontextmanager
+    async def unit_of_work(self) -> AsyncIterator[AsyncSession]:
+        """async version of Syfit.unit_of_work"""
+        if self.uow_session is not None:
+            yield self.uow_session
+            return
+
+        session = AsyncSession(
+            self.engine,
+            sync_session_class=common.UnitOfWorkSession,
+            expire_on_commit=False,
+        )
+        self.uow_session = session
+
+        try:
+            with self.sync.use_session(session.sync_session):
+                yield session
+        except BaseException:
+            await session.run_sync(common.UnitOfWorkSession.finish, False)
+            raise
+        else:
+            await session.run_sync(common.UnitOfWorkSession.finish, True)
+        finally:
+            self.uow_session = None
+
+    async def run_sync(self, fn: Callable, *args, **kwargs) -> Any:
+        """runs a sync interface method inside the current (or a new) unit of work"""
+        async with self.unit_of_work() as session:
+            return await session.run_sync(lambda _: fn(*args, **kwargs))
 
 
 def get_db():
     db = Syfit(config.config["DATABASE"]["CONN_STRING"])
-    try:
+    with db.unit_of_work():
+        yield db
+
+
+def get_engine() -> Engine:
+    """the shared sync engine, for routes that write outside a unit of work"""
+    return common.get_engine(config.config["DATABASE"]["CONN_STRING"])
+
+
+def get_async_engine() -> AsyncEngine:
+    """the shared engine, for routes that read outside a unit of work"""
+    return common.get_async_engine(config.config["DATABASE"]["CONN_STRING"])
+
+
+async def get_async_db():
+    """
+    the request's unit of work. routes depend on it with scope="function", so
+    it is committed before the response is sent and a failed commit is an error
+    """
+    db = AsyncSyfit(config.config["DATABASE"]["CONN_STRING"])
+    async with db.unit_of_work():
         yield db
-    finally:
-        db.Session().close()
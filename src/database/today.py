@@ -0,0 +1,153 @@
+"""
+per-user cache of the "today" projection: the current routine, its days for
+today's day of week with their exercises, and the sets last logged for each.
+writes mark the rows they change on their session with touch(), which bumps
+app_user.today_version of every user whose projection reads those rows, in the
+write's own transaction. an entry remembers the version it was built at, so a
+hit is one primary key lookup and a write made by any worker or process turns
+every other worker's entry stale once it commits. each process keeps at most
+MAX_ENTRIES entries, dropping the least recently used. callers get their own
+copy of a cached projection, so changing it leaves the cache alone
+"""
+
+import copy
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Hashable
+from sqlalchemy import Select, column, event, or_, select, table, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from src.database import constraints
+
+TOUCHED = "today_touched"
+
+MAX_ENTRIES = 10_000
+
+# (database, user_id) -> (day, today_version, projection), oldest use first
+_entries: OrderedDict[tuple[str, int], tuple[date, int, dict]] = OrderedDict()
+_lock = threading.Lock()
+
+# the columns the owner of a touched row is found through; the models import
+# this module, so they are not imported here
+_user = table("app_user", column("id"), column("today_version"))
+_routine = table("routine", column("id"), column("user_id"))
+_routine_day = table("routine_day", column("id"), column("routine_id"))
+_routine_exercise = table(
+    "routine_exercise", column("id"), column("day_id"), column("exercise_id")
+)
+
+
+def day_of_week(day: date) -> str:
+    return list(constraints.DayOfWeekCheck)[day.weekday()].value
+
+
+def database_key(engine: Engine) -> str:
+    # the sync and async engines of one database share their entries
+    url = engine.url
+    return url.set(drivername=url.get_backend_name()).render_as_string()
+
+
+def version_query(user_id: int) -> Select:
+    return select(_user.c.today_version).where(_user.c.id == user_id)
+
+
+def get(engine: Engine, user_id: int, day: date, version: int) -> dict | None:
+    """the cached projection, if it was built for day at the user's version"""
+    key = (database_key(engine), user_id)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None or entry[:2] != (day, version):
+            return None
+        _entries.move_to_end(key)
+        projection = entry[2]
+    return copy.deepcopy(projection)
+
+
+def put(engine: Engine, user_id: int, day: date, version: int, projection: dict):
+    """caches projection as built from rows read at the user's version"""
+    entry = (day, version, copy.deepcopy(projection))
+    with _lock:
+        _entries[(database_key(engine), user_id)] = entry
+        _entries.move_to_end((database_key(engine), user_id))
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+
+def invalidate_database(engine: Engine) -> None:
+    """drops every entry of a database, e.g. when it is recreated"""
+    database = database_key(engine)
+    with _lock:
+        for key in [key for key in _entries if key[0] == database]:
+            del _entries[key]
+
+
+def owners(dependencies: set[Hashable]) -> list:
+    """conditions on app_user.id matching the users who read the given rows"""
+    ids: dict[str, list[int]] = {}
+    for kind, id in dependencies:
+        ids.setdefault(kind, []).append(id)
+
+    conditions = []
+    if "user" in ids:
+        conditions.append(_user.c.id.in_(ids["user"]))
+    if "routine" in ids:
+        conditions.append(
+            _user.c.id.in_(
+                select(_routine.c.user_id).where(_routine.c.id.in_(ids["routine"]))
+            )
+        )
+    days = select(_routine.c.user_id).join(
+        _routine_day, _routine_day.c.routine_id == _routine.c.id
+    )
+    if "routine_day" in ids:
+        conditions.append(
+            _user.c.id.in_(days.where(_routine_day.c.id.in_(ids["routine_day"])))
+        )
+    exercises = days.join(
+        _routine_exercise, _routine_exercise.c.day_id == _routine_day.c.id
+    )
+    if "routine_exercise" in ids:
+        conditions.append(
+            _user.c.id.in_(
+                exercises.where(_routine_exercise.c.id.in_(ids["routine_exercise"]))
+            )
+        )
+    if "exercise" in ids:
+        conditions.append(
+            _user.c.id.in_(
+                exercises.where(_routine_exercise.c.exercise_id.in_(ids["exercise"]))
+            )
+        )
+    return conditions
+
+
+def touch(session: Session, *dependencies: Hashable) -> None:
+    """
+    marks rows a write changes, e.g. ("routine_day", day_id), and bumps the
+    today version of the users who read them. call it before deleting the rows
+    it names are flushed, while their owners can still be found
+    """
+    session.info.setdefault(TOUCHED, set()).update(dependencies)
+    conditions = owners(set(dependencies))
+    if conditions:
+        session.execute(
+            update(_user)
+            .where(or_(*conditions))
+            .values(today_version=_user.c.today_version + 1)
+        )
+
+
+def pending(session: Session) -> bool:
+    """whether the session holds writes that are not committed yet"""
+    return bool(session.info.get(TOUCHED))
+
+
+@event.listens_for(Session, "after_commit")
+def _forget_committed(session: Session) -> None:
+    session.info.pop(TOUCHED, None)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_touched(session: Session) -> None:
+    session.info.pop(TOUCHED, None)
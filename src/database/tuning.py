@@ -0,0 +1,126 @@
+from sqlalchemy import event, text
+from sqlalchemy.engine import Connection, Engine
+from src import config
+
+PRESETS = {
+    # sqlite's own defaults, plus a busy timeout so concurrent writers wait
+    # for the lock instead of failing with "database is locked"
+    "durable": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "cache_size": -2000,
+        "mmap_size": 0,
+        "busy_timeout": 5000,
+        "temp_store": "DEFAULT",
+    },
+    "balanced": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16000,
+        "mmap_size": 134217728,
+        "busy_timeout": 5000,
+        "temp_store": "MEMORY",
+    },
+    # can lose the last transactions on power loss (never on an app crash)
+    "throughput": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -64000,
+        "mmap_size": 268435456,
+        "busy_timeout": 10000,
+        "temp_store": "MEMORY",
+    },
+}
+
+DEFAULT_PRESET = "durable"
+
+# settings applied to each engine, keyed by database url
+applied_settings: dict[str, dict[str, str | int]] = {}
+
+PRAGMA_CHOICES = {
+    "journal_mode": ["DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"],
+    "synchronous": ["OFF", "NORMAL", "FULL", "EXTRA"],
+    "temp_store": ["DEFAULT", "FILE", "MEMORY"],
+}
+
+PRAGMA_INTEGERS = ["cache_size", "mmap_size", "busy_timeout"]
+
+
+def validate_pragma(name: str, value: str | int) -> str | int:
+    if name in PRAGMA_CHOICES:
+        value = str(value).upper()
+        if value not in PRAGMA_CHOICES[name]:
+            raise ValueError(f"invalid value {value} for {name}")
+        return value
+    elif name in PRAGMA_INTEGERS:
+        return int(value)
+    raise ValueError(f"unsupported pragma {name}")
+
+
+def get_settings() -> dict[str, str | int]:
+    """
+    reads the [DATABASE_TUNING] section: PRESET picks one of PRESETS and any
+    pragma listed in it (e.g. SYNCHRONOUS = FULL) overrides the preset value
+    """
+    preset = config.config.get("DATABASE_TUNING", "PRESET", fallback=DEFAULT_PRESET)
+    if preset not in PRESETS:
+        raise ValueError(f"unknown database tuning preset {preset}")
+
+    settings = dict(PRESETS[preset])
+    for name in settings:
+        value = config.config.get("DATABASE_TUNING", name, fallback=None)
+        if value is not None:
+            settings[name] = validate_pragma(name, value)
+
+    return settings
+
+
+def apply_settings(engine: Engine, settings: dict[str, str | int]) -> None:
+    """runs the pragmas on every new connection the engine opens"""
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        for name, value in settings.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    applied_settings[engine.url.render_as_string()] = settings
+
+
+def nest_savepoints(engine: Engine) -> None:
+    """
+    pysqlite only opens a transaction at the first write, so a SAVEPOINT taken
+    before that would become the outermost transaction and its release would
+    commit. a transaction is opened first in that case, so savepoints nest
+    """
+
+    @event.listens_for(engine, "savepoint")
+    def begin_before_savepoint(connection, name):
+        begin_write(connection)
+
+
+def begin_write(connection: Connection) -> None:
+    """
+    opens the transaction with the write lock unless pysqlite already opened
+    one at an earlier write. rows read from then on can't be changed by another
+    writer before the transaction ends
+    """
+    if connection.dialect.name != "sqlite":
+        return
+    if not connection.connection.driver_connection.in_transaction:
+        # on the dbapi connection, so it isn't counted as a statement
+        cursor = connection.connection.dbapi_connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.close()
+
+
+def get_active_settings(engine: Engine) -> dict[str, dict]:
+    configured = applied_settings.get(engine.url.render_as_string(), {})
+    with engine.connect() as connection:
+        active = {
+            name: connection.execute(text(f"PRAGMA {name}")).scalar()
+            for name in PRESETS[DEFAULT_PRESET]
+        }
+
+    return {"configured": configured, "active": active}
@@ -0,0 +1,70 @@
+"""
+measurements are stored in canonical metric units, kilograms and centimetres,
+whatever system the user reads them in. values are converted on the way in by
+to_metric and on the way out by from_metric, which scales a whole result set
+one column at a time, rounding each column to its PRECISION. changing a user's
+system only flips the flag on the user, and stored values never pick up drift
+from being converted back and forth.
+"""
+
+from typing import Any, Mapping, Sequence
+
+# metric units per unit of each system, for every convertible column
+FACTORS: dict[str, dict[str, float]] = {
+    "metric": {"body_weight": 1.0, "height": 1.0},
+    "imperial": {"body_weight": 0.45359237, "height": 2.54},
+}
+
+COLUMNS = tuple(FACTORS["metric"])
+
+# decimal places each column is shown with, in every system
+PRECISION: dict[str, int] = {"body_weight": 2, "height": 2}
+
+
+def factors(measurement_system: str | None) -> dict[str, float]:
+    # users without a system see the canonical units
+    if measurement_system is None:
+        return FACTORS["metric"]
+    try:
+        return FACTORS[measurement_system]
+    except KeyError:
+        raise ValueError(f"unknown measurement system {measurement_system}") from None
+
+
+def to_metric(values: Mapping[str, Any], measurement_system: str | None) -> dict:
+    """converts one set of column values given in measurement_system"""
+    scale = factors(measurement_system)
+    return {
+        k: v * scale[k] if k in scale and v is not None else v
+        for k, v in values.items()
+    }
+
+
+def from_metric(
+    columns: Mapping[str, Sequence], measurement_system: str | None
+) -> dict[str, Sequence]:
+    """
+    converts a result set held as columns, e.g. {"body_weight": [...]}, into
+    measurement_system, rounded to PRECISION. other columns are passed through
+    """
+    scale = factors(measurement_system)
+    return {
+        name: (
+            [
+                None if v is None else round(v / scale[name], PRECISION[name])
+                for v in values
+            ]
+            if name in scale
+            else values
+        )
+        for name, values in columns.items()
+    }
+
+
+def to_columns(rows: Sequence[Mapping[str, Any]], names: Sequence[str]) -> dict:
+    return {name: [row[name] for row in rows] for name in names}
+
+
+def to_rows(columns: Mapping[str, Sequence]) -> list[dict]:
+    names = list(columns)
+    return [dict(zip(names, values)) for values in zip(*columns.values())]
@@ -1,4 +1,5 @@
-from src.database.common import DatabaseInterface, User
+from src.database.common import DatabaseInterface, ExerciseLog, User
+from src.database import session_totals
 from datetime import datetime, timedelta
 from sqlalchemy.exc import IntegrityError
 
@@ -8,15 +9,15 @@ class Interface(DatabaseInterface):
         user.last_updated_username = datetime.utcnow()
 
         session = self.Session()
-        session.add(user)
-
-        
 
         try:
+            # a savepoint, so a duplicate only undoes this insert
+            with session.begin_nested():
+                session.add(user)
+                session.flush()
             session.commit()
             user = self.get_user_by_username(user.username)
         except IntegrityError as e:
-            session.rollback()
             session.close()
             if "UNIQUE constraint failed" in e.args[0]:
                 return {"message": f"username {user.username} already exists!"}
@@ -49,6 +50,7 @@ class Interface(DatabaseInterface):
         user = self.get_user_by_id(user_id)
         if user:
             session.delete(user)
+            session_totals.delete_sets(session, ExerciseLog.user_id == user_id)
             session.commit()
         session.close()
 
@@ -0,0 +1,210 @@
+from datetime import datetime, timedelta
+from typing import Iterable
+from sqlalchemy import and_, case, delete, insert, select, update
+from sqlalchemy.orm import Session
+from src.database.common import ExerciseLog, WorkoutSession
+from src.database import routine_exercise, session_totals
+
+# a set within this long of a session's first or last set belongs to it
+SESSION_GAP = timedelta(minutes=60)
+
+
+def overlapping(user_id: int, start_time: datetime, end_time: datetime):
+    """sessions of user_id that a set between start_time and end_time joins"""
+    return and_(
+        WorkoutSession.user_id == user_id,
+        WorkoutSession.end_time >= start_time - SESSION_GAP,
+        WorkoutSession.start_time <= end_time + SESSION_GAP,
+    )
+
+
+def merge(session: Session, workout_session_id: int, other_ids: Iterable[int]) -> None:
+    """moves the sets of the sessions other_ids into workout_session_id"""
+    other_ids = set(other_ids)
+    session.execute(
+        update(ExerciseLog)
+        .where(ExerciseLog.workout_session_id.in_(other_ids))
+        .values(workout_session_id=workout_session_id)
+        .execution_options(synchronize_session=False)
+    )
+    session.execute(
+        delete(WorkoutSession)
+        .where(WorkoutSession.id.in_(other_ids))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def add_set(
+    session: Session,
+    user_id: int,
+    workout_session_ids: list[int],
+    time_stamp: datetime,
+    num_reps: int = None,
+    time_duration: float = None,
+) -> int:
+    """
+    opens a new workout session for a set, or widens the bounds and adds the
+    set to the totals of the one it joins, and returns the session id.
+    workout_session_ids are the sessions the set joins, the one to keep first;
+    a set that bridges several merges them
+    """
+    if len(workout_session_ids) == 0:
+        return session.scalars(
+            insert(WorkoutSession)
+            .values(
+                user_id=user_id,
+                start_time=time_stamp,
+                end_time=time_stamp,
+                num_sets=1,
+                total_reps=num_reps or 0,
+                total_duration=time_duration or 0,
+            )
+            .returning(WorkoutSession.id)
+        ).one()
+
+    workout_session_id, *others = workout_session_ids
+    if others:
+        merge(session, workout_session_id, others)
+        session_totals.refresh(session, [workout_session_id], drop_empty=False)
+    session.execute(
+        update(WorkoutSession)
+        .where(WorkoutSession.id == workout_session_id)
+        .values(
+            start_time=case(
+                (WorkoutSession.start_time > time_stamp, time_stamp),
+                else_=WorkoutSession.start_time,
+            ),
+            end_time=case(
+                (WorkoutSession.end_time < time_stamp, time_stamp),
+                else_=WorkoutSession.end_time,
+            ),
+            num_sets=WorkoutSession.num_sets + 1,
+            total_reps=WorkoutSession.total_reps + (num_reps or 0),
+            total_duration=WorkoutSession.total_duration + (time_duration or 0),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return workout_session_id
+
+
+def add_sets(session: Session, rows: list[dict], user_ids: dict[int, int]) -> set[int]:
+    """
+    sets workout_session_id on a batch of new sets, joining the sessions they
+    overlap and opening new ones where there are none. sessions a set bridges
+    are merged. user_ids maps each routine_exercise_id to its user. returns the
+    sessions touched, whose totals need a refresh once the sets are written
+    """
+    time_stamps = [row["time_stamp"] for row in rows]
+    # [id, user_id, start_time, end_time]; new sessions have no id yet, and
+    # a merged session gets the session it went into appended
+    workout_sessions = [
+        list(row)
+        for row in session.execute(
+            select(
+                WorkoutSession.id,
+                WorkoutSession.user_id,
+                WorkoutSession.start_time,
+                WorkoutSession.end_time,
+            ).where(
+                WorkoutSession.user_id.in_(set(user_ids.values())),
+                WorkoutSession.end_time >= min(time_stamps) - SESSION_GAP,
+                WorkoutSession.start_time <= max(time_stamps) + SESSION_GAP,
+            )
+        )
+    ]
+
+    assigned, merged = [], []
+    for row in sorted(rows, key=lambda row: row["time_stamp"]):
+        user_id, time_stamp = user_ids[row["routine_exercise_id"]], row["time_stamp"]
+        candidates = [
+            w
+            for w in workout_sessions
+            if w[1] == user_id
+            and w[3] >= time_stamp - SESSION_GAP
+            and w[2] <= time_stamp + SESSION_GAP
+        ]
+        if candidates:
+            workout_session = max(candidates, key=lambda w: w[3])
+            for other in candidates:
+                if other is not workout_session:
+                    workout_session[2] = min(workout_session[2], other[2])
+                    workout_session[3] = max(workout_session[3], other[3])
+                    workout_sessions.remove(other)
+                    other.append(workout_session)
+                    merged.append(other)
+        else:
+            workout_session = [None, user_id, time_stamp, time_stamp]
+            workout_sessions.append(workout_session)
+        workout_session[2] = min(workout_session[2], time_stamp)
+        workout_session[3] = max(workout_session[3], time_stamp)
+        assigned.append((row, workout_session))
+
+    # new sessions of one user never share a start time, since they would
+    # overlap, which identifies the ids coming back from RETURNING
+    new = [w for w in workout_sessions if w[0] is None]
+    if new:
+        inserted = session.execute(
+            insert(WorkoutSession).returning(
+                WorkoutSession.id, WorkoutSession.user_id, WorkoutSession.start_time
+            ),
+            [{"user_id": w[1], "start_time": w[2], "end_time": w[3]} for w in new],
+        ).all()
+        ids = {(user_id, start_time): id for id, user_id, start_time in inserted}
+        for w in new:
+            w[0] = ids[(w[1], w[2])]
+
+    def merged_into(workout_session: list) -> list:
+        while len(workout_session) > 4:
+            workout_session = workout_session[4]
+        return workout_session
+
+    # sessions that existed before the batch move into the one they joined
+    other_ids = {}
+    for other in merged:
+        if other[0] is not None:
+            other_ids.setdefault(merged_into(other)[0], []).append(other[0])
+    for workout_session_id, ids in other_ids.items():
+        merge(session, workout_session_id, ids)
+
+    for row, workout_session in assigned:
+        row["workout_session_id"] = merged_into(workout_session)[0]
+    return {row["workout_session_id"] for row in rows}
+
+
+class Interface(routine_exercise.Interface):
+    def get_workout_session_by_id(self, workout_session_id: int):
+        session = self.Session()
+        workout_session = (
+            session.query(WorkoutSession)
+            .filter(WorkoutSession.id == workout_session_id)
+            .first()
+        )
+        session.close()
+        return workout_session
+
+    def get_workout_sessions_by_user(
+        self, user_id: int, start_time: datetime = None, end_time: datetime = None
+    ):
+        """sessions that overlap start_time <= t < end_time, oldest first"""
+        session = self.Session()
+        query = session.query(WorkoutSession).filter(WorkoutSession.user_id == user_id)
+        if start_time is not None:
+            query = query.filter(WorkoutSession.end_time >= start_time)
+        if end_time is not None:
+            query = query.filter(WorkoutSession.start_time < end_time)
+        workout_sessions = query.order_by(
+            WorkoutSession.start_time, WorkoutSession.id
+        ).all()
+        session.close()
+        return workout_sessions
+
+    def get_exercise_logs_by_workout_session(self, workout_session_id: int):
+        session = self.Session()
+        logs = (
+            session.query(ExerciseLog)
+            .filter(ExerciseLog.workout_session_id == workout_session_id)
+            .order_by(ExerciseLog.time_stamp, ExerciseLog.id)
+            .all()
+        )
+        session.close()
+        return logs
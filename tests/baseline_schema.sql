@@ -0,0 +1,122 @@
+-- the schema of the first release, before any migration
+CREATE TABLE app_user (
+    id INTEGER NOT NULL,
+    first_name VARCHAR(25) NOT NULL,
+    last_name VARCHAR(25) NOT NULL,
+    username VARCHAR(25) NOT NULL,
+    tel_country VARCHAR(2),
+    tel VARCHAR(15),
+    email VARCHAR(200) NOT NULL,
+    password VARCHAR(200) NOT NULL,
+    "DOB" DATE NOT NULL,
+    last_updated_username TIMESTAMP,
+    deletion_date TIMESTAMP,
+    measurement_system VARCHAR(10),
+    PRIMARY KEY (id),
+    CONSTRAINT pwd_gt_8 CHECK (LENGTH(password) > 8),
+    UNIQUE (username),
+    UNIQUE (tel),
+    UNIQUE (email),
+    CONSTRAINT measurementsystemcheck CHECK (measurement_system IN ('imperial', 'metric'))
+);
+
+CREATE TABLE tel_country_code (
+    id INTEGER NOT NULL,
+    name VARCHAR(44),
+    short_name VARCHAR(2),
+    tele_code VARCHAR(16),
+    PRIMARY KEY (id)
+);
+
+CREATE TABLE warmup (
+    id INTEGER NOT NULL,
+    num_sets INTEGER,
+    default_reps INTEGER,
+    default_time FLOAT,
+    PRIMARY KEY (id)
+);
+
+CREATE TABLE exercise (
+    id INTEGER NOT NULL,
+    exercise_name VARCHAR(100) NOT NULL,
+    reference_link VARCHAR(255),
+    body_part VARCHAR(50),
+    secondary_body_part VARCHAR(50),
+    rep_type VARCHAR(4),
+    user_id INTEGER,
+    PRIMARY KEY (id),
+    UNIQUE (exercise_name),
+    CONSTRAINT bodypartcheck CHECK (body_part IN ('triceps', 'chest', 'shoulders', 'biceps', 'core', 'back', 'forearms', 'upper_legs', 'glutes', 'cardio', 'lower_legs', 'other')),
+    CONSTRAINT bodypartcheck CHECK (secondary_body_part IN ('triceps', 'chest', 'shoulders', 'biceps', 'core', 'back', 'forearms', 'upper_legs', 'glutes', 'cardio', 'lower_legs', 'other')),
+    CONSTRAINT reptypecheck CHECK (rep_type IN ('reps', 'time')),
+    FOREIGN KEY(user_id) REFERENCES app_user (id)
+);
+
+CREATE TABLE measurement (
+    id INTEGER NOT NULL,
+    measurement_time TIMESTAMP NOT NULL,
+    user_id INTEGER NOT NULL,
+    height FLOAT,
+    body_weight FLOAT,
+    PRIMARY KEY (id),
+    FOREIGN KEY(user_id) REFERENCES app_user (id)
+);
+
+CREATE TABLE routine (
+    id INTEGER NOT NULL,
+    routine_name VARCHAR(20) NOT NULL,
+    user_id INTEGER,
+    num_days INTEGER,
+    is_current BOOLEAN,
+    is_public BOOLEAN,
+    PRIMARY KEY (id),
+    FOREIGN KEY(user_id) REFERENCES app_user (id)
+);
+
+CREATE TABLE warmup_set (
+    id INTEGER NOT NULL,
+    warmup_id INTEGER NOT NULL,
+    set_idx INTEGER NOT NULL,
+    num_reps INTEGER,
+    time_duration FLOAT,
+    working_percentage FLOAT,
+    PRIMARY KEY (id),
+    FOREIGN KEY(warmup_id) REFERENCES warmup (id)
+);
+
+CREATE TABLE routine_day (
+    id INTEGER NOT NULL,
+    routine_id INTEGER NOT NULL,
+    day_idx INTEGER,
+    routine_day_name VARCHAR(10),
+    day_of_week VARCHAR(3),
+    PRIMARY KEY (id),
+    FOREIGN KEY(routine_id) REFERENCES routine (id),
+    CONSTRAINT dayofweekcheck CHECK (day_of_week IN ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun'))
+);
+
+CREATE TABLE routine_exercise (
+    id INTEGER NOT NULL,
+    exercise_id INTEGER NOT NULL,
+    day_id INTEGER NOT NULL,
+    exercise_idx INTEGER NOT NULL,
+    num_sets INTEGER,
+    default_reps INTEGER,
+    default_time FLOAT,
+    warmup_schema INTEGER,
+    PRIMARY KEY (id),
+    FOREIGN KEY(exercise_id) REFERENCES exercise (id),
+    FOREIGN KEY(day_id) REFERENCES routine_day (id),
+    FOREIGN KEY(warmup_schema) REFERENCES warmup (id)
+);
+
+CREATE TABLE exercise_log (
+    id INTEGER NOT NULL,
+    routine_exercise_id INTEGER NOT NULL,
+    time_stamp TIMESTAMP NOT NULL,
+    set_idx INTEGER,
+    num_reps INTEGER,
+    time_duration FLOAT,
+    PRIMARY KEY (id),
+    FOREIGN KEY(routine_exercise_id) REFERENCES routine_exercise (id)
+);
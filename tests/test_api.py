@@ -1,5 +1,9 @@
 ## reset test database
 import json
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from src.api.main import app
 from src.database import common
 from src.config import config
 from src.api.auth import get_token_data
@@ -100,3 +104,423 @@ class TestUser:
             error_msg.get("detail")
             == f"username {data.get('username')} already exists!"
         )
+
+
+class TestAdmin:
+    def test_db_stats(self, db, client):
+        token = client.post(
+            "/users/token/",
+            data={"username": "admin", "password": "adminadminadmin"},
+            headers={
+                "Content-Type": "application/x-www-form-urlencoded",
+                "api_key": config["API"]["API_KEY"],
+            },
+        ).json()["access_token"]
+        client.get(
+            "/users/me/",
+            headers={
+                "api_key": config["API"]["API_KEY"],
+                "Authorization": f"Bearer {token}",
+            },
+        )
+
+        stats = client.get(
+            "/admin/db/stats", headers={"admin_key": config["API"]["ADMIN_KEY"]}
+        )
+        routes = stats.json()["routes"]
+
+        assert stats.status_code == 200
+        assert routes["GET /users/me/"]["count"] >= 1
+        assert "user.Interface.get_user_by_id" in routes["GET /users/me/"]["methods"]
+        # the unit of work commits after the route returns and is still counted
+        assert "<commit>" in routes["GET /users/me/"]["methods"]
+
+    def test_db_stats_requires_admin_key(self, client):
+        stats = client.get(
+            "/admin/db/stats", headers={"admin_key": config["API"]["API_KEY"]}
+        )
+
+        assert stats.status_code == 403
+
+
+class TestStatementBudgets:
+    def test_routes_within_budget(self, db, client, monkeypatch):
+        monkeypatch.setitem(config["DATABASE"], "STRICT_STATEMENT_BUDGETS", "true")
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded",
+            "api_key": config["API"]["API_KEY"],
+        }
+        signup = client.post(
+            "/users/signup",
+            data={
+                "first_name": "Budget",
+                "last_name": "User",
+                "username": "budgetuser",
+                "email": "budget@test.com",
+                "password": "budget20242024",
+                "DOB": "1/1/2001",
+                "measurement_system": "metric",
+            },
+            headers=headers,
+        )
+        token = signup.json()["access_token"]
+        token_data = get_token_data(token)
+        headers["Authorization"] = f"Bearer {token}"
+
+        responses = [
+            signup,
+            client.get("/users/me/", headers=headers),
+            client.get(f"/users/id/{token_data.id}", headers=headers),
+            client.get("/users/username/budgetuser", headers=headers),
+            client.get(f"/measurement/user/{token_data.id}/latest"),
+            client.get(
+                f"/measurement/user/{token_data.id}/time",
+                params={"start_time": "20000101", "end_time": "21000101"},
+            ),
+            client.get(
+                f"/measurement/user/{token_data.id}/buckets",
+                params={"start_time": "20000101", "period": "month"},
+            ),
+        ]
+
+        assert [r.status_code for r in responses] == [200] * len(responses)
+
+
+class TestExerciseLog:
+    def test_add_logs(self, db, client):
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded",
+            "api_key": config["API"]["API_KEY"],
+        }
+        token = client.post(
+            "/users/token/",
+            data={"username": "testuser2023", "password": "test20242024"},
+            headers=headers,
+        ).json()["access_token"]
+        user_id = get_token_data(token).id
+        headers = {
+            "api_key": config["API"]["API_KEY"],
+            "Authorization": f"Bearer {token}",
+        }
+
+        routine = db.routine.add_routine(user_id, "BULK ROUTINE", 1)
+        day = db.routine_day.add_routine_day(routine.id, "BULK DAY", "mon")
+        exercise = db.exercise.add_exercise(
+            "bulk squat", "syfit.test", "upper_legs", None, "reps"
+        )
+        routine_exercise = db.routine_exercise.add_routine_exercise(
+            day.id, exercise.id
+        )
+        logs = [
+            {
+                "routine_exercise_id": routine_exercise.id,
+                "time_stamp": f"2024-01-01T12:0{n}:00Z",
+                "num_reps": 10 - n,
+            }
+            for n in range(5)
+        ]
+
+        response = client.post(
+            "/exercise_log/bulk", json={"logs": logs}, headers=headers
+        )
+        not_owned = client.post(
+            "/exercise_log/bulk",
+            json={
+                "logs": [
+                    {
+                        "routine_exercise_id": routine_exercise.id + 1000,
+                        "time_stamp": "2024-01-01T12:00:00",
+                    }
+                ]
+            },
+            headers=headers,
+        )
+
+        ids = response.json()["ids"]
+        added = [db.exercise_log.get_exercise_log_by_id(id) for id in ids]
+
+        assert response.status_code == 200
+        assert [log.set_idx for log in added] == [0, 1, 2, 3, 4]
+        assert [log.num_reps for log in added] == [10, 9, 8, 7, 6]
+        assert not_owned.status_code == 403
+
+    def test_get_logs_pages(self, db, client):
+        token = client.post(
+            "/users/token/",
+            data={"username": "testuser2023", "password": "test20242024"},
+            headers={
+                "Content-Type": "application/x-www-form-urlencoded",
+                "api_key": config["API"]["API_KEY"],
+            },
+        ).json()["access_token"]
+        user_id = get_token_data(token).id
+        headers = {
+            "api_key": config["API"]["API_KEY"],
+            "Authorization": f"Bearer {token}",
+        }
+
+        logs, cursors = [], []
+        params = {"limit": 2, "start_time": "20240101", "end_time": "20240102"}
+        while True:
+            page = client.get(
+                f"/exercise_log/user/{user_id}", params=params, headers=headers
+            ).json()
+            logs.extend(page["logs"])
+            if page["next_cursor"] is None:
+                break
+            cursors.append(page["next_cursor"])
+            params["cursor"] = page["next_cursor"]
+        other_user = client.get(f"/exercise_log/user/{user_id + 1}", headers=headers)
+        bad_cursor = client.get(
+            f"/exercise_log/user/{user_id}",
+            params={"cursor": "not a cursor"},
+            headers=headers,
+        )
+
+        assert len(logs) == 5
+        assert len(cursors) == 2
+        assert [log["num_reps"] for log in logs] == [10, 9, 8, 7, 6]
+        assert other_user.status_code == 403
+        assert bad_cursor.status_code == 400
+
+
+class TestRoutine:
+    def test_get_routine_tree(self, db, client):
+        token = client.post(
+            "/users/token/",
+            data={"username": "testuser2023", "password": "test20242024"},
+            headers={
+                "Content-Type": "application/x-www-form-urlencoded",
+                "api_key": config["API"]["API_KEY"],
+            },
+        ).json()["access_token"]
+        user_id = get_token_data(token).id
+        headers = {
+            "api_key": config["API"]["API_KEY"],
+            "Authorization": f"Bearer {token}",
+        }
+
+        routine = db.routine.add_routine(user_id, "TREE ROUTINE", 2)
+        exercise = db.exercise.add_exercise(
+            "tree press", "syfit.test", "chest", None, "reps"
+        )
+        for name in ["PUSH", "PULL"]:
+            day = db.routine_day.add_routine_day(routine.id, name, "mon")
+            for _ in range(2):
+                db.routine_exercise.add_routine_exercise(day.id, exercise.id)
+        private = db.routine.add_routine(user_id + 1, "PRIVATE", 1)
+
+        response = client.get(f"/routine/{routine.id}/tree", headers=headers)
+        not_owned = client.get(f"/routine/{private.id}/tree", headers=headers)
+        missing = client.get(f"/routine/{private.id + 1000}/tree", headers=headers)
+
+        tree = response.json()
+        assert response.status_code == 200
+        assert tree["routine_name"] == "TREE ROUTINE"
+        assert [d["routine_day_name"] for d in tree["days"]] == ["PUSH", "PULL"]
+        assert [d["day_idx"] for d in tree["days"]] == [0, 1]
+        exercises = tree["days"][1]["exercises"]
+        assert [e["exercise_idx"] for e in exercises] == [0, 1]
+        assert exercises[0]["exercise"]["exercise_name"] == "tree press"
+        assert exercises[0]["warmup"] is None
+        assert not_owned.status_code == 403
+        assert missing.status_code == 404
+
+    def test_clone_routine(self, db, client):
+        token = client.post(
+            "/users/token/",
+            data={"username": "testuser2023", "password": "test20242024"},
+            headers={
+                "Content-Type": "application/x-www-form-urlencoded",
+                "api_key": config["API"]["API_KEY"],
+            },
+        ).json()["access_token"]
+        user_id = get_token_data(token).id
+        headers = {
+            "api_key": config["API"]["API_KEY"],
+            "Authorization": f"Bearer {token}",
+        }
+        public = db.routine.add_routine(user_id + 1, "PUBLIC", 1)
+        db.routine_day.add_routine_day(public.id, "ALL", "mon")
+        session = db.Session()
+        session.query(common.Routine).filter(common.Routine.id == public.id).update(
+            {"is_public": True}
+        )
+        session.commit()
+        session.close()
+        private = db.routine.add_routine(user_id + 1, "PRIVATE", 1)
+
+        response = client.post(f"/routine/{public.id}/clone", headers=headers)
+        not_public = client.post(f"/routine/{private.id}/clone", headers=headers)
+
+        clone = db.routine.get_routine_tree(response.json()["id"])
+        assert response.status_code == 200
+        assert clone.user_id == user_id
+        assert [d.routine_day_name for d in clone.days] == ["ALL"]
+        assert not_public.status_code == 404
+
+    def test_get_today(self, db, client):
+        token = client.post(
+            "/users/token/",
+            data={"username": "testuser2023", "password": "test20242024"},
+            headers={
+                "Content-Type": "application/x-www-form-urlencoded",
+                "api_key": config["API"]["API_KEY"],
+            },
+        ).json()["access_token"]
+        user_id = get_token_data(token).id
+        headers = {
+            "api_key": config["API"]["API_KEY"],
+            "Authorization": f"Bearer {token}",
+        }
+
+        response = client.get("/routine/today", headers=headers)
+        cached = client.get("/routine/today", headers=headers)
+        kiritimati = client.get(
+            "/routine/today", params={"tz": "Pacific/Kiritimati"}, headers=headers
+        )
+        bad_zone = client.get(
+            "/routine/today", params={"tz": "Nowhere/Atall"}, headers=headers
+        )
+
+        today = response.json()
+        assert response.status_code == 200
+        assert today["routine"]["id"] == db.routine.get_current_routine(user_id).id
+        assert today["day_of_week"] in ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+        assert cached.json() == today
+        assert kiritimati.status_code == 200
+        assert bad_zone.status_code == 400
+
+
+class TestMeasurement:
+    def test_import_measurements(self, db, client):
+        token = client.post(
+            "/users/token/",
+            data={"username": "testuser2023", "password": "test20242024"},
+            headers={
+                "Content-Type": "application/x-www-form-urlencoded",
+                "api_key": config["API"]["API_KEY"],
+            },
+        ).json()["access_token"]
+        user_id = get_token_data(token).id
+        headers = {
+            "api_key": config["API"]["API_KEY"],
+            "Authorization": f"Bearer {token}",
+        }
+        ndjson = "".join(
+            json.dumps({"time": f"2018-06-{day:02}T07:00:00", "weight": 150}) + "\n"
+            for day in range(1, 11)
+        )
+
+        imported = client.post(
+            f"/measurement/user/{user_id}/import",
+            files={"file": ("scale.ndjson", ndjson)},
+            headers=headers,
+        )
+        again = client.post(
+            f"/measurement/user/{user_id}/import",
+            params={"format": "ndjson"},
+            files={"file": ("scale.txt", ndjson)},
+            headers=headers,
+        )
+        bad_format = client.post(
+            f"/measurement/user/{user_id}/import",
+            files={"file": ("scale.xml", "<weights/>")},
+            headers=headers,
+        )
+        bad_json = client.post(
+            f"/measurement/user/{user_id}/import",
+            files={"file": ("scale.json", "{}")},
+            headers=headers,
+        )
+        not_records = client.post(
+            f"/measurement/user/{user_id}/import",
+            files={"file": ("scale.json", '[[1, 2], ["x"], 3]')},
+            headers=headers,
+        )
+        other_user = client.post(
+            f"/measurement/user/{user_id + 1}/import",
+            files={"file": ("scale.ndjson", ndjson)},
+            headers=headers,
+        )
+        no_token = client.post(
+            f"/measurement/user/{user_id}/import",
+            files={"file": ("scale.ndjson", ndjson)},
+            headers={"api_key": config["API"]["API_KEY"]},
+        )
+
+        assert imported.status_code == 200
+        assert imported.headers["content-type"] == "application/x-ndjson"
+        assert json.loads(imported.text.splitlines()[-1])["inserted"] == 10
+        assert [json.loads(line) for line in again.text.splitlines()] == [
+            {"read": 10, "inserted": 0, "duplicates": 10, "skipped": 0}
+        ]
+        assert bad_format.status_code == 400
+        assert bad_json.status_code == 400
+        assert not_records.status_code == 200
+        assert json.loads(not_records.text) == {
+            "read": 3,
+            "inserted": 0,
+            "duplicates": 0,
+            "skipped": 3,
+        }
+        assert other_user.status_code == 403
+        assert no_token.status_code == 401
+
+    def test_failed_commit_is_an_error(self, db, monkeypatch):
+        user = db.user.get_user_by_username("testuser2023")
+
+        def commit(session):
+            raise OperationalError("COMMIT", None, Exception("database is locked"))
+
+        # the unit of work commits before the response is sent, so a failed
+        # commit can't reach the client as a success
+        monkeypatch.setattr(Session, "commit", commit)
+        client = TestClient(app, raise_server_exceptions=False)
+        response = client.put(
+            f"/measurement/user/{user.id}/change_measurement_system"
+        )
+        monkeypatch.undo()
+
+        assert response.status_code == 500
+        assert (
+            db.user.get_user_by_id(user.id).measurement_system
+            == user.measurement_system
+        )
+
+
+class TestExport:
+    def test_export_user(self, db, client):
+        token = client.post(
+            "/users/token/",
+            data={"username": "testuser2023", "password": "test20242024"},
+            headers={
+                "Content-Type": "application/x-www-form-urlencoded",
+                "api_key": config["API"]["API_KEY"],
+            },
+        ).json()["access_token"]
+        user_id = get_token_data(token).id
+        headers = {
+            "api_key": config["API"]["API_KEY"],
+            "Authorization": f"Bearer {token}",
+        }
+
+        ndjson = client.get(f"/export/user/{user_id}", headers=headers)
+        csv_export = client.get(
+            f"/export/user/{user_id}",
+            params={"format": "csv", "table": "exercise_log"},
+            headers=headers,
+        )
+        bad_format = client.get(
+            f"/export/user/{user_id}", params={"format": "csv"}, headers=headers
+        )
+        other_user = client.get(f"/export/user/{user_id + 1}", headers=headers)
+
+        rows = [json.loads(line) for line in ndjson.text.splitlines()]
+        assert ndjson.status_code == 200
+        assert ndjson.headers["content-type"] == "application/x-ndjson"
+        assert len([r for r in rows if r["table"] == "exercise_log"]) == 5
+        assert csv_export.text.splitlines()[0].startswith("id,routine_exercise_id")
+        assert len(csv_export.text.splitlines()) == 6
+        assert bad_format.status_code == 400
+        assert other_user.status_code == 403
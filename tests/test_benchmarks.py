@@ -0,0 +1,87 @@
+import asyncio
+import pathlib
+from datetime import datetime
+import httpx
+from sqlalchemy import select
+from src.api.main import app
+from src.database import common
+from src.database.syfit import Syfit
+from benchmarks import db_benchmark, load_test, synthetic
+
+SCENARIOS = pathlib.Path(__file__).parent.parent / "benchmarks" / "scenarios"
+
+
+def generate(path, **kwargs):
+    db = Syfit(f"sqlite:///{path}", reset_db=True)
+    rows = synthetic.generate(
+        db, users=2, years=0.25, end_time=datetime(2024, 1, 1), **kwargs
+    )
+    return db, rows
+
+
+class TestSynthetic:
+    def test_generate(self, tmp_path):
+        db, rows = generate(tmp_path / "synthetic.db")
+
+        assert rows["app_user"] == 2
+        assert rows["routine"] == 2 * 3
+        assert rows["routine_day"] == 2 * 3 * 4
+        assert rows["routine_exercise"] == 2 * 3 * 4 * 5
+        assert rows["measurement"] == 2 * 91
+        assert rows["exercise_log"] > 0
+
+        current = [r for r in db.routine.get_all_user_routines(1) if r.is_current]
+        assert len(current) == 1
+
+    def test_generate_is_deterministic(self, tmp_path):
+        first, _ = generate(tmp_path / "first.db", seed=3)
+        second, _ = generate(tmp_path / "second.db", seed=3)
+
+        query = select(common.ExerciseLog).order_by(common.ExerciseLog.id)
+        with first.engine.connect() as a, second.engine.connect() as b:
+            assert a.execute(query).all() == b.execute(query).all()
+
+
+class TestDbBenchmark:
+    def test_every_method_has_a_case(self, tmp_path):
+        db = Syfit(f"sqlite:///{tmp_path / 'cases.db'}", reset_db=True)
+
+        assert set(db_benchmark.public_methods(db)) == set(db_benchmark.CASES)
+
+    def test_benchmark_scale(self, tmp_path):
+        db, _ = generate(tmp_path / "bench.db")
+
+        results = db_benchmark.benchmark_scale(db, 2, 0, ["exercise_log", "user"])
+
+        assert results["exercise_log.add_log"]["runs"] == 2
+        assert results["exercise_log.add_log"]["statements"] >= 1
+        assert "routine.add_routine" not in results
+
+
+class TestLoadTest:
+    def test_run_scenario(self, db):
+        synthetic.generate(db, users=2, years=0.1)
+        scenario = load_test.Scenario.load(SCENARIOS / "mixed.json")
+        scenario.concurrency = 2
+        scenario.max_requests = 20
+        users = load_test.load_virtual_users(db, scenario.virtual_users)
+
+        async def drive():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://test"
+            ) as client:
+                return await load_test.run_scenario(client, scenario, users)
+
+        report = asyncio.run(drive())
+
+        assert report["total"]["requests"] == 20
+        assert report["total"]["errors"] == 0
+        assert report["total"]["p50_ms"] <= report["total"]["p99_ms"]
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+
+        assert load_test.percentile(values, 50) == 50
+        assert load_test.percentile(values, 99) == 99
+        assert load_test.percentile([], 50) is None
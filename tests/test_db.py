@@ -1,8 +1,24 @@
-from datetime import datetime, timedelta
-import math
-from sqlalchemy import and_
+import asyncio
+import csv
+import gzip
+import io
+import json
+from datetime import date, datetime, timedelta
+import sqlite3
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import pytest
+from sqlalchemy import and_, event, inspect
+from sqlalchemy.exc import IntegrityError, InvalidRequestError, OperationalError
 from src.database import common
 from src.database.common import User
+from src.database.syfit import AsyncSyfit, Syfit
+from src.database import export, instrumentation, migrations, ordering, today
+from src.database import tuning, units
+from src import config
 from passlib.context import CryptContext
 
 password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -148,11 +164,39 @@ class TestMeasurement:
             session.query(common.Measurement).filter(common.Measurement.id == 1).first()
         )
 
+        # user 1 reads imperial units, stored as metric
         assert test_measurement is not None
-        assert test_measurement.height == 60
-        assert test_measurement.body_weight == 125
+        assert test_measurement.height == pytest.approx(60 * 2.54)
+        assert test_measurement.body_weight == pytest.approx(125 * 0.45359237)
         assert test_measurement.user_id == 1
 
+        measurement = db.measurement.get_measurement_by_id(1)
+        assert measurement.height == pytest.approx(60)
+        assert measurement.body_weight == pytest.approx(125)
+
+    def test_add_duplicate_measurement(self, db):
+        first = db.measurement.add_measurement(1, None, height=61, body_weight=126)
+        duplicate = db.measurement.add_measurement(1, None, height=61, body_weight=126)
+
+        assert "message" in duplicate
+        matches = db.measurement.get_measurement_by_measurements(1, body_weight=126)
+        assert len(matches) == 1
+
+        # older entries with the same values are not duplicates
+        session = db.Session()
+        session.query(common.Measurement).filter(
+            common.Measurement.id == first.id
+        ).update({"measurement_time": datetime.utcnow() - timedelta(hours=25)})
+        session.commit()
+        session.close()
+
+        again = db.measurement.add_measurement(1, None, height=61, body_weight=126)
+        assert again.id != first.id
+        assert again.body_weight == pytest.approx(126)
+
+        db.measurement.delete_measurement(first.id)
+        db.measurement.delete_measurement(again.id)
+
     def test_get_all_measurements_by_user(self, db):
         user_id = 1
 
@@ -182,11 +226,11 @@ class TestMeasurement:
             .filter(common.Measurement.user_id == user_id)
             .all()
         )
-        query_body_weights = [m.body_weight for m in query_measurements]
+        query_body_weights = [m.body_weight / 0.45359237 for m in query_measurements]
 
         assert len(measurements) == len(query_measurements)
-        assert max(body_weights) == max(query_body_weights)
-        assert min(body_weights) == min(query_body_weights)
+        assert max(body_weights) == pytest.approx(max(query_body_weights))
+        assert min(body_weights) == pytest.approx(min(query_body_weights))
 
     def test_get_all_measurements_by_user_by_date(self, db):
         start_time = (datetime.utcnow() + timedelta(days=-120)).date()
@@ -207,6 +251,103 @@ class TestMeasurement:
 
         assert len(measurements) == len(query_measurements)
 
+    def test_get_measurement_buckets(self, db):
+        start = datetime(2020, 3, 2, 7)
+        for day, body_weight in enumerate([200, 198, 199, 190, 180, 185, 170]):
+            db.measurement.add_measurement(
+                1, start + timedelta(days=3 * day), body_weight=body_weight
+            )
+
+        weeks = db.measurement.get_measurement_buckets(
+            1, datetime(2020, 3, 1), datetime(2020, 4, 1), "week"
+        )
+        # weeks start on monday, and weeks without measurements are left out
+        assert [w["start"] for w in weeks] == [
+            date(2020, 3, 2),
+            date(2020, 3, 9),
+            date(2020, 3, 16),
+        ]
+        assert [w["count"] for w in weeks] == [3, 2, 2]
+        assert weeks[0]["body_weight"]["last"] == pytest.approx(199)
+
+        months = db.measurement.get_measurement_buckets(
+            1, datetime(2020, 3, 1), datetime(2020, 4, 1), "month"
+        )
+        assert len(months) == 1
+        assert months[0]["start"] == date(2020, 3, 1)
+        assert months[0]["end"] == date(2020, 4, 1)
+        assert months[0]["count"] == 7
+        assert months[0]["body_weight"]["min"] == pytest.approx(170)
+        assert months[0]["body_weight"]["max"] == pytest.approx(200)
+        assert months[0]["body_weight"]["mean"] == round(1322 / 7, 2)
+        assert months[0]["body_weight"]["last"] == pytest.approx(170)
+        assert months[0]["height"]["last"] is None
+
+        days = db.measurement.get_measurement_buckets(
+            1, datetime(2020, 3, 1), datetime(2020, 4, 1), "day", max_points=4
+        )
+        assert len(days) <= 4
+        assert sum(d["count"] for d in days) == 7
+
+        with pytest.raises(ValueError):
+            db.measurement.get_measurement_buckets(1, start, period="year")
+
+    def test_import_measurements(self, db):
+        csv_file = io.BytesIO(
+            b"\xef\xbb\xbfDate,Weight (kg),Height (cm),Fat %\n"
+            b"2019-01-01T07:00:00,80,180,20\n"
+            b"2019-01-02T07:00:00,79.5,,20\n"
+            b"2019-01-02T07:00:00,79.5,,20\n"
+            b"not a date,79,,20\n"
+            b"2019-01-03T07:00:00+02:00,79,,20\n"
+        )
+        progress = []
+
+        totals = db.measurement.import_measurements(
+            1, csv_file, batch_size=2, progress=progress.append
+        )
+
+        assert totals == {"read": 5, "inserted": 3, "duplicates": 1, "skipped": 1}
+        assert [p["read"] for p in progress] == [2, 4, 5]
+        assert not csv_file.closed
+        imported = db.measurement.get_all_measurements_by_user_by_date(
+            1, datetime(2019, 1, 1), datetime(2019, 1, 4)
+        )
+        assert [m.measurement_time for m in imported] == [
+            datetime(2019, 1, 1, 7),
+            datetime(2019, 1, 2, 7),
+            datetime(2019, 1, 3, 5),
+        ]
+        # user 1 reads pounds and inches
+        assert imported[0].body_weight == round(80 / 0.45359237, 2)
+        assert imported[0].height == round(180 / 2.54, 2)
+        assert imported[1].height is None
+
+        # json arrays in the user's own units, against what is already there
+        json_file = io.BytesIO(
+            json.dumps(
+                [
+                    {"timestamp": "2019-01-03T05:00:00", "weight": 170},
+                    {"timestamp": 1546560000, "weight": 171},
+                    {"table": "exercise_log", "time_stamp": "2019-01-04"},
+                    [1, 2],
+                    "x",
+                    None,
+                ]
+            ).encode()
+        )
+        totals = db.measurement.import_measurements(1, json_file, "json")
+
+        assert totals == {"read": 6, "inserted": 1, "duplicates": 1, "skipped": 4}
+        latest = db.measurement.get_all_measurements_by_user_by_date(
+            1, datetime(2019, 1, 4), datetime(2019, 1, 5)
+        )
+        assert latest[0].measurement_time == datetime(2019, 1, 4)
+        assert latest[0].body_weight == pytest.approx(171)
+
+        with pytest.raises(ValueError):
+            db.measurement.import_measurements(1, io.BytesIO(b"{}"), "json")
+
     def test_get_latest_measurement_by_user(self, db):
         latest = db.measurement.get_latest_measurement_by_user(1)
 
@@ -231,14 +372,15 @@ class TestMeasurement:
         query_measurement = (
             session.query(common.Measurement)
             .filter(
-                common.Measurement.user_id == 1, common.Measurement.body_weight == 125
+                common.Measurement.user_id == 1,
+                common.Measurement.body_weight == 125 * 0.45359237,
             )
             .first()
         )
 
         assert measurement.user_id == query_measurement.id
-        assert measurement.body_weight == query_measurement.body_weight
-        assert measurement.height == query_measurement.height
+        assert measurement.body_weight == pytest.approx(125)
+        assert measurement.height == pytest.approx(query_measurement.height / 2.54)
 
         db.measurement.add_measurement(
             1, datetime.utcnow() + timedelta(days=30), body_weight=130
@@ -260,8 +402,10 @@ class TestMeasurement:
 
         assert measurement.id == query_measurement.id
         assert measurement.user_id == query_measurement.user_id
-        assert measurement.height == query_measurement.height
-        assert measurement.body_weight == query_measurement.body_weight
+        assert measurement.height == pytest.approx(query_measurement.height / 2.54)
+        assert measurement.body_weight == pytest.approx(
+            query_measurement.body_weight / 0.45359237
+        )
 
     def test_edit_measurement(self, db):
         db.measurement.edit_measurement(
@@ -274,38 +418,64 @@ class TestMeasurement:
             session.query(common.Measurement).filter(common.Measurement.id == 7).first()
         )
 
-        assert query_measurement.body_weight == 127
+        assert query_measurement.body_weight == pytest.approx(127 * 0.45359237)
         assert (
             query_measurement.measurement_time.date()
             == (datetime.utcnow() + timedelta(days=-10)).date()
         )
 
     def test_change_measurement_system(self, db):
+        session = db.Session()
+        stored = session.query(common.Measurement).all()
         measurements = db.measurement.get_all_measurement_by_user(1)
 
-        db.measurement.change_measurement_system(1, 1)
-        db.measurement.change_measurement_system(1, 1)
-
-        new_measurements = db.measurement.get_all_measurement_by_user(1)
+        user = db.measurement.change_measurement_system(1)
+        assert user.measurement_system == "metric"
 
+        # the flag flips, the stored rows do not
+        metric = {m.id: m for m in db.measurement.get_all_measurement_by_user(1)}
+        assert {m.id: (m.height, m.body_weight) for m in stored} == {
+            m.id: (m.height, m.body_weight)
+            for m in session.query(common.Measurement).all()
+        }
         for m in measurements:
-            new_measurement = [n for n in new_measurements if n.id == m.id]
+            if m.body_weight is not None:
+                # both are shown rounded to two places
+                assert metric[m.id].body_weight == pytest.approx(
+                    m.body_weight * 0.45359237, abs=0.01
+                )
 
-            assert len(new_measurement) == 1
-            new_measurement = new_measurement[0]
+        db.measurement.change_measurement_system(1)
+        session.close()
 
-            assert new_measurement.id == m.id
-            assert new_measurement.user_id == m.user_id
-            assert (
-                new_measurement.height == m.height
-                or math.ceil(new_measurement.height) == m.height
-                or math.floor(new_measurement.height) == m.height
-            )
-            assert (
-                new_measurement.body_weight == m.body_weight
-                or math.ceil(new_measurement.body_weight) == m.body_weight
-                or math.floor(new_measurement.body_weight) == m.body_weight
-            )
+        new_measurements = db.measurement.get_all_measurement_by_user(1)
+
+        assert [(m.id, m.height, m.body_weight) for m in new_measurements] == [
+            (m.id, m.height, m.body_weight) for m in measurements
+        ]
+
+    def test_unit_conversion(self):
+        columns = {"id": [1, 2], "body_weight": [100.0, None], "height": [180.0, 2.54]}
+
+        assert units.from_metric(columns, "metric") == columns
+        imperial = units.from_metric(columns, "imperial")
+        assert imperial["id"] == [1, 2]
+        assert imperial["body_weight"] == [220.46, None]
+        assert imperial["height"] == [70.87, 1]
+        # shown values are rounded, not 180.00000000000003
+        assert units.from_metric({"height": [180 * 2.54]}, "imperial") == {
+            "height": [180]
+        }
+        assert units.from_metric({"body_weight": [70 / 3]}, None) == {
+            "body_weight": [23.33]
+        }
+        assert units.to_metric({"height": 1, "body_weight": None}, "imperial") == {
+            "height": 2.54,
+            "body_weight": None,
+        }
+        assert units.to_rows(imperial)[1] == {"id": 2, "body_weight": None, "height": 1}
+        with pytest.raises(ValueError):
+            units.from_metric(columns, "cubits")
 
 
 class TestRoutine:
@@ -377,6 +547,28 @@ class TestRoutine:
         assert routine.is_current is True
         assert new_routine.is_current is False
 
+    def test_one_current_routine_per_user(self, db):
+        routine = db.routine.add_routine(1, "SWITCH", 3, is_current=True)
+
+        assert db.routine.get_current_routine(1).id == routine.id
+        assert db.routine.get_routine_by_id(1).is_current is False
+
+        assert db.routine.make_routine_current(1).is_current is True
+        assert db.routine.get_current_routine(1).id == 1
+        current = [r.id for r in db.routine.get_all_user_routines(1) if r.is_current]
+        assert current == [1]
+
+        session = db.Session()
+        with pytest.raises(IntegrityError):
+            session.query(common.Routine).filter(
+                common.Routine.id == routine.id
+            ).update({"is_current": True})
+        session.rollback()
+        session.close()
+
+        assert db.routine.make_routine_current(1000) is None
+        db.routine.delete_routine(routine.id)
+
 
 class TestRoutineDay:
     def test_add_routine_day(self, db):
@@ -456,6 +648,52 @@ class TestRoutineDay:
         assert day.day_of_week == "sun"
         assert day.day_idx == 0
 
+    def test_move_day(self, db):
+        def order():
+            days = db.routine_day.get_days_by_routine_id(1)
+            assert [d.day_idx for d in days] == list(range(len(days)))
+            return [d.id for d in days]
+
+        sort_keys = {d.id: d.sort_key for d in db.routine_day.get_days_by_routine_id(1)}
+
+        day = db.routine_day.move_day(5, before_day_id=2)
+        assert day.day_idx == 1
+        assert order() == [1, 5, 2, 3, 4]
+        # only the moved day is written
+        moved = {d.id: d.sort_key for d in db.routine_day.get_days_by_routine_id(1)}
+        assert {id for id in moved if moved[id] != sort_keys[id]} == {5}
+
+        db.routine_day.move_day_to_idx(1, 2)
+        assert order() == [5, 2, 1, 3, 4]
+        db.routine_day.edit_routine_day(1, day_idx=0)
+        assert order() == [1, 5, 2, 3, 4]
+        db.routine_day.move_day(5)
+        assert order() == [1, 2, 3, 4, 5]
+
+        assert "message" in db.routine_day.move_day(1, before_day_id=1000)
+        assert "message" in db.routine_day.move_day_to_idx(1000, 0)
+
+    def test_insert_and_rebalance_days(self, tmp_path):
+        db = Syfit(f"sqlite:///{tmp_path / 'days.db'}", reset_db=True)
+        routine = db.routine.add_routine(1, "ORDER", 3)
+        ids = [
+            db.routine_day.add_routine_day(routine.id, f"DAY {n}", "mon").id
+            for n in range(3)
+        ]
+        day = db.routine_day.add_routine_day(routine.id, "FIRST", "tue", day_idx=0)
+        ids.insert(0, day.id)
+        day = db.routine_day.add_routine_day(routine.id, "MIDDLE", "wed", day_idx=2)
+        ids.insert(2, day.id)
+
+        # moving into the same gap halves it until the keys have to be spread
+        # out again
+        for _ in range(40):
+            db.routine_day.move_day_to_idx(ids[-1], 1)
+            ids.insert(1, ids.pop())
+            days = db.routine_day.get_days_by_routine_id(routine.id)
+            assert [d.id for d in days] == ids
+            assert [d.day_idx for d in days] == list(range(len(ids)))
+
 
 class TestExercise:
     def test_add_exercise(self, db):
@@ -711,6 +949,74 @@ class TestRoutineExercise:
         assert exercise.default_time is None
         assert exercise.warmup_schema is None
 
+    def test_move_exercise(self, db):
+        def order():
+            exercises = db.routine_exercise.get_exercises_by_routine_day_id(1)
+            assert [e.exercise_idx for e in exercises] == list(range(len(exercises)))
+            return [e.id for e in exercises]
+
+        exercise = db.routine_exercise.move_exercise(1, before_id=4)
+        assert exercise.exercise_idx == 2
+        assert order() == [2, 3, 1, 4]
+        db.routine_exercise.edit_routine_exercise(4, exercise_idx=0)
+        assert order() == [4, 2, 3, 1]
+        db.routine_exercise.move_exercise_to_idx(1, 0)
+        assert order() == [1, 4, 2, 3]
+        db.routine_exercise.move_exercise(4)
+        assert order() == [1, 2, 3, 4]
+
+    def test_get_routine_tree(self, db):
+        session = db.Session()
+        warmup = common.WarmUp(num_sets=2, default_reps=8)
+        session.add(warmup)
+        session.flush()
+        session.add_all(
+            [
+                common.WarmUpSet(warmup_id=warmup.id, set_idx=1, num_reps=5),
+                common.WarmUpSet(warmup_id=warmup.id, set_idx=0, num_reps=10),
+            ]
+        )
+        session.commit()
+        warmup_id = warmup.id
+        session.close()
+        db.routine_exercise.edit_routine_exercise(2, warmup_schema=warmup_id)
+
+        with instrumentation.StatementBudget(4, strict=True):
+            routine = db.routine.get_routine_tree(1)
+
+        days = db.routine_day.get_days_by_routine_id(1)
+        assert [d.id for d in routine.days] == [d.id for d in days]
+        assert [d.day_idx for d in routine.days] == list(range(len(days)))
+        exercises = routine.days[0].exercises
+        assert [e.id for e in exercises] == [1, 2, 3, 4]
+        assert [e.exercise.exercise_name for e in exercises] == [
+            db.exercise.get_exercise_by_id(e.exercise_id).exercise_name
+            for e in exercises
+        ]
+        assert exercises[0].warmup is None
+        assert [s.num_reps for s in exercises[1].warmup.sets] == [10, 5]
+        assert db.routine.get_routine_tree(1000) is None
+
+        with instrumentation.StatementBudget(8, strict=True):
+            clone = db.routine.clone_routine(1, 1)
+        assert "message" in db.routine.clone_routine(1, 2)
+
+        copy = db.routine.get_routine_tree(clone.id)
+        assert copy.user_id == 1
+        assert copy.is_current is False
+        assert copy.is_public is False
+        assert [d.routine_day_name for d in copy.days] == [
+            d.routine_day_name for d in routine.days
+        ]
+        assert [d.day_idx for d in copy.days] == list(range(len(days)))
+        copied = copy.days[0].exercises
+        assert [e.exercise_id for e in copied] == [e.exercise_id for e in exercises]
+        assert copied[1].warmup.id != warmup_id
+        assert [s.num_reps for s in copied[1].warmup.sets] == [10, 5]
+        assert copied[0].warmup is None
+
+        db.routine_exercise.edit_routine_exercise(2, warmup_schema=None)
+
 
 class TestExerciseLog:
     def test_add_exercise_log(self, db):
@@ -727,6 +1033,130 @@ class TestExerciseLog:
 
         assert len(logs) == 3
 
+    def test_add_exercise_log_set_idx(self, db):
+        time_stamp = datetime(2020, 1, 1, 12)
+        first = db.exercise_log.add_log(2, time_stamp, 10)
+        second = db.exercise_log.add_log(2, time_stamp + timedelta(minutes=5), 10)
+        next_day = db.exercise_log.add_log(2, time_stamp + timedelta(days=1), 10)
+
+        assert (first.set_idx, second.set_idx, next_day.set_idx) == (0, 1, 0)
+        assert second.time_stamp == time_stamp + timedelta(minutes=5)
+
+    def test_add_exercise_logs(self, db):
+        time_stamp = datetime(2021, 1, 1, 12)
+        logs = [
+            {"routine_exercise_id": 1, "time_stamp": time_stamp, "num_reps": 10},
+            {
+                "routine_exercise_id": 2,
+                "time_stamp": time_stamp + timedelta(minutes=1),
+                "time_duration": 30.5,
+            },
+            {
+                "routine_exercise_id": 1,
+                "time_stamp": time_stamp - timedelta(minutes=2),
+                "num_reps": 8,
+            },
+        ]
+        db.exercise_log.add_log(2, time_stamp - timedelta(minutes=10), 10)
+
+        ids = db.exercise_log.add_logs(logs)
+        added = [db.exercise_log.get_exercise_log_by_id(id) for id in ids]
+
+        assert [log.routine_exercise_id for log in added] == [1, 2, 1]
+        assert [log.set_idx for log in added] == [1, 1, 0]
+        assert added[1].time_duration == 30.5
+        assert added[2].num_reps == 8
+
+    def test_add_exercise_logs_concurrently(self, db):
+        time_stamp = datetime(2022, 3, 1, 12)
+        logs = [
+            {
+                "routine_exercise_id": 1,
+                "time_stamp": time_stamp + timedelta(minutes=i),
+            }
+            for i in range(5)
+        ]
+        barrier = threading.Barrier(2)
+
+        def upload():
+            barrier.wait()
+            return db.exercise_log.add_logs(logs)
+
+        with ThreadPoolExecutor(2) as executor:
+            uploads = list(executor.map(lambda _: upload(), range(2)))
+
+        ids = uploads[0] + uploads[1]
+        added = [db.exercise_log.get_exercise_log_by_id(id) for id in ids]
+        assert sorted(log.set_idx for log in added) == list(range(10))
+        with pytest.raises(IntegrityError):
+            with db.Session() as session:
+                session.add(
+                    common.ExerciseLog(
+                        routine_exercise_id=1, time_stamp=time_stamp, set_idx=0
+                    )
+                )
+                session.commit()
+
+    def test_get_exercise_logs_by_user_plan(self, db):
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            statements.append((statement, parameters))
+
+        event.listen(db.engine, "before_cursor_execute", capture)
+        try:
+            db.exercise_log.get_exercise_logs_by_user(
+                1, after=(datetime(2021, 1, 1), 1), limit=2
+            )
+        finally:
+            event.remove(db.engine, "before_cursor_execute", capture)
+        statement, parameters = statements[-1]
+        with db.engine.connect() as connection:
+            plan = [
+                row[3]
+                for row in connection.exec_driver_sql(
+                    f"EXPLAIN QUERY PLAN {statement}", parameters
+                )
+            ]
+
+        # one range of the user's index, already in page order
+        assert plan == [
+            "SEARCH exercise_log USING INDEX ix_exercise_log_user_id_time_stamp "
+            "(user_id=? AND time_stamp>?)"
+        ]
+
+    def test_add_exercise_logs_other_user(self, db):
+        logs = [{"routine_exercise_id": 1, "time_stamp": datetime.utcnow()}]
+
+        result = db.exercise_log.add_logs(logs, user_id=2)
+
+        assert isinstance(result, dict)
+        assert isinstance(result.get("message"), str)
+
+    def test_get_exercise_logs_by_user_pages(self, db):
+        all_logs = db.exercise_log.get_exercise_logs_by_user(1)
+        pages, after = [], None
+        while True:
+            page = db.exercise_log.get_exercise_logs_by_user(1, after=after, limit=2)
+            if len(page) == 0:
+                break
+            pages.append(page)
+            after = (page[-1].time_stamp, page[-1].id)
+        window = db.exercise_log.get_exercise_logs_by_user(
+            1, start_time=datetime(2021, 1, 1), end_time=datetime(2021, 1, 2)
+        )
+        routine_id = db.routine.get_all_user_routines(1)[0].id
+
+        assert [log.id for page in pages for log in page] == [
+            log.id for log in all_logs
+        ]
+        assert all(len(page) <= 2 for page in pages)
+        assert all_logs == sorted(all_logs, key=lambda log: (log.time_stamp, log.id))
+        assert [log.time_stamp.date() for log in window] == [
+            datetime(2021, 1, 1).date()
+        ] * 4
+        assert db.exercise_log.get_exercise_logs_by_routine(routine_id, user_id=2) == []
+
     def test_get_exercise_logs_by_routine_exercise_id(self, db):
         logs = db.exercise_log.get_exercise_logs_by_routine_exercise_id(1)
 
@@ -785,12 +1215,301 @@ class TestExerciseLog:
 
         assert log.num_reps == 9
 
+    def test_edit_exercise_log_clash(self, db):
+        time_stamp = datetime(2023, 5, 1, 12)
+        first = db.exercise_log.add_log(1, time_stamp, 10)
+        second = db.exercise_log.add_log(1, time_stamp, 8)
+
+        clash = db.exercise_log.edit_exercise_log(second.id, set_idx=first.set_idx)
+
+        assert "message" in clash
+        assert db.exercise_log.get_exercise_log_by_id(second.id).set_idx == (
+            second.set_idx
+        )
+        db.exercise_log.delete_exercise_log_by_id(first.id)
+        db.exercise_log.delete_exercise_log_by_id(second.id)
+
     def test_get_exercise_log_by_routine_exercise(self, db):
         logs = db.exercise_log.get_exercise_logs_by_routine_exercise(1)
         for log in logs:
             assert log.routine_exercise_id == 1
 
 
+class TestWorkoutSession:
+    def test_add_log_joins_session(self, db):
+        start = datetime(2023, 3, 1, 18)
+        first = db.exercise_log.add_log(1, start, 10)
+        second = db.exercise_log.add_log(2, start + timedelta(minutes=50), 8)
+        third = db.exercise_log.add_log(1, start + timedelta(minutes=100), 6)
+        later = db.exercise_log.add_log(1, start + timedelta(hours=5), 5)
+
+        workout_session = db.workout_session.get_workout_session_by_id(
+            first.workout_session_id
+        )
+
+        assert first.workout_session_id == second.workout_session_id
+        assert third.workout_session_id == first.workout_session_id
+        assert later.workout_session_id != first.workout_session_id
+        assert workout_session.start_time == start
+        assert workout_session.end_time == start + timedelta(minutes=100)
+        assert (workout_session.num_sets, workout_session.total_reps) == (3, 24)
+
+    def test_get_workout_sessions_by_user(self, db):
+        workout_sessions = db.workout_session.get_workout_sessions_by_user(
+            1, datetime(2023, 3, 1), datetime(2023, 3, 2)
+        )
+        logs = db.workout_session.get_exercise_logs_by_workout_session(
+            workout_sessions[0].id
+        )
+
+        assert [w.num_sets for w in workout_sessions] == [3, 1]
+        assert [log.num_reps for log in logs] == [10, 8, 6]
+
+    def test_edit_and_delete_refresh_session(self, db):
+        workout_session = db.workout_session.get_workout_sessions_by_user(
+            1, datetime(2023, 3, 1), datetime(2023, 3, 2)
+        )[0]
+        logs = db.workout_session.get_exercise_logs_by_workout_session(
+            workout_session.id
+        )
+
+        db.exercise_log.edit_exercise_log(logs[0].id, num_reps=20)
+        db.exercise_log.delete_exercise_log_by_id(logs[2].id)
+        workout_session = db.workout_session.get_workout_session_by_id(
+            workout_session.id
+        )
+
+        assert (workout_session.num_sets, workout_session.total_reps) == (2, 28)
+        assert workout_session.end_time == logs[1].time_stamp
+
+    def test_bridging_set_merges_sessions(self, tmp_path):
+        db = Syfit(f"sqlite:///{tmp_path / 'merge.db'}", reset_db=True)
+        routine = db.routine.add_routine(1, "MERGE ROUTINE", 1)
+        day = db.routine_day.add_routine_day(routine.id, "MERGE DAY", "mon")
+        exercise = db.exercise.add_exercise(
+            "merge press", "syfit.test", "chest", None, "reps"
+        )
+        routine_exercise_id = db.routine_exercise.add_routine_exercise(
+            day.id, exercise.id
+        ).id
+        start = datetime(2023, 5, 1, 10)
+        for hours in [0, 2, 5, 7]:
+            db.exercise_log.add_log(routine_exercise_id, start + timedelta(hours=hours))
+        assert len(db.workout_session.get_workout_sessions_by_user(1)) == 4
+
+        # one set between the first two, a batch between the last two
+        bridge = db.exercise_log.add_log(
+            routine_exercise_id, start + timedelta(hours=1)
+        )
+        db.exercise_log.add_logs(
+            [
+                {
+                    "routine_exercise_id": routine_exercise_id,
+                    "time_stamp": start + timedelta(hours=hours),
+                }
+                for hours in [6, 5.5]
+            ]
+        )
+
+        workout_sessions = db.workout_session.get_workout_sessions_by_user(1)
+        assert [(w.start_time, w.end_time, w.num_sets) for w in workout_sessions] == [
+            (start, start + timedelta(hours=2), 3),
+            (start + timedelta(hours=5), start + timedelta(hours=7), 4),
+        ]
+        assert bridge.workout_session_id == workout_sessions[0].id
+        logs = db.workout_session.get_exercise_logs_by_workout_session(
+            workout_sessions[1].id
+        )
+        assert len(logs) == 4
+
+    def test_deletes_refresh_sessions(self, tmp_path):
+        db = Syfit(f"sqlite:///{tmp_path / 'deletes.db'}", reset_db=True)
+        user = db.user.add_user(
+            User(
+                first_name="Delete",
+                last_name="User",
+                username="deleteuser",
+                email="delete@test.com",
+                password=password_context.hash("deletepassword"),
+                DOB=date(2000, 1, 1),
+                measurement_system="metric",
+            )
+        )
+        exercise = db.exercise.add_exercise(
+            "delete row", "syfit.test", "back", None, "reps"
+        )
+        routine_exercise_ids = []
+        for name in ["FIRST", "SECOND"]:
+            routine = db.routine.add_routine(user.id, name, 2)
+            for day_name in ["PUSH", "PULL"]:
+                day = db.routine_day.add_routine_day(routine.id, day_name, "mon")
+                for _ in range(2):
+                    routine_exercise_ids.append(
+                        db.routine_exercise.add_routine_exercise(
+                            day.id, exercise.id
+                        ).id
+                    )
+        start = datetime(2023, 6, 1, 10)
+        db.exercise_log.add_logs(
+            [
+                {
+                    "routine_exercise_id": id,
+                    "time_stamp": start + timedelta(minutes=n),
+                    "num_reps": 1,
+                }
+                for n, id in enumerate(routine_exercise_ids)
+            ]
+        )
+
+        def sessions():
+            return [
+                (w.num_sets, w.total_reps, w.end_time - start)
+                for w in db.workout_session.get_workout_sessions_by_user(user.id)
+            ]
+
+        assert sessions() == [(8, 8, timedelta(minutes=7))]
+        db.routine_exercise.delete_exercise_by_id(routine_exercise_ids[7])
+        assert sessions() == [(7, 7, timedelta(minutes=6))]
+        db.routine_day.delete_day_by_id(day.id)
+        assert sessions() == [(6, 6, timedelta(minutes=5))]
+        db.routine.delete_routine(routine.id)
+        assert sessions() == [(4, 4, timedelta(minutes=3))]
+        db.user.delete_user(user.id)
+        assert sessions() == []
+        assert db.exercise_log.get_exercise_logs_by_user(user.id) == []
+
+
+class TestToday:
+    def test_get_today(self, tmp_path):
+        db = Syfit(f"sqlite:///{tmp_path / 'today.db'}", reset_db=True)
+        user = add_today_user(db, "todayuser")
+        sunday = date(2024, 1, 7)
+        squat = db.exercise.add_exercise(
+            "today squat", "x", "upper_legs", None, "reps"
+        )
+        routine = db.routine.add_routine(user.id, "TODAY", 2)
+        legs = db.routine_day.add_routine_day(routine.id, "LEGS", "sun")
+        db.routine_day.add_routine_day(routine.id, "REST", "mon")
+        first = db.routine_exercise.add_routine_exercise(legs.id, squat.id)
+        second = db.routine_exercise.add_routine_exercise(legs.id, squat.id)
+        for start, reps in [
+            (datetime(2024, 1, 1, 9), 8),
+            (datetime(2024, 1, 5, 9), 10),
+        ]:
+            db.exercise_log.add_logs(
+                [
+                    {
+                        "routine_exercise_id": first.id,
+                        "time_stamp": start + timedelta(minutes=n),
+                        "num_reps": reps,
+                    }
+                    for n in range(3)
+                ]
+            )
+
+        with instrumentation.StatementBudget(4, strict=True):
+            projection = db.routine.get_today(1, sunday)
+
+        assert projection["routine"]["id"] == routine.id
+        assert [d["routine_day_name"] for d in projection["days"]] == ["LEGS"]
+        exercises = projection["days"][0]["exercises"]
+        assert [e["id"] for e in exercises] == [first.id, second.id]
+        assert exercises[0]["exercise"]["exercise_name"] == "today squat"
+        assert [s["num_reps"] for s in exercises[0]["last_sets"]] == [10, 10, 10]
+        assert exercises[1]["last_sets"] == []
+
+        # served from the cache, after one version lookup, until a write
+        # touches the rows it came from
+        with instrumentation.StatementBudget(1, strict=True):
+            assert db.routine.get_today(1, sunday) == projection
+        other_routine = db.routine.add_routine(2, "OTHER USER", 1)
+        db.routine_day.add_routine_day(other_routine.id, "OTHER DAY", "sun")
+        cached = db.routine.get_today(1, sunday)
+        assert cached == projection
+        # callers get a copy, the cache can't be changed through it
+        cached["days"].clear()
+        assert db.routine.get_today(1, sunday) == projection
+
+        db.exercise_log.add_log(second.id, datetime(2024, 1, 6, 9), 5)
+        projection = db.routine.get_today(1, sunday)
+        assert [s["num_reps"] for s in exercises_of(projection)[1]["last_sets"]] == [5]
+
+        db.exercise.edit_exercise(squat.id, exercise_name="today front squat")
+        projection = db.routine.get_today(1, sunday)
+        assert exercises_of(projection)[0]["exercise"]["exercise_name"] == (
+            "today front squat"
+        )
+
+        db.routine_exercise.move_exercise(first.id)
+        assert [e["id"] for e in exercises_of(db.routine.get_today(1, sunday))] == [
+            second.id,
+            first.id,
+        ]
+
+        db.routine_day.edit_routine_day(legs.id, day_of_week="mon")
+        assert db.routine.get_today(1, sunday)["days"] == []
+
+        other = db.routine.add_routine(1, "SWITCHED", 1, is_current=True)
+        assert db.routine.get_today(1, sunday)["routine"]["id"] == other.id
+        # one entry per user, for the latest day asked for
+        assert db.routine.get_today(1, date(2024, 1, 9))["days"] == []
+
+    def test_today_sees_other_workers_writes(self, tmp_path):
+        db = Syfit(f"sqlite:///{tmp_path / 'today.db'}", reset_db=True)
+        user = add_today_user(db, "todayuser")
+        first = db.routine.add_routine(user.id, "FIRST", 1, is_current=True)
+        second = db.routine.add_routine(user.id, "SECOND", 1)
+        assert db.routine.get_today(user.id)["routine"]["id"] == first.id
+
+        # another worker shares the database but not this process's cache
+        subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "from src.database.syfit import Syfit; "
+                f"Syfit({str(db.engine.url)!r}).routine"
+                f".make_routine_current({second.id})",
+            ],
+            cwd=Path(__file__).parent.parent,
+            check=True,
+        )
+
+        assert db.routine.get_today(user.id)["routine"]["id"] == second.id
+
+    def test_today_cache_is_bounded(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(today, "MAX_ENTRIES", 2)
+        db = Syfit(f"sqlite:///{tmp_path / 'today.db'}", reset_db=True)
+        users = [add_today_user(db, f"todayuser{n}") for n in range(3)]
+        for user in users:
+            db.routine.get_today(user.id)
+        db.routine.get_today(users[1].id)
+        db.routine.get_today(users[2].id)
+
+        database = today.database_key(db.engine)
+        assert list(today._entries) == [
+            (database, users[1].id),
+            (database, users[2].id),
+        ]
+
+
+def add_today_user(db: Syfit, username: str) -> User:
+    return db.user.add_user(
+        User(
+            first_name="Today",
+            last_name="User",
+            username=username,
+            email=f"{username}@test.com",
+            password=password_context.hash("todaypassword"),
+            DOB=date(2000, 1, 1),
+            measurement_system="metric",
+        )
+    )
+
+
+def exercises_of(projection: dict) -> list[dict]:
+    return [e for d in projection["days"] for e in d["exercises"]]
+
+
 class TestDelete:
     __test__ = False
 
@@ -938,3 +1657,492 @@ class TestDelete:
 
         for n, log in enumerate(logs):
             assert log.set_idx == n
+
+
+class TestSyfit:
+    def test_interfaces_share_engine(self, db):
+        conn_string = str(db.engine.url)
+        other_db = Syfit(conn_string)
+
+        assert other_db.engine is db.engine
+        assert db.user.engine is db.engine
+        assert db.exercise_log.engine is db.engine
+        assert other_db.measurement.Session is db.Session
+
+    def test_unit_of_work_shares_session(self, db):
+        with db.unit_of_work() as session:
+            assert db.user.Session() is session
+            assert db.exercise_log.Session() is session
+
+            routine = db.routine.add_routine(1, "UOW ROUTINE", 2)
+            day = db.routine_day.add_routine_day(routine.id, "UOW DAY", "mon")
+
+            # not committed yet, so invisible outside the unit of work
+            connection = db.engine.connect()
+            assert (
+                connection.execute(
+                    common.RoutineDay.__table__.select().where(
+                        common.RoutineDay.id == day.id
+                    )
+                ).first()
+                is None
+            )
+            connection.close()
+
+        assert db.user.Session() is not session
+        assert db.routine_day.get_routine_day_by_id(day.id) is not None
+
+        db.routine.delete_routine(routine.id)
+        db.routine_day.delete_day_by_id(day.id)
+
+    def test_unit_of_work_rolls_back(self, db):
+        try:
+            with db.unit_of_work():
+                routine = db.routine.add_routine(1, "ROLLBACK ROUTINE", 2)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+
+        assert db.routine.get_routine_by_id(routine.id) is None
+
+    def test_unit_of_work_keeps_writes_before_expected_error(self, db):
+        def new_user():
+            return User(
+                first_name="Savepoint",
+                last_name="User",
+                username="savepointuser",
+                email="savepoint@test.com",
+                password=password_context.hash("testpassword"),
+                DOB=date(1990, 1, 1),
+                measurement_system="metric",
+            )
+
+        user = db.user.add_user(new_user())
+        username = user.username
+        with db.unit_of_work():
+            routine = db.routine.add_routine(user.id, "SAVEPOINT ROUTINE", 2)
+            duplicate = db.user.add_user(new_user())
+            with pytest.raises(ValueError):
+                db.measurement.change_measurement_system(-1)
+
+        assert duplicate == {"message": f"username {username} already exists!"}
+        assert db.routine.get_routine_by_id(routine.id) is not None
+
+        db.routine.delete_routine(routine.id)
+        db.user.delete_user(user.id)
+
+    def test_unit_of_work_refuses_commit_after_rollback(self, db):
+        with pytest.raises(InvalidRequestError):
+            with db.unit_of_work() as session:
+                routine = db.routine.add_routine(1, "ROLLED BACK ROUTINE", 2)
+                session.rollback()
+                after = db.routine.add_routine(1, "AFTER ROLLBACK ROUTINE", 2)
+
+        assert db.routine.get_routine_by_id(routine.id) is None
+        assert db.routine.get_routine_by_id(after.id) is None
+
+    def test_tuning_settings(self, db):
+        settings = db.get_tuning_settings()
+        active = settings["active"]
+        configured = settings["configured"]
+
+        assert configured == tuning.get_settings()
+        assert active["busy_timeout"] == configured["busy_timeout"]
+        assert active["journal_mode"].upper() == configured["journal_mode"]
+
+    def test_tuning_presets(self):
+        config.config["DATABASE_TUNING"] = {"PRESET": "balanced", "SYNCHRONOUS": "full"}
+        try:
+            settings = tuning.get_settings()
+        finally:
+            config.config.remove_section("DATABASE_TUNING")
+
+        assert settings["journal_mode"] == "WAL"
+        assert settings["synchronous"] == "FULL"
+
+        with pytest.raises(ValueError):
+            tuning.validate_pragma("synchronous", "sometimes")
+
+    def test_async_syfit(self, db):
+        async_db = AsyncSyfit(str(db.engine.url))
+
+        async def add_and_read():
+            async with async_db.unit_of_work():
+                routine = await async_db.routine.add_routine(1, "ASYNC ROUTINE", 1)
+                day = await async_db.routine_day.add_routine_day(
+                    routine.id, "ASYNC DAY", "sat"
+                )
+            read_day = await async_db.routine_day.get_routine_day_by_id(day.id)
+            return routine, day, read_day
+
+        routine, day, read_day = asyncio.run(add_and_read())
+
+        assert read_day.routine_id == routine.id
+        assert db.routine_day.get_routine_day_by_id(day.id).day_of_week == "sat"
+
+        db.routine_day.delete_day_by_id(day.id)
+        db.routine.delete_routine(routine.id)
+
+    def test_migrate_baseline_database(self, tmp_path):
+        old_db = Syfit(f"sqlite:///{tmp_path / 'baseline.db'}")
+        schema = (Path(__file__).parent / "baseline_schema.sql").read_text()
+        with old_db.engine.connect() as connection:
+            connection.connection.driver_connection.executescript(schema)
+        with old_db.engine.begin() as connection:
+            for statement in [
+                "INSERT INTO app_user (id, first_name, last_name, username, email, "
+                "password, DOB, measurement_system) VALUES (1, 'Old', 'User', "
+                "'olduser', 'old@test.com', 'oldpassword', '2000-01-01', 'imperial')",
+                "INSERT INTO exercise (id, exercise_name) VALUES (1, 'old press')",
+                "INSERT INTO routine (id, routine_name, user_id, is_current) "
+                "VALUES (1, 'FIRST', 1, 1), (2, 'SECOND', 1, 1)",
+                "INSERT INTO routine_day (id, routine_id, day_idx) "
+                "VALUES (1, 1, 1), (2, 1, 0)",
+                "INSERT INTO routine_exercise (id, exercise_id, day_id, exercise_idx) "
+                "VALUES (1, 1, 1, 0)",
+                "INSERT INTO exercise_log (routine_exercise_id, time_stamp, set_idx, "
+                "num_reps) VALUES (1, '2020-01-01 10:00:00', 0, 8), "
+                "(1, '2020-01-01 10:30:00', 1, 6), (1, '2020-01-01 14:00:00', 0, 5)",
+                "INSERT INTO measurement (measurement_time, user_id, height, "
+                "body_weight) VALUES ('2020-01-01 07:00:00', 1, 70, 180)",
+            ]:
+                connection.exec_driver_sql(statement)
+
+        assert old_db.migrate() == sorted(migrations.MIGRATIONS)
+        assert old_db.migrate() == []
+
+        # the migrated schema is the one the models build
+        inspector = inspect(old_db.engine)
+        for table in common.Base.metadata.sorted_tables:
+            columns = {c["name"] for c in inspector.get_columns(table.name)}
+            indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+            assert columns == set(table.columns.keys())
+            assert indexes == {i.name for i in table.indexes}
+
+        days = old_db.routine_day.get_days_by_routine_id(1)
+        assert [d.id for d in days] == [2, 1]
+        assert old_db.routine.get_current_routine(1).id == 2
+        sessions = old_db.workout_session.get_workout_sessions_by_user(1)
+        assert sorted(s.num_sets for s in sessions) == [1, 2]
+        assert len(old_db.exercise_log.get_exercise_logs_by_user(1)) == 3
+        measurement = old_db.measurement.get_latest_measurement_by_user(1)
+        assert measurement.height == pytest.approx(70)
+        assert measurement.body_weight == pytest.approx(180)
+
+    def test_migrate_backfills_workout_sessions(self, tmp_path):
+        old_db = Syfit(f"sqlite:///{tmp_path / 'sessions.db'}", reset_db=True)
+        routine = old_db.routine.add_routine(1, "OLD ROUTINE", 1)
+        day = old_db.routine_day.add_routine_day(routine.id, "OLD DAY", "mon")
+        routine_exercise = old_db.routine_exercise.add_routine_exercise(day.id, 1)
+        start = datetime(2022, 1, 1, 9)
+        offsets = [0, 30, 85, 200, 210, 24 * 60]
+        old_db.exercise_log.add_logs(
+            [
+                {
+                    "routine_exercise_id": routine_exercise.id,
+                    "time_stamp": start + timedelta(minutes=minutes),
+                    "num_reps": 10,
+                }
+                for minutes in offsets
+            ]
+        )
+        with old_db.engine.begin() as connection:
+            # the exercise_log table as it was before workout sessions
+            for statement in [
+                "CREATE TABLE old_log AS SELECT id, routine_exercise_id, "
+                "time_stamp, set_idx, num_reps, time_duration FROM exercise_log",
+                "DROP TABLE exercise_log",
+                "ALTER TABLE old_log RENAME TO exercise_log",
+                "DROP TABLE workout_session",
+                "DELETE FROM schema_version WHERE version >= 2",
+            ]:
+                connection.exec_driver_sql(statement)
+
+        assert old_db.migrate() == [2, 3, 4, 5, 6, 7, 8]
+
+        workout_sessions = old_db.workout_session.get_workout_sessions_by_user(1)
+        assert [w.num_sets for w in workout_sessions] == [3, 2, 1]
+        assert [w.total_reps for w in workout_sessions] == [30, 20, 10]
+        assert workout_sessions[0].start_time == start
+        assert workout_sessions[0].end_time == start + timedelta(minutes=85)
+        logs = old_db.workout_session.get_exercise_logs_by_workout_session(
+            workout_sessions[1].id
+        )
+        assert [log.time_stamp for log in logs] == [
+            start + timedelta(minutes=200),
+            start + timedelta(minutes=210),
+        ]
+
+    def test_migrate_sort_keys(self, tmp_path):
+        old_db = Syfit(f"sqlite:///{tmp_path / 'order.db'}", reset_db=True)
+        routine = old_db.routine.add_routine(1, "OLD ROUTINE", 3)
+        ids = [
+            old_db.routine_day.add_routine_day(routine.id, f"DAY {n}", "mon").id
+            for n in range(3)
+        ]
+        with old_db.engine.begin() as connection:
+            # the routine_day table as it was before sort keys, in reverse order
+            for statement in [
+                "CREATE TABLE old_day AS SELECT id, routine_id, 10 - id AS day_idx, "
+                "routine_day_name, day_of_week FROM routine_day",
+                "DROP TABLE routine_day",
+                "ALTER TABLE old_day RENAME TO routine_day",
+                "CREATE INDEX ix_routine_day_routine_id_day_idx "
+                "ON routine_day (routine_id, day_idx)",
+                "DELETE FROM schema_version WHERE version >= 3",
+            ]:
+                connection.exec_driver_sql(statement)
+
+        assert old_db.migrate() == [3, 4, 5, 6, 7, 8]
+
+        days = old_db.routine_day.get_days_by_routine_id(routine.id)
+        assert [d.id for d in days] == ids[::-1]
+        assert [d.day_idx for d in days] == [0, 1, 2]
+        assert [d.sort_key for d in days] == [0, ordering.STEP, 2 * ordering.STEP]
+        index_names = {
+            i["name"] for i in inspect(old_db.engine).get_indexes("routine_day")
+        }
+        assert index_names == {"ix_routine_day_routine_id_sort_key"}
+
+    def test_migrate_current_routine_index(self, tmp_path):
+        old_db = Syfit(f"sqlite:///{tmp_path / 'current.db'}", reset_db=True)
+        first = old_db.routine.add_routine(1, "FIRST", 3)
+        second = old_db.routine.add_routine(1, "SECOND", 3)
+        with old_db.engine.begin() as connection:
+            for statement in [
+                "DROP INDEX ix_routine_user_id_is_current",
+                "UPDATE routine SET is_current = 1",
+                "DELETE FROM schema_version WHERE version >= 4",
+            ]:
+                connection.exec_driver_sql(statement)
+
+        assert old_db.migrate() == [4, 5, 6, 7, 8]
+
+        assert old_db.routine.get_current_routine(1).id == second.id
+        assert old_db.routine.get_routine_by_id(first.id).is_current is False
+
+    def test_migrate_measurements_to_metric(self, tmp_path):
+        old_db = Syfit(f"sqlite:///{tmp_path / 'units.db'}", reset_db=True)
+        user = old_db.user.add_user(
+            User(
+                first_name="Old",
+                last_name="User",
+                username="olduser",
+                email="old@test.com",
+                password=password_context.hash("oldpassword"),
+                DOB=date(2000, 1, 1),
+                measurement_system="imperial",
+            )
+        )
+        old_db.measurement.add_measurement(user.id, None, height=70, body_weight=180)
+        with old_db.engine.begin() as connection:
+            # measurements as they were stored, in the user's own units
+            for statement in [
+                "UPDATE measurement SET height = 70, body_weight = 180",
+                "DELETE FROM schema_version WHERE version >= 5",
+            ]:
+                connection.exec_driver_sql(statement)
+
+        assert old_db.migrate() == [5, 6, 7, 8]
+
+        measurement = old_db.measurement.get_latest_measurement_by_user(user.id)
+        assert measurement.height == pytest.approx(70)
+        assert measurement.body_weight == pytest.approx(180)
+
+    def test_migrate_unique_set_index(self, tmp_path):
+        old_db = Syfit(f"sqlite:///{tmp_path / 'sets.db'}", reset_db=True)
+        routine = old_db.routine.add_routine(1, "OLD ROUTINE", 1)
+        day = old_db.routine_day.add_routine_day(routine.id, "OLD DAY", "mon")
+        exercise = old_db.exercise.add_exercise(
+            "old curl", "syfit.test", "biceps", None, "reps"
+        )
+        routine_exercise = old_db.routine_exercise.add_routine_exercise(
+            day.id, exercise.id
+        )
+        time_stamp = datetime(2020, 1, 1, 10)
+        ids = old_db.exercise_log.add_logs(
+            [
+                {"routine_exercise_id": routine_exercise.id, "time_stamp": time_stamp}
+                for _ in range(3)
+            ]
+        )
+        with old_db.engine.begin() as connection:
+            # as left by two uploads that read the same max
+            for statement in [
+                "DROP INDEX ix_exercise_log_routine_exercise_id_time_stamp",
+                f"UPDATE exercise_log SET set_idx = 0 WHERE id = {ids[1]}",
+                "DELETE FROM schema_version WHERE version >= 6",
+            ]:
+                connection.exec_driver_sql(statement)
+
+        assert old_db.migrate() == [6, 7, 8]
+
+        logs = [old_db.exercise_log.get_exercise_log_by_id(id) for id in ids]
+        assert [log.set_idx for log in logs] == [0, 3, 2]
+        index = next(
+            i
+            for i in inspect(old_db.engine).get_indexes("exercise_log")
+            if i["name"] == "ix_exercise_log_routine_exercise_id_time_stamp"
+        )
+        assert index["unique"]
+
+    def test_new_database_is_stamped(self, db):
+        assert db.migrate() == []
+
+    def test_create_tables_keeps_old_database_unstamped(self, tmp_path):
+        old_db = Syfit(f"sqlite:///{tmp_path / 'baseline.db'}")
+        schema = (Path(__file__).parent / "baseline_schema.sql").read_text()
+        with old_db.engine.connect() as connection:
+            connection.connection.driver_connection.executescript(schema)
+
+        old_db.create_tables()
+
+        assert old_db.migrate() == sorted(migrations.MIGRATIONS)
+        columns = {c["name"] for c in inspect(old_db.engine).get_columns("routine_day")}
+        assert "sort_key" in columns
+        assert "day_idx" not in columns
+
+    def test_instrumentation(self, db):
+        with instrumentation.track("test") as stats:
+            db.exercise_log.add_log(1, datetime.utcnow(), 8)
+            db.measurement.get_latest_measurement_by_user(1)
+
+        assert stats.count >= 2
+        assert stats.methods["exercise_log.Interface.add_log"].count == 5
+        latest = stats.methods["measurement.Interface.get_latest_measurement_by_user"]
+        assert latest.count == 1
+        assert stats.slowest_statement is not None
+        assert instrumentation.snapshot()["routes"]["test"]["count"] >= stats.count
+
+    def test_failed_statements_leave_no_start_times(self, db):
+        with db.engine.connect() as connection:
+            for _ in range(3):
+                with pytest.raises(OperationalError):
+                    connection.exec_driver_sql("SELECT * FROM no_such_table")
+            assert "query_start_time" not in connection.info
+            assert connection.exec_driver_sql("SELECT 1").scalar() == 1
+
+
+class TestStatementBudgets:
+    @pytest.mark.parametrize(
+        "interface, method, args, kwargs, budget",
+        [
+            ("user", "get_user_by_id", (1,), {}, 1),
+            ("user", "get_user_by_username", ("testuser2023",), {}, 1),
+            ("measurement", "get_all_measurement_by_user", (1,), {}, 1),
+            ("measurement", "get_latest_measurement_by_user", (1,), {}, 1),
+            ("measurement", "add_measurement", (1, None), {"body_weight": 111}, 2),
+            ("measurement", "edit_measurement", (1,), {"body_weight": 125}, 2),
+            ("routine", "get_all_user_routines", (1,), {}, 1),
+            ("routine", "add_routine", (1, "BUDGET ROUTINE", 1), {}, 4),
+            ("routine_day", "get_days_by_routine_id", (1,), {}, 1),
+            ("routine_day", "add_routine_day", (1, "BUDGET DAY", "sat"), {}, 3),
+            ("routine_exercise", "get_exercises_by_routine_day_id", (1,), {}, 1),
+            ("routine_exercise", "add_routine_exercise", (1, 1), {}, 3),
+            ("exercise_log", "add_log", (1, datetime.utcnow(), 6), {}, 5),
+            (
+                "exercise_log",
+                "add_logs",
+                ([{"routine_exercise_id": 1, "time_stamp": datetime.utcnow()}] * 25,),
+                {"user_id": 1},
+                6,
+            ),
+            ("exercise_log", "get_exercise_logs_by_user", (1,), {}, 1),
+            ("exercise_log", "get_exercise_logs_by_routine", (1,), {}, 1),
+            ("exercise_log", "get_exercise_logs_by_routine_day", (1,), {}, 1),
+        ],
+    )
+    def test_method_budget(self, db, interface, method, args, kwargs, budget):
+        with instrumentation.StatementBudget(budget, method, strict=True):
+            getattr(getattr(db, interface), method)(*args, **kwargs)
+
+    def test_reset_idxs_budget(self, db):
+        logs = db.exercise_log.get_exercise_logs_by_routine_exercise_id(1)
+        logs = sorted(logs, key=lambda log: (log.set_idx, log.id))
+        for n, log in enumerate(logs):
+            db.exercise_log.edit_exercise_log(log.id, set_idx=10 * n + 5)
+
+        with instrumentation.StatementBudget(1, strict=True):
+            db.routine_day.reset_day_idxs(1)
+        with instrumentation.StatementBudget(1, strict=True):
+            db.routine_exercise.reset_exercise_idxs(1)
+        # set indexes are unique, so they are parked on negative keys first
+        with instrumentation.StatementBudget(3, strict=True):
+            db.exercise_log.reset_set_idxs(1)
+
+        renumbered = {
+            log.id: log.set_idx
+            for log in db.exercise_log.get_exercise_logs_by_routine_exercise_id(1)
+        }
+        assert [renumbered[log.id] for log in logs] == list(range(len(logs)))
+
+    def test_make_routine_current_budget(self, db):
+        with instrumentation.StatementBudget(4, strict=True):
+            db.routine.make_routine_current(1)
+
+    def test_change_measurement_system_budget(self, db):
+        system = db.user.get_user_by_id(1).measurement_system
+
+        with instrumentation.StatementBudget(2, strict=True):
+            user = db.measurement.change_measurement_system(1)
+        assert user.measurement_system != system
+        with instrumentation.StatementBudget(2, strict=True):
+            user = db.measurement.change_measurement_system(1)
+        assert user.measurement_system == system
+
+    def test_budget_exceeded(self, db):
+        with pytest.raises(instrumentation.StatementBudgetExceeded):
+            with instrumentation.StatementBudget(1, strict=True):
+                db.user.get_user_by_id(1)
+                db.user.get_user_by_id(1)
+
+        @instrumentation.StatementBudget(1, strict=False)
+        def over_budget():
+            db.user.get_user_by_id(1)
+            return db.user.get_user_by_id(1)
+
+        assert over_budget().id == 1
+
+
+class TestExport:
+    def test_export_ndjson(self, db):
+        measurements = db.measurement.get_all_measurement_by_user(1)
+        logs = db.exercise_log.get_exercise_logs_by_user(1)
+
+        chunks = list(export.export(db.engine, 1, batch_size=2))
+        rows = [json.loads(line) for line in b"".join(chunks).decode().splitlines()]
+
+        assert len(chunks) > 3
+        assert [r["id"] for r in rows if r["table"] == "measurement"] == [
+            m.id for m in sorted(measurements, key=lambda m: (m.measurement_time, m.id))
+        ]
+        assert [r["id"] for r in rows if r["table"] == "exercise_log"] == [
+            log.id for log in logs
+        ]
+
+    def test_export_csv_gzip(self, db):
+        data = b"".join(
+            export.export(db.engine, 1, ["exercise_log"], "csv", compress=True)
+        )
+        rows = list(csv.DictReader(io.StringIO(gzip.decompress(data).decode())))
+
+        assert len(rows) == len(db.exercise_log.get_exercise_logs_by_user(1))
+        assert rows[0]["exercise_name"]
+
+    def test_export_csv_needs_one_table(self, db):
+        with pytest.raises(ValueError):
+            list(export.export(db.engine, 1, format="csv"))
+
+    def test_export_holds_no_lock_between_pages(self, db):
+        chunks = export.export(db.engine, 1, ["measurement"], batch_size=1)
+        next(chunks)
+        next(chunks)
+
+        # with a page still to come, a writer gets the database at once
+        connection = sqlite3.connect(db.engine.url.database, timeout=0)
+        try:
+            connection.execute("BEGIN EXCLUSIVE")
+            connection.rollback()
+        finally:
+            connection.close()
+        assert len(list(chunks)) > 1